@@ -24,34 +24,191 @@ Main module of the application performing fish counting.
 
 import argparse
 
-from fishcounter.display import DisplayManager
-from fishcounter.segment import (CompositeSegmentationAlgorithm,
-                                 MovingAverageBackgroundSubtractor,
-                                 MixtureOfGaussiansBackgroundSubtractor,
-                                 HSVColourSegmenter)
-from fishcounter.tracking.multistage import MultistageTracker
-from fishcounter.analyzer import Analyzer
-from fishcounter.videoreader import VideoReader
-
-
-def run(video_path, skip=0):
-    segmenter = CompositeSegmentationAlgorithm([
-        MovingAverageBackgroundSubtractor(0.05),
-        MixtureOfGaussiansBackgroundSubtractor(),
-        HSVColourSegmenter()])
-    display = DisplayManager("Fish Counter")
-    tracker = MultistageTracker()
-    analyzer = Analyzer(segmenter, tracker, display)
-    VideoReader(video_path, analyzer).start(skip)
+from fishcounter.chunking import count_in_chunks
+from fishcounter.checkpoint import (Checkpointer, CheckpointingAnalyzer,
+                                    restore_checkpoint)
+from fishcounter.framecache import FrameCache
+from fishcounter.pipeline import create_analyzer
+from fishcounter.sources import open_source, parse_frame_size
+from fishcounter.videoreader import (VideoReader, PrefetchingVideoReader,
+                                     BlockVideoReader, parse_timestamp)
+
+
+def run(video, skip=0, headless=False, prefetch=0, start_time=None,
+        end_time=None, scale=1.0, input_scale=1.0, ring_size=0,
+        cascade=False, segment_threads=0, show_timings=False,
+        colour_lut_dir=None, pyramid_levels=0, motion_gate=False,
+        tiles=None, checkpoint_path=None, checkpoint_interval=1000,
+        resume=False, block_size=0, optical_flow=False, edge_model=False):
+    analyzer = create_analyzer(headless, scale, input_scale, cascade,
+                               segment_threads, colour_lut_dir,
+                               pyramid_levels, motion_gate, tiles,
+                               offline_blocks=block_size > 0,
+                               optical_flow=optical_flow,
+                               edge_model=edge_model)
+
+    video_analyzer = analyzer
+    checkpointer = None
+    if checkpoint_path is not None:
+        checkpointer = Checkpointer(checkpoint_path)
+        video_analyzer = CheckpointingAnalyzer(analyzer, checkpointer,
+                                               checkpoint_interval)
+
+    if block_size > 0:
+        reader = BlockVideoReader(video, video_analyzer, headless=headless,
+                                  block_size=block_size)
+    elif prefetch > 0:
+        reader = PrefetchingVideoReader(video, video_analyzer,
+                                        headless=headless, depth=prefetch,
+                                        ring_size=ring_size)
+    else:
+        reader = VideoReader(video, video_analyzer, headless=headless,
+                             ring_size=ring_size)
+
+    if resume:
+        skip = restore_checkpoint(checkpoint_path, analyzer)
+    elif start_time is not None:
+        skip = reader.frame_at(start_time)
+
+    if checkpointer is not None:
+        video_analyzer.frame = skip
+
+    stop = None
+    if end_time is not None:
+        stop = reader.frame_at(end_time)
+
+    reader.start(skip, stop)
+    analyzer.close()
+    if checkpointer is not None:
+        checkpointer.wait()
+
+    if isinstance(reader, PrefetchingVideoReader) and headless:
+        print reader.stats
+
+    if show_timings:
+        print analyzer.segmenter.timing_report()
+
+    return analyzer.count
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("video", help="the video to analyze")
+    parser.add_argument("video",
+                        help="the video to analyze: a file, a .npy stack of "
+                             "frames, a camera index, a stream URL, or a "
+                             "file or FIFO of raw BGR frames ('-' for "
+                             "stdin) together with --raw")
+    parser.add_argument("--raw", type=parse_frame_size, metavar="WxH",
+                        help="read raw BGR frames of this size")
+    parser.add_argument("--live-buffer", type=int, default=1,
+                        help="frames kept for live sources, which drop the "
+                             "oldest frames when analysis falls behind")
     parser.add_argument("-s", "--skip", type=int, default=0,
-                        help="skip to start analyzing at a later frame")
+                        help="skip to start analyzing at a later frame "
+                             "(instead of --start)")
+    parser.add_argument("--start", type=parse_timestamp,
+                        help="time to start analyzing at, as [[HH:]MM:]SS")
+    parser.add_argument("--end", type=parse_timestamp,
+                        help="time to stop analyzing at, as [[HH:]MM:]SS")
+    parser.add_argument("--headless", action="store_true",
+                        help="don't display anything; just print the count")
+    parser.add_argument("-p", "--prefetch", type=int, default=0,
+                        help="decode up to this many frames ahead on a "
+                             "background thread")
+    parser.add_argument("--ring", type=int, default=0,
+                        help="decode into this many preallocated frame "
+                             "buffers instead of allocating every frame")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="process frames at this fraction of their "
+                             "original resolution, e.g. 0.5")
+    parser.add_argument("--cascade", action="store_true",
+                        help="only run the expensive segmenters where the "
+                             "cheap ones found something")
+    parser.add_argument("--segment-threads", type=int, default=0,
+                        help="run the segmenters concurrently on this many "
+                             "threads")
+    parser.add_argument("--pyramid", type=int, default=0, metavar="LEVELS",
+                        help="find fish in frames reduced this many times "
+                             "by an image pyramid, and only segment at full "
+                             "resolution around them")
+    parser.add_argument("--tiles", type=parse_frame_size,
+                        metavar="COLUMNSxROWS",
+                        help="segment large (e.g. 4K) frames in overlapping "
+                             "tiles on this many threads")
+    parser.add_argument("--block", type=int, default=0, metavar="FRAMES",
+                        help="for video files, compute the background for "
+                             "blocks of this many frames at once")
+    parser.add_argument("--edges", action="store_true",
+                        help="reject pixels without edges that the "
+                             "background lacks, such as water and tank "
+                             "texture")
+    parser.add_argument("--flow", action="store_true",
+                        help="only count fish which sparse optical flow "
+                             "sees moving")
+    parser.add_argument("--motion-gate", action="store_true",
+                        help="skip segmenting frames in which nothing "
+                             "changed, such as static overnight footage")
+    parser.add_argument("--colour-lut", metavar="DIR",
+                        help="classify colours with a lookup table instead "
+                             "of an HSV conversion, caching the table in "
+                             "this directory")
+    parser.add_argument("--checkpoint", metavar="PATH",
+                        help="periodically save the state of the analysis "
+                             "to this file")
+    parser.add_argument("--checkpoint-interval", type=int, default=1000,
+                        metavar="FRAMES",
+                        help="frames between checkpoints")
+    parser.add_argument("--resume", action="store_true",
+                        help="resume from the --checkpoint file")
+    parser.add_argument("--timings", action="store_true",
+                        help="print how long each segmenter took")
+    parser.add_argument("--cache-dir",
+                        help="decode the video once into a cache of raw "
+                             "frames in this directory, and reuse it on "
+                             "later runs")
+    parser.add_argument("--cache-size", type=float, default=20,
+                        help="size limit of the frame cache in GB")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="analyze the video in time chunks on this many "
+                             "processes (implies --headless)")
 
     args = parser.parse_args()
 
-    run(args.video, args.skip)
+    if args.resume and args.checkpoint is None:
+        parser.error("--resume needs a --checkpoint file")
+    if args.start is not None and args.skip > 0:
+        parser.error("--start and --skip can't be used together")
+
+    if args.processes > 0:
+        if args.cache_dir is not None:
+            parser.error("--cache-dir can't be used with --processes")
+
+        count = count_in_chunks(args.video, args.processes,
+                                scale=args.scale, skip=args.skip,
+                                start_time=args.start, end_time=args.end)
+    else:
+        if args.cache_dir is not None:
+            cache = FrameCache(args.cache_dir, int(args.cache_size * 1e9))
+            source = cache.open(args.video, args.scale)
+            input_scale = args.scale
+        else:
+            source = open_source(args.video, raw_size=args.raw,
+                                 buffer_size=args.live_buffer)
+            input_scale = 1.0
+
+        count = run(source, args.skip, args.headless, args.prefetch,
+                    args.start, args.end, args.scale, input_scale=input_scale,
+                    ring_size=args.ring, cascade=args.cascade,
+                    segment_threads=args.segment_threads,
+                    show_timings=args.timings,
+                    colour_lut_dir=args.colour_lut,
+                    pyramid_levels=args.pyramid,
+                    motion_gate=args.motion_gate, tiles=args.tiles,
+                    checkpoint_path=args.checkpoint,
+                    checkpoint_interval=args.checkpoint_interval,
+                    resume=args.resume, block_size=args.block,
+                    optical_flow=args.flow, edge_model=args.edges)
+
+    if args.headless or args.processes > 0:
+        print "Fish counted: %d" % count
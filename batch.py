@@ -0,0 +1,51 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Counts the fish in a batch of videos.
+"""
+
+import argparse
+
+from fishcounter.batch import run_batch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("videos",
+                        help="a directory of videos, or a glob pattern")
+    parser.add_argument("-o", "--output", default="summary.csv",
+                        help="the summary file to write; videos it already "
+                             "lists as successful are skipped")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="number of worker processes (default: one per "
+                             "core)")
+    parser.add_argument("-r", "--retries", type=int, default=1,
+                        help="extra attempts for a video which fails")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="process frames at this fraction of their "
+                             "original resolution")
+
+    args = parser.parse_args()
+
+    for row in run_batch(args.videos, args.output, args.processes,
+                         args.retries, args.scale):
+        print "%s: %s (%s)" % (row["video"], row["count"], row["status"])
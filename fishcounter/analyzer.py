@@ -25,34 +25,131 @@ tracking algorithms, display, etc.
 
 import cv2
 
-from components import find_connected_components
+from components import find_blobs
+from frame import Frame
+from motion import DUPLICATE, STATIC
+from segment import scaled_iterations
 
 
 class Analyzer(object):
-    def __init__(self, segmenter, tracker, display):
+    """
+    When headless, nothing is drawn or shown with HighGUI, so analysis can
+    run on machines without a display and faster than real time.  The
+    display may be None in that case.
+
+    Frames are resized by scale before being analyzed.  The segmenter and
+    tracker should be created with the same scale so that their pixel
+    thresholds match; bounding boxes are mapped back to full resolution
+    for display.  Frames which have already been resized, such as those
+    from a frame cache, arrive at input_scale.
+
+    With a motion_gate, frames in which nothing changed skip segmentation
+    and shape tracking: the segmenter's models are aged over them and only
+    the stationary objects are tracked.  Exact repeats of the previous
+    frame aren't tracked at all, though the models are still aged over
+    them so that they stay in step with the video.
+
+    With a tiler, the mask is cleaned up tile by tile on its threads.
+
+    Offline, a block of frames can be prepared with prepare_block before
+    they are analyzed in order.
+    """
+
+    def __init__(self, segmenter, tracker, display, headless=False,
+                 scale=1.0, input_scale=1.0, motion_gate=None, tiler=None):
         self.segmenter = segmenter
         self.tracker = tracker
         self.display = display
+        self.headless = headless
+        self.scale = scale
+        self.input_scale = input_scale
+        self.motion_gate = motion_gate
+        self.tiler = tiler
+
+        # Frames prepared by prepare_block, by the id of their image
+        self._prepared = {}
+
+        # TODO an algorithm to dynamically set threshold
+        self.contour_length_threshold = 200 * scale
+        self.close_iterations = scaled_iterations(15, scale)
+
+    @property
+    def count(self):
+        return self.tracker.count
+
+    def close(self):
+        self.segmenter.close()
+        if self.tiler is not None:
+            self.tiler.close()
+
+    def prepare_block(self, images):
+        """
+        Prepares a block of images which are about to be analyzed in
+        order, letting segmenters which can process a whole block at once
+        do so.
+        """
+        frames = [Frame(self._ingest(image)) for image in images]
+        if hasattr(self.segmenter, "segment_block"):
+            self.segmenter.segment_block(frames)
+
+        # The images are kept so that their ids can't be reused
+        self._prepared = dict((id(image), (image, frame))
+                              for image, frame in zip(images, frames))
 
     def analyze(self, previous_image, current_image):
-        segmented = self.segmenter.segment(current_image)
+        change = None
+        if self.motion_gate is not None:
+            change = self.motion_gate.classify(previous_image, current_image)
+
+        if change == DUPLICATE:
+            self.segmenter.age()
+            self.tracker.skip_frame()
+        elif change == STATIC:
+            self.segmenter.age()
+            self.tracker.track_stationary(self._frame_for(current_image))
+        else:
+            self._analyze_changed(current_image)
+
+        if not self.headless:
+            self._display_findings(current_image)
+
+    def _analyze_changed(self, current_image):
+        frame = self._frame_for(current_image)
+
+        segmented = self.segmenter.segment(frame)
 
         kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        # TODO an algorithm to dynamically set threshold
-        contours = find_connected_components(segmented, kernel, 200)
+        blobs = find_blobs(
+            segmented, kernel, self.contour_length_threshold,
+            headless=self.headless, close_iterations=self.close_iterations,
+            tiler=self.tiler)
+
+        self.tracker.track(frame, blobs)
 
-        self.tracker.track(current_image, contours)
+    def _frame_for(self, image):
+        prepared = self._prepared.pop(id(image), None)
+        if prepared is not None:
+            return prepared[1]
+        return Frame(self._ingest(image))
 
-        self._display_findings(current_image)
+    def _ingest(self, image):
+        resize = self.scale / self.input_scale
+        if resize == 1.0:
+            return image
+
+        return cv2.resize(image, None, fx=resize, fy=resize,
+                          interpolation=cv2.INTER_AREA)
 
     def _display_findings(self, current_image):
+        to_full_resolution = self.input_scale / self.scale
+
         self.display.new_frame(current_image)
         self.display.draw_bounding_boxes(self.tracker.potential_objects,
-                                         (0, 255, 255))
+                                         (0, 255, 255), to_full_resolution)
         self.display.draw_bounding_boxes(self.tracker.moving_objects,
-                                         (255, 0, 0))
+                                         (255, 0, 0), to_full_resolution)
         self.display.draw_bounding_boxes(self.tracker.stationary_objects,
-                                         (0, 0, 255))
+                                         (0, 0, 255), to_full_resolution)
         self.display.draw_counter(self.tracker.count)
 
         self.display.display_frame()
@@ -0,0 +1,151 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Analyze many videos on a pool of processes, writing one summary row per
+video.
+"""
+
+import csv
+import glob
+import multiprocessing
+import os
+import time
+import traceback
+
+from fishcounter.pipeline import create_analyzer
+from fishcounter.videoreader import VideoReader
+
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".mov", ".mkv", ".mpg", ".mpeg", ".m4v")
+
+SUMMARY_FIELDS = ["video", "count", "frames", "seconds", "status",
+                  "attempts", "error"]
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+
+
+def find_videos(path_or_pattern):
+    """
+    Finds the videos in a directory, or the files matching a glob pattern.
+    Returns them largest first, so the longest jobs start earliest and
+    don't hold up the end of the batch.
+    """
+    if os.path.isdir(path_or_pattern):
+        paths = [os.path.join(path_or_pattern, filename)
+                 for filename in os.listdir(path_or_pattern)
+                 if filename.lower().endswith(VIDEO_EXTENSIONS)]
+    else:
+        paths = glob.glob(path_or_pattern)
+
+    paths = [path for path in paths if os.path.isfile(path)]
+    return sorted(paths, key=os.path.getsize, reverse=True)
+
+
+def read_completed(summary_path):
+    """
+    Returns the videos already analyzed successfully according to an
+    existing summary file.
+    """
+    if not os.path.exists(summary_path):
+        return set()
+
+    with open(summary_path, "rb") as summary_file:
+        return set(row["video"] for row in csv.DictReader(summary_file)
+                   if row["status"] == STATUS_OK)
+
+
+def analyze_video(video_path, scale=1.0):
+    """
+    Counts the fish in one video with a freshly built pipeline.
+
+    Returns the count and the number of frames read.
+    """
+    reader = VideoReader(video_path,
+                         create_analyzer(headless=True, scale=scale),
+                         headless=True)
+    if not reader.source.is_opened():
+        raise IOError("Unable to open %s" % video_path)
+
+    reader.start()
+    return reader.video_analyzer.count, reader.frame_number + 1
+
+
+def _analyze_with_retries(args):
+    video_path, retries, scale = args
+
+    row = {"video": video_path, "count": "", "frames": "", "error": ""}
+    start_time = time.time()
+
+    for attempt in xrange(1, retries + 2):
+        row["attempts"] = attempt
+        try:
+            row["count"], row["frames"] = analyze_video(video_path, scale)
+            row["status"] = STATUS_OK
+            row["error"] = ""
+            break
+        except Exception:
+            row["status"] = STATUS_FAILED
+            row["error"] = traceback.format_exc().strip().splitlines()[-1]
+
+    row["seconds"] = "%.1f" % (time.time() - start_time)
+    return row
+
+
+def run_batch(path_or_pattern, summary_path, processes=None, retries=1,
+              scale=1.0):
+    """
+    Analyzes every video found at path_or_pattern, skipping those already
+    recorded as successful in the summary file so an interrupted batch can
+    be resumed.  Each video gets up to retries extra attempts.
+
+    Returns the rows written in this run.
+    """
+    completed = read_completed(summary_path)
+    videos = [video for video in find_videos(path_or_pattern)
+              if video not in completed]
+
+    if len(videos) == 0:
+        return []
+
+    write_header = not os.path.exists(summary_path)
+
+    rows = []
+    pool = multiprocessing.Pool(processes)
+    try:
+        with open(summary_path, "ab") as summary_file:
+            writer = csv.DictWriter(summary_file, SUMMARY_FIELDS)
+            if write_header:
+                writer.writeheader()
+
+            # chunksize of 1 hands out the videos in order, largest first
+            for row in pool.imap_unordered(_analyze_with_retries,
+                                           [(video, retries, scale)
+                                            for video in videos],
+                                           chunksize=1):
+                writer.writerow(row)
+                # Flush every row so an interrupted batch can be resumed
+                summary_file.flush()
+                rows.append(row)
+    finally:
+        pool.close()
+        pool.join()
+
+    return rows
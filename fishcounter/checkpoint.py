@@ -0,0 +1,156 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Saving the state of the whole pipeline, so that analysis of a long
+recording can resume where it stopped with warm background models and
+the objects tracked (and counted) so far.
+"""
+
+import cPickle as pickle
+import os
+import threading
+import zlib
+
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(state, path):
+    """
+    Compresses and writes a checkpoint.  It replaces any earlier one at
+    path only once it is completely written.
+    """
+    data = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+    partial_path = path + ".partial"
+    with open(partial_path, "wb") as checkpoint_file:
+        checkpoint_file.write(data)
+    os.rename(partial_path, path)
+
+
+def load_checkpoint(path):
+    with open(path, "rb") as checkpoint_file:
+        state = pickle.loads(zlib.decompress(checkpoint_file.read()))
+
+    if state["version"] != CHECKPOINT_VERSION:
+        raise ValueError("Unsupported checkpoint version %s in %s" %
+                         (state["version"], path))
+    return state
+
+
+def restore_checkpoint(path, analyzer):
+    """
+    Restores an Analyzer from a checkpoint, returning the number of the
+    last frame it had analyzed.
+    """
+    state = load_checkpoint(path)
+    analyzer.segmenter.restore_state(state["segmenter"])
+    analyzer.tracker.restore_state(pickle.loads(state["tracker"]))
+
+    # Checkpoints from runs without a motion gate have no gate state
+    gate_state = state.get("motion_gate")
+    if gate_state is not None and analyzer.motion_gate is not None:
+        analyzer.motion_gate.restore_state(gate_state)
+
+    return state["frame"]
+
+
+class Checkpointer(object):
+    """
+    Saves checkpoints of an Analyzer.
+
+    Only copying the state happens on the caller's thread; it is
+    compressed and written on a background thread.  If the previous
+    checkpoint is still being written, a new one is skipped rather than
+    holding up analysis.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._writer = None
+
+    def save(self, analyzer, frame):
+        if self._writer is not None and self._writer.is_alive():
+            return False
+
+        # The tracked objects are pickled right away, since tracking goes
+        # on changing them.
+        state = {"version": CHECKPOINT_VERSION,
+                 "frame": frame,
+                 "segmenter": analyzer.segmenter.checkpoint_state(),
+                 "tracker": pickle.dumps(analyzer.tracker.checkpoint_state(),
+                                         pickle.HIGHEST_PROTOCOL)}
+        if analyzer.motion_gate is not None:
+            state["motion_gate"] = analyzer.motion_gate.checkpoint_state()
+
+        self._writer = threading.Thread(target=save_checkpoint,
+                                        args=(state, self.path))
+        self._writer.start()
+        return True
+
+    def wait(self):
+        """
+        Waits for the checkpoint being written, if any.
+        """
+        if self._writer is not None:
+            self._writer.join()
+
+
+class CheckpointingAnalyzer(object):
+    """
+    Wraps an Analyzer to save a checkpoint every interval frames.
+
+    frame is the number of the last frame analyzed, which is the previous
+    image of the next call to analyze.
+
+    When a block of frames is prepared at once, segmenters may already
+    have folded the whole block into their models, so a checkpoint which
+    falls due inside a block is put off until its last frame.
+    """
+
+    def __init__(self, analyzer, checkpointer, interval=1000, frame=0):
+        self.analyzer = analyzer
+        self.checkpointer = checkpointer
+        self.interval = interval
+        self.frame = frame
+
+        # The last frame of the block being analyzed
+        self._block_end = None
+        self._is_due = False
+
+    @property
+    def count(self):
+        return self.analyzer.count
+
+    def prepare_block(self, images):
+        self.analyzer.prepare_block(images)
+        self._block_end = self.frame + len(images)
+
+    def analyze(self, previous_image, current_image):
+        self.analyzer.analyze(previous_image, current_image)
+        self.frame += 1
+
+        if self.frame % self.interval == 0:
+            self._is_due = True
+
+        if self._is_due and (self._block_end is None or
+                             self.frame >= self._block_end):
+            self.checkpointer.save(self.analyzer, self.frame)
+            self._is_due = False
@@ -0,0 +1,224 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Analyze a single long video in time chunks on multiple processes.
+
+Each chunk owns the objects first seen inside its frame range.  A chunk
+starts analyzing some warm-up frames early so that its background models
+have converged by the time its own range begins, and continues for some
+tail frames past its end so that objects first seen near the end have time
+to be confirmed.  Objects first seen during the warm-up belong to the
+previous chunk.  Because the background has not fully converged at the
+start of a chunk, an object may still be first seen a few frames later
+than in a sequential run; these are found by comparing positions with
+the previous chunk's tracks over the overlapping frames, and counted once.
+"""
+
+import collections
+import multiprocessing
+
+import numpy as np
+
+from fishcounter.pipeline import create_analyzer
+from fishcounter.tracking import utils
+from fishcounter.tracking.shapefeatures import ShapeMatcher
+from fishcounter.videoreader import VideoReader
+
+Chunk = collections.namedtuple("Chunk", ["start", "end", "first_frame",
+                                         "last_frame"])
+
+
+class TrackRecord(object):
+    """
+    What a chunk knows about one confirmed object: the frame it was first
+    seen in and its centers during the frames which overlap neighbouring
+    chunks.
+    """
+
+    def __init__(self, first_frame):
+        self.first_frame = first_frame
+        self.centers = {}
+
+    def is_near(self, other, distance_threshold):
+        for frame, center in self.centers.iteritems():
+            other_center = other.centers.get(frame)
+            if other_center is None:
+                continue
+
+            distance = np.sqrt(np.square(center[0] - other_center[0]) +
+                               np.square(center[1] - other_center[1]))
+            if distance < distance_threshold:
+                return True
+
+        return False
+
+
+class ChunkAnalyzer(object):
+    """
+    Wraps an Analyzer to record the tracks needed to stitch a chunk to its
+    neighbours.
+    """
+
+    def __init__(self, analyzer, chunk, overlap):
+        self.analyzer = analyzer
+        self.chunk = chunk
+        self.overlap = overlap
+        self.records = {}
+
+    def analyze(self, previous_image, current_image):
+        self.analyzer.analyze(previous_image, current_image)
+
+        tracker = self.analyzer.tracker
+        frame = tracker.frame_number - 1
+
+        is_overlapping = (frame < self.chunk.start + self.overlap or
+                          frame >= self.chunk.end)
+        if not is_overlapping:
+            return
+
+        for obj in utils.join_lists(tracker.potential_objects,
+                                    tracker.known_objects):
+            record = self.records.get(obj)
+            if record is None:
+                record = TrackRecord(obj.first_frame_tracked - 1)
+                self.records[obj] = record
+            record.centers[frame] = obj.center
+
+    def confirmed_records(self):
+        """
+        Returns the records of all objects this chunk counted.
+        """
+        records = []
+        for obj in self.analyzer.tracker.known_objects:
+            record = self.records.get(obj)
+            if record is None:
+                # Never seen during an overlap, so it can't be a duplicate.
+                record = TrackRecord(obj.first_frame_tracked - 1)
+            records.append(record)
+        return records
+
+
+def split_into_chunks(frame_count, num_chunks, warmup, tail, first_frame=0):
+    """
+    Splits the frames of a video from first_frame up to frame_count into
+    num_chunks contiguous chunks.  Each chunk is extended by warmup frames
+    before its start and tail frames after its end, clipped to the frames
+    being analyzed.
+    """
+    chunk_length = max(1, int(np.ceil(float(frame_count - first_frame) /
+                                      num_chunks)))
+
+    chunks = []
+    for start in xrange(first_frame, frame_count, chunk_length):
+        end = min(start + chunk_length, frame_count)
+        chunks.append(Chunk(start, end, max(first_frame, start - warmup),
+                            min(frame_count, end + tail)))
+    return chunks
+
+
+def stitch_chunks(chunk_records, chunks, distance_threshold):
+    """
+    Merges the confirmed records of consecutive chunks into a single count.
+
+    Returns the number of distinct objects.
+    """
+    count = 0
+    previous_records = []
+
+    for records, chunk in zip(chunk_records, chunks):
+        owned = [record for record in records
+                 if chunk.start <= record.first_frame < chunk.end]
+
+        for record in owned:
+            is_duplicate = any(record.is_near(previous, distance_threshold)
+                               for previous in previous_records)
+            if not is_duplicate:
+                count += 1
+
+        previous_records = owned
+
+    return count
+
+
+def _analyze_chunk(args):
+    video_path, chunk, overlap, scale, analyzer_factory = args
+
+    analyzer = analyzer_factory(headless=True, scale=scale)
+    # Keep frame numbers consistent with a sequential run, which starts
+    # tracking at frame 1 with a frame number of 2.
+    analyzer.tracker.frame_number = chunk.first_frame + 1
+
+    chunk_analyzer = ChunkAnalyzer(analyzer, chunk, overlap)
+    VideoReader(video_path, chunk_analyzer, headless=True).start(
+        chunk.first_frame, chunk.last_frame)
+
+    return chunk_analyzer.confirmed_records()
+
+
+def count_in_chunks(video_path, processes=None, num_chunks=None,
+                    warmup=1000, tail=100, scale=1.0, skip=0,
+                    start_time=None, end_time=None,
+                    analyzer_factory=create_analyzer):
+    """
+    Counts the fish in a video by analyzing it in num_chunks time chunks on
+    a pool of processes.  By default there is one chunk per process.
+
+    Like a sequential run, analysis starts at frame skip, or at start_time
+    seconds if given, and stops at end_time seconds or the end of the
+    video.
+
+    Each chunk gets a fresh analyzer from analyzer_factory, called with
+    the headless and scale keywords.  It is sent to the processes, so it
+    must be a module-level function.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if num_chunks is None:
+        num_chunks = processes
+
+    reader = VideoReader(video_path, None, headless=True)
+    frame_count = reader.frame_count
+    if frame_count <= 0:
+        raise ValueError("Unable to determine the length of %s" % video_path)
+
+    if start_time is not None:
+        skip = reader.frame_at(start_time)
+    if end_time is not None:
+        frame_count = min(frame_count, reader.frame_at(end_time))
+    reader.source.release()
+
+    chunks = split_into_chunks(frame_count, num_chunks, warmup, tail, skip)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunk_records = pool.map(_analyze_chunk,
+                                 [(video_path, chunk, tail, scale,
+                                   analyzer_factory)
+                                  for chunk in chunks],
+                                 chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Tracks on either side of a boundary are compared the same way the
+    # shape tracker compares an object with itself between frames.
+    return stitch_chunks(chunk_records, chunks,
+                         ShapeMatcher(scale).centroid_threshold)
@@ -23,22 +23,169 @@ Find connected components.
 """
 
 import cv2
+import numpy as np
 
+from fishcounter.morphology import MorphologyChain
 
-def find_connected_components(bin_img, kernel, length_thresh):
-    # clean up image
-    bin_img = cv2.morphologyEx(bin_img, cv2.MORPH_OPEN, kernel, iterations=1)
-    bin_img = cv2.morphologyEx(bin_img, cv2.MORPH_CLOSE, kernel, iterations=15)
 
-    cv2.imshow("Segmentation - post processed", bin_img)
+class Blobs(object):
+    """
+    The blobs found in one binary image, as arrays with one entry per blob
+    rather than one object per contour:
 
-    contours, _ = cv2.findContours(bin_img, cv2.RETR_TREE,
+      bboxes      (x, y, width, height) of each blob
+      areas       area inside the outline of each blob
+      centroids   (x, y) centre of mass of each blob
+      perimeters  length of the outline of each blob
+      angles      orientation of each blob's principal axis from its
+                  moments, in degrees and folded into [-45, 45) like the
+                  angle of cv2.minAreaRect
+
+    These are the same as cv2.boundingRect, cv2.contourArea, cv2.moments
+    and cv2.arcLength would give for each outline.  The outlines are kept
+    as one array of points, and the contour of a blob is only sliced out
+    of it when asked for.
+    """
+
+    def __init__(self, points, starts, ends, bboxes, areas, centroids,
+                 perimeters, angles):
+        self.points = points
+        self.starts = starts
+        self.ends = ends
+        self.bboxes = bboxes
+        self.areas = areas
+        self.centroids = centroids
+        self.perimeters = perimeters
+        self.angles = angles
+
+    def __len__(self):
+        return len(self.starts)
+
+    def bbox(self, index):
+        return tuple(int(value) for value in self.bboxes[index])
+
+    def contour(self, index):
+        """
+        The outline of a blob, as cv2.findContours would give it.
+        """
+        return self.points[self.starts[index]:self.ends[index], np.newaxis]
+
+
+def _outline_edges(points, lengths):
+    # The start and end of each edge of each (closed) outline
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    successors = np.arange(1, len(points) + 1)
+    successors[ends - 1] = starts
+
+    x = points[:, 0].astype(np.float64)
+    y = points[:, 1].astype(np.float64)
+    return starts, ends, x, y, x[successors], y[successors]
+
+
+def extract_blobs(bin_img, min_perimeter=None):
+    """
+    Finds the outer outlines of the blobs in a binary image, and computes
+    their statistics for all of them at once.  Each is a sum over the
+    edges of an outline (by Green's theorem for the area and moments), so
+    they are all sums over the points of every outline reduced by blob.
+
+    With min_perimeter, only blobs with a longer perimeter are kept, and
+    nothing more is computed for the rest.
+    """
+    contours, _ = cv2.findContours(bin_img, cv2.RETR_EXTERNAL,
                                    cv2.CHAIN_APPROX_SIMPLE)
 
-    large_contours = []
-    for contour in contours:
-        length = cv2.arcLength(contour, True)
-        if length > length_thresh:
-            large_contours.append(contour)
+    lengths = np.array([len(contour) for contour in contours], np.intp)
+    if len(contours) > 0:
+        points = np.concatenate(contours).reshape(-1, 2)
+    else:
+        points = np.empty((0, 2), np.int32)
+
+    starts, ends, x, y, next_x, next_y = _outline_edges(points, lengths)
+    perimeters = np.hypot(next_x - x, next_y - y)
+
+    if min_perimeter is not None and len(contours) > 0:
+        perimeters = np.add.reduceat(perimeters, starts)
+        keep = perimeters > min_perimeter
+        points = points[np.repeat(keep, lengths)]
+        lengths = lengths[keep]
+        perimeters = perimeters[keep]
+        starts, ends, x, y, next_x, next_y = _outline_edges(points, lengths)
+    elif len(contours) > 0:
+        perimeters = np.add.reduceat(perimeters, starts)
+
+    if len(lengths) == 0:
+        empty = np.empty(0)
+        return Blobs(points, starts, ends, np.empty((0, 4), np.int32),
+                     empty, np.empty((0, 2)), empty, empty)
+
+    def per_blob(values):
+        return np.add.reduceat(values, starts)
+
+    bboxes = np.column_stack((np.minimum.reduceat(points[:, 0], starts),
+                              np.minimum.reduceat(points[:, 1], starts),
+                              np.maximum.reduceat(points[:, 0], starts),
+                              np.maximum.reduceat(points[:, 1], starts)))
+    bboxes[:, 2:] += 1 - bboxes[:, :2]
+
+    cross = x * next_y - next_x * y
+    m00 = per_blob(cross) / 2
+    m10 = per_blob(cross * (x + next_x)) / 6
+    m01 = per_blob(cross * (y + next_y)) / 6
+    m20 = per_blob(cross * (x * x + x * next_x + next_x * next_x)) / 12
+    m02 = per_blob(cross * (y * y + y * next_y + next_y * next_y)) / 12
+    m11 = per_blob(cross * (2 * x * y + x * next_y + next_x * y +
+                            2 * next_x * next_y)) / 24
+
+    # Outlines enclosing no area (lines and single pixels) have their
+    # centroid at the mean of their points, and no orientation
+    flat = m00 == 0
+    m00[flat] = 1
+    centroids = np.column_stack((m10 / m00, m01 / m00))
+    centroids[flat] = np.column_stack(
+        (per_blob(x) / lengths, per_blob(y) / lengths))[flat]
+
+    mu20 = m20 - m10 * m10 / m00
+    mu02 = m02 - m01 * m01 / m00
+    mu11 = m11 - m10 * m01 / m00
+    angles = 0.5 * np.degrees(np.arctan2(2 * mu11, mu20 - mu02))
+    angles = (angles + 45) % 90 - 45
+    angles[flat] = 0
+
+    areas = np.abs(m00)
+    areas[flat] = 0
+    return Blobs(points, starts, ends, bboxes, areas, centroids, perimeters,
+                 angles)
+
+
+def clean_mask(bin_img, kernel, close_iterations=15, tiler=None):
+    """
+    Removes speckles from a mask and joins up the pieces of blobs.
+    """
+    cleaning = MorphologyChain(kernel, [(cv2.MORPH_OPEN, 1),
+                                        (cv2.MORPH_CLOSE, close_iterations)])
+    if tiler is None:
+        return cleaning.apply(bin_img)
+
+    # The tiles are cleaned with enough overlap to leave no seams, so
+    # blobs crossing them are found whole.
+    return tiler.map_image(cleaning.apply, bin_img, cleaning.reach)
+
+
+def find_blobs(bin_img, kernel, length_thresh, headless=False,
+               close_iterations=15, tiler=None):
+    """
+    Cleans up a mask and returns its blobs with a perimeter longer than
+    length_thresh.
+
+    Only the outer outline of each blob is traced, so unlike the contour
+    hierarchy find_connected_components used to return, the holes in
+    blobs and any blobs nested inside those holes are not counted.
+    """
+    bin_img = clean_mask(bin_img, kernel, close_iterations, tiler)
+
+    if not headless:
+        cv2.imshow("Segmentation - post processed", bin_img)
 
-    return large_contours
+    return extract_blobs(bin_img, length_thresh)
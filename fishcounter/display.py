@@ -23,6 +23,7 @@ Manages displaying results to user.
 """
 
 import cv2
+import numpy as np
 
 
 class DisplayManager(object):
@@ -37,19 +38,30 @@ class DisplayManager(object):
         return self.current_frame.shape[1]
 
     def new_frame(self, new_frame):
-        self.current_frame = new_frame.copy()
+        # Drawing happens on a copy, reusing the same buffer each frame.
+        if (self.current_frame is None or
+                self.current_frame.shape != new_frame.shape):
+            self.current_frame = new_frame.copy()
+        else:
+            np.copyto(self.current_frame, new_frame)
 
-    def draw_bounding_boxes(self, tracked_objects, colour):
+    def draw_bounding_boxes(self, tracked_objects, colour, scale=1.0):
+        """
+        Bounding box coordinates are multiplied by scale, for objects
+        tracked at a different resolution than the frame being displayed.
+        """
         min_x = 0
         max_x = self._frame_width()
         min_y = 0
         max_y = self._frame_height()
 
         for obj in tracked_objects:
+            top_left = self._scale_point(obj.bbox.top_left, scale)
+            bottom_right = self._scale_point(obj.bbox.bottom_right, scale)
             cv2.rectangle(self.current_frame,
-                          self._restrict_point(obj.bbox.top_left,
+                          self._restrict_point(top_left,
                                                min_x, max_x, min_y, max_y),
-                          self._restrict_point(obj.bbox.bottom_right,
+                          self._restrict_point(bottom_right,
                                                min_x, max_x, min_y, max_y),
                           colour)
 
@@ -68,6 +80,11 @@ class DisplayManager(object):
     def display_frame(self):
         cv2.imshow(self.display_name, self.current_frame)
 
+    def _scale_point(self, point, scale):
+        if scale == 1.0:
+            return point
+        return (int(round(point[0] * scale)), int(round(point[1] * scale)))
+
     def _restrict_point(self, point, min_x, max_x, min_y, max_y):
         return (self._restrict_val(point[0], min_x, max_x),
                 self._restrict_val(point[1], min_y, max_y))
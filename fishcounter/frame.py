@@ -0,0 +1,116 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+A frame being analyzed, along with representations derived from it.
+"""
+
+import threading
+
+import cv2
+
+
+class Frame(object):
+    """
+    Wraps an image so that derived representations, such as its grayscale
+    and HSV conversions or a segmentation mask, are computed the first
+    time they are needed and then shared by every segmenter and tracker
+    that uses them.
+
+    Derived representations are shared, so they must not be modified.
+    Segmenters running on different threads can share a Frame; each
+    representation is still only computed once.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self._derived = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def memoize(self, key, compute):
+        """
+        Returns the representation stored under key, calling compute to
+        create it if this is the first time it is needed.
+        """
+        try:
+            return self._derived[key]
+        except KeyError:
+            pass
+
+        # Only threads computing the same representation wait on each other.
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            if key not in self._derived:
+                self._derived[key] = compute()
+            return self._derived[key]
+
+    def region(self, rect):
+        """
+        Returns a Frame for the (x, y, width, height) region of this one.
+        Representations already computed for this frame are shared with
+        the region as views.
+        """
+        x, y, width, height = rect
+        region = Frame(self.image[y:y + height, x:x + width])
+
+        for key in ("gray", "hsv"):
+            if key in self._derived:
+                region._derived[key] = self._derived[key][y:y + height,
+                                                          x:x + width]
+        return region
+
+    @property
+    def gray(self):
+        return self.memoize("gray", lambda: cv2.cvtColor(self.image,
+                                                         cv2.COLOR_BGR2GRAY))
+
+    @property
+    def hsv(self):
+        return self.memoize("hsv", lambda: cv2.cvtColor(self.image,
+                                                        cv2.COLOR_BGR2HSV))
+
+    def reduced(self, levels):
+        """
+        Returns a Frame for this one reduced levels times by an image
+        pyramid, each level half the width and height of the one before.
+        """
+        def reduce():
+            image = self.image
+            for _ in xrange(levels):
+                image = cv2.pyrDown(image)
+            return Frame(image)
+
+        return self.memoize(("reduced", levels), reduce)
+
+
+def as_frame(image):
+    """
+    Wraps an image in a Frame, unless it already is one.
+    """
+    if isinstance(image, Frame):
+        return image
+    return Frame(image)
@@ -0,0 +1,197 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Cache of decoded frames, for analyzing the same video many times.
+
+A video is decoded once into a file of raw frames, resized to the
+processing scale.  The file has a small header giving the number of
+frames, their shape, dtype and frame rate, followed by the frames
+themselves, so later runs can memory-map it and serve each frame as a
+view of the mapping without decoding or copying.
+"""
+
+import hashlib
+import os
+import struct
+
+import cv2
+import numpy as np
+
+from fishcounter.sources import StackSource, CaptureSource
+
+MAGIC = "FCFRAMES"
+HEADER_FORMAT = "<8sIIIId8s" # magic, count, height, width, channels, fps, dtype
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+CACHE_EXTENSION = ".frames"
+
+
+def hash_file(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as video_file:
+        block = video_file.read(block_size)
+        while block:
+            digest.update(block)
+            block = video_file.read(block_size)
+    return digest.hexdigest()
+
+
+def write_frames(source, path, scale=1.0):
+    """
+    Decodes every frame of source, resized by scale, into a raw frame file.
+    """
+    count = 0
+    shape = None
+    dtype = None
+
+    with open(path, "wb") as frame_file:
+        # Written again once the number of frames is known
+        frame_file.write("\0" * HEADER_SIZE)
+
+        frame_was_read, image = source.read()
+        while frame_was_read:
+            if scale != 1.0:
+                image = cv2.resize(image, None, fx=scale, fy=scale,
+                                   interpolation=cv2.INTER_AREA)
+
+            if shape is None:
+                shape = image.shape
+                dtype = image.dtype
+            elif image.shape != shape:
+                raise ValueError("Frame %d of %s has shape %s, expected %s" %
+                                 (count, source, image.shape, shape))
+
+            frame_file.write(np.ascontiguousarray(image).data)
+            count += 1
+
+            frame_was_read, image = source.read()
+
+        if count == 0:
+            raise ValueError("No frames could be read from %s" % source)
+
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) > 2 else 1
+
+        frame_file.seek(0)
+        frame_file.write(struct.pack(HEADER_FORMAT, MAGIC, count, height,
+                                     width, channels, source.fps,
+                                     dtype.str))
+
+
+class CachedFrameSource(StackSource):
+    """
+    Frames served from a memory-mapped raw frame file.  Frames are
+    copy-on-write views of the mapping.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as frame_file:
+            header = frame_file.read(HEADER_SIZE)
+
+        if len(header) < HEADER_SIZE:
+            raise ValueError("%s is not a frame cache file" % path)
+
+        (magic, count, height, width, channels, fps,
+         dtype) = struct.unpack(HEADER_FORMAT, header)
+        if magic != MAGIC:
+            raise ValueError("%s is not a frame cache file" % path)
+
+        shape = (count, height, width)
+        if channels > 1:
+            shape += (channels,)
+
+        frames = np.memmap(path, dtype=np.dtype(dtype.rstrip("\0")),
+                           mode="c", offset=HEADER_SIZE, shape=shape)
+        super(CachedFrameSource, self).__init__(frames, fps)
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+
+class FrameCache(object):
+    """
+    A directory of raw frame files, keyed by the hash of the video file and
+    the processing scale.  When the total size exceeds max_bytes the least
+    recently used files are removed.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path_for(self, video_path, scale=1.0):
+        return os.path.join(self.directory, "%s-%g%s" % (hash_file(video_path),
+                                                         scale,
+                                                         CACHE_EXTENSION))
+
+    def open(self, video_path, scale=1.0):
+        """
+        Returns a CachedFrameSource for the video at the given scale,
+        decoding it into the cache first if necessary.
+        """
+        path = self.path_for(video_path, scale)
+
+        if os.path.exists(path):
+            # The modification time records when the file was last used.
+            os.utime(path, None)
+        else:
+            partial_path = path + ".partial"
+            source = CaptureSource(video_path)
+            try:
+                write_frames(source, partial_path, scale)
+            except:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                raise
+            finally:
+                source.release()
+            os.rename(partial_path, path)
+
+            self.evict(keep=path)
+
+        return CachedFrameSource(path)
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used files until the cache fits within
+        max_bytes.  The file at keep is never removed.
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(CACHE_EXTENSION):
+                path = os.path.join(self.directory, filename)
+                info = os.stat(path)
+                entries.append((info.st_mtime, info.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+
+            os.remove(path)
+            total_size -= size
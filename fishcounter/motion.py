@@ -0,0 +1,107 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Cheap tests for whether anything changed between consecutive frames.
+"""
+
+import cv2
+import numpy as np
+
+DUPLICATE = "duplicate"
+STATIC = "static"
+CHANGED = "changed"
+
+
+class MotionGate(object):
+    """
+    Compares small thumbnails of frames.  Each thumbnail pixel is the mean
+    of one tile of a grid laid over the frame, so a fish moving into or
+    out of a tile shifts that pixel even though it is a tiny fraction of
+    the frame.
+
+    A frame is a duplicate if it is exactly the same as the previous one,
+    as happens when a camera or decoder stalls and repeats a frame; the
+    full frames are only compared when their thumbnails match.  Otherwise
+    it is compared with the last frame which changed (or the first frame),
+    so that a fish moving too slowly to show between consecutive frames
+    still adds up to a change.  It is static if no tile changed by more
+    than tile_threshold grey levels and the frame as a whole by no more
+    than global_threshold on average.  Otherwise it changed, and becomes
+    the frame later ones are compared with.
+
+    Thumbnails are kept between calls, which assumes frames are classified
+    in order.  They are saved with checkpoints, so that a resumed run
+    classifies its first frames as the uninterrupted one would.
+    """
+
+    def __init__(self, grid=(32, 18), tile_threshold=2.0,
+                 global_threshold=0.5):
+        self.grid = grid
+        self.tile_threshold = tile_threshold
+        self.global_threshold = global_threshold
+
+        # The tiles which changed since the last changed frame, as of the
+        # last frame classified
+        self.changed_tiles = None
+
+        self._previous_thumbnail = None
+        self._changed_thumbnail = None
+
+    def classify(self, previous_image, current_image):
+        previous_thumbnail = self._previous_thumbnail
+        if previous_thumbnail is None:
+            previous_thumbnail = self._thumbnail(previous_image)
+        if self._changed_thumbnail is None:
+            self._changed_thumbnail = previous_thumbnail
+
+        current_thumbnail = self._thumbnail(current_image)
+        self._previous_thumbnail = current_thumbnail
+
+        if (np.array_equal(previous_thumbnail, current_thumbnail) and
+                cv2.norm(previous_image, current_image, cv2.NORM_INF) == 0):
+            return DUPLICATE
+
+        difference = cv2.absdiff(self._changed_thumbnail, current_thumbnail)
+        self.changed_tiles = difference > self.tile_threshold
+
+        if (self.changed_tiles.any() or
+                difference.mean() > self.global_threshold):
+            self._changed_thumbnail = current_thumbnail
+            return CHANGED
+        else:
+            return STATIC
+
+    def checkpoint_state(self):
+        # Thumbnails are replaced rather than updated, so they needn't be
+        # copied
+        return {"previous_thumbnail": self._previous_thumbnail,
+                "changed_thumbnail": self._changed_thumbnail}
+
+    def restore_state(self, state):
+        self._previous_thumbnail = state["previous_thumbnail"]
+        self._changed_thumbnail = state["changed_thumbnail"]
+
+    def _thumbnail(self, image):
+        # Averaging the colour tiles first keeps the conversion tiny
+        thumbnail = cv2.resize(image, self.grid, interpolation=cv2.INTER_AREA)
+        if thumbnail.ndim == 3:
+            thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+        return thumbnail.astype(np.float32)
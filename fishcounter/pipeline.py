@@ -0,0 +1,130 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Builds the standard fish counting pipeline.
+"""
+
+from fishcounter.analyzer import Analyzer
+from fishcounter.display import DisplayManager
+from fishcounter.motion import MotionGate
+from fishcounter.tiling import Tiler
+from fishcounter.segment import (BlockMovingAverageBackgroundSubtractor,
+                                 CompositeSegmentationAlgorithm,
+                                 EdgeBackgroundSubtractor,
+                                 InPlaceMovingAverageBackgroundSubtractor,
+                                 MixtureOfGaussiansBackgroundSubtractor,
+                                 MovingAverageBackgroundSubtractor,
+                                 OpticalFlowSegmenter,
+                                 PyramidSegmentationAlgorithm,
+                                 HSVColourSegmenter,
+                                 LookupTableColourSegmenter)
+from fishcounter.tracking.multistage import MultistageTracker
+
+
+def create_analyzer(headless=False, scale=1.0, input_scale=1.0,
+                    cascade=False, segment_threads=0, colour_lut_dir=None,
+                    pyramid_levels=0, motion_gate=False, tiles=None,
+                    offline_blocks=False, optical_flow=False,
+                    edge_model=False):
+    """
+    Creates an Analyzer with its own segmenters and tracker.  Nothing is
+    shared between the analyzers returned by separate calls, so each
+    process or video can have its own.
+
+    Frames are processed at the given scale of their original resolution,
+    and arrive at input_scale of it.
+
+    With cascade, the expensive segmenters only look at the regions the
+    cheaper ones found.  Neither background subtractor here can update
+    its model region by region, so they still see every frame whole and
+    the saving is in the colour segmenter (and optical flow).  The colour
+    mask is then only computed inside the regions, so the CamShift
+    tracker computes it again for the whole frame whenever there are
+    stationary fish.  Otherwise, segment_threads threads can run the
+    segmenters concurrently.
+
+    With a colour_lut_dir, colours are classified with a lookup table
+    cached in that directory rather than by converting frames to HSV.
+
+    With pyramid_levels, the segmenters above look for fish in frames
+    reduced that many times, and the mask is only refined at full
+    resolution where they found something.
+
+    With motion_gate, frames in which nothing changed are not segmented.
+
+    With tiles, given as (columns, rows), colour segmentation and cleaning
+    up the mask are split into that many tiles processed on threads.
+
+    With offline_blocks, the moving average is computed for blocks of
+    frames at once when they are read with a BlockVideoReader.
+
+    With optical_flow, fish must also be seen moving by sparse optical flow,
+    which is kept to about 10 ms a frame.
+
+    With edge_model, fish must also have edges where the background
+    usually doesn't, which rules out most of the water and tank cheaply.
+    """
+    tiler = None
+    if tiles is not None:
+        tiler = Tiler(*tiles)
+
+    def colour_segmenter(colour_scale):
+        if colour_lut_dir is not None:
+            return LookupTableColourSegmenter(colour_scale, colour_lut_dir,
+                                              tiler)
+        return HSVColourSegmenter(colour_scale, tiler)
+
+    margin = int(round(32 * scale))
+    coarse_scale = scale / 2.0 ** pyramid_levels
+
+    if offline_blocks:
+        moving_average = BlockMovingAverageBackgroundSubtractor(0.05)
+    else:
+        moving_average = InPlaceMovingAverageBackgroundSubtractor(0.05)
+
+    algorithms = [moving_average,
+                  MixtureOfGaussiansBackgroundSubtractor(),
+                  colour_segmenter(coarse_scale)]
+    if edge_model:
+        algorithms.insert(0, EdgeBackgroundSubtractor(coarse_scale,
+                                                      edge_scale=0.5))
+    if optical_flow:
+        algorithms.append(OpticalFlowSegmenter(coarse_scale,
+                                               budget_seconds=0.01))
+
+    segmenter = CompositeSegmentationAlgorithm(
+        algorithms, cascade=cascade, margin=int(round(32 * coarse_scale)),
+        threads=segment_threads)
+
+    if pyramid_levels > 0:
+        # Only the moving average can update its model region by region
+        fine = CompositeSegmentationAlgorithm([
+            MovingAverageBackgroundSubtractor(0.05),
+            colour_segmenter(scale)])
+        segmenter = PyramidSegmentationAlgorithm(segmenter, fine,
+                                                 pyramid_levels, margin)
+
+    display = None if headless else DisplayManager("Fish Counter")
+    tracker = MultistageTracker(scale)
+    gate = MotionGate() if motion_gate else None
+    return Analyzer(segmenter, tracker, display, headless=headless,
+                    scale=scale, input_scale=input_scale, motion_gate=gate,
+                    tiler=tiler)
@@ -20,16 +20,148 @@
 
 """
 Segmentation algorithms.
+
+Segmenters are given a Frame (or a plain image, which is wrapped in one)
+so that colour conversions and masks are only computed once per frame.
+
+Each segmenter has a relative cost, used to order the stages of a
+cascade, and says whether it is stateful (keeps a model which must see
+every frame).  Stateful segmenters can be aged over frames which are
+skipped because nothing changed, as if they had seen more frames like
+the next one they segment.  They can also save their state with
+checkpoint_state and load it again with restore_state, so that analysis
+can resume without warming their models up again.
 """
 
+import hashlib
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
 import cv2
 import numpy as np
 
+from fishcounter.frame import as_frame
+from fishcounter.morphology import MorphologyChain
+
 MAX_PIXEL_VALUE = 255
 
 
+def scaled_iterations(iterations, scale):
+    """
+    Scales a number of morphology iterations (each of which reaches one
+    pixel further) for images resized by scale.
+    """
+    return max(1, int(round(iterations * scale)))
+
+
+def _copy(array):
+    return None if array is None else array.copy()
+
+
+def aged_weight(alpha, pending_frames):
+    """
+    The weight of one moving average update with alpha that has the same
+    effect as pending_frames + 1 updates towards the same image.
+    """
+    if pending_frames == 0:
+        return alpha
+    return 1 - (1 - alpha) ** (pending_frames + 1)
+
+
+def candidate_regions(bin_img, margin, cell_size=8):
+    """
+    Finds the regions of a binary image worth looking at more closely:
+    the bounding rectangles (x, y, width, height) of its foreground, grown
+    by margin pixels.  Nearby foreground is grouped into one region.
+
+    The work is done on a grid of cell_size cells, so it is cheap even for
+    noisy masks.
+    """
+    height, width = bin_img.shape[:2]
+    grid = cv2.resize(bin_img, ((width + cell_size - 1) // cell_size,
+                                (height + cell_size - 1) // cell_size),
+                      interpolation=cv2.INTER_AREA)
+    grid = (grid > 0).astype(np.uint8)
+
+    margin_cells = (margin + cell_size - 1) // cell_size
+    if margin_cells > 0:
+        grid = cv2.dilate(grid, cv2.getStructuringElement(
+            cv2.MORPH_RECT, (2 * margin_cells + 1, 2 * margin_cells + 1)))
+
+    contours, _ = cv2.findContours(grid, cv2.RETR_EXTERNAL,
+                                   cv2.CHAIN_APPROX_SIMPLE)
+
+    regions = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        x0 = x * cell_size
+        y0 = y * cell_size
+        regions.append((x0, y0, min(width, (x + w) * cell_size) - x0,
+                        min(height, (y + h) * cell_size) - y0))
+    return regions
+
+
+def hysteresis_threshold(image, low, high, out=None):
+    """
+    Thresholds an image with hysteresis: pixels above high are foreground,
+    as is every pixel above low that is 8-connected to one of them through
+    other pixels above low.
+
+    This is one connected components labelling of the pixels above low,
+    keeping the components which contain a pixel above high, so it takes
+    time linear in the size of the image however large the blobs grow.
+    """
+    weak = cv2.compare(image, low, cv2.CMP_GT)
+    strong = cv2.compare(image, max(low, high), cv2.CMP_GT)
+    if out is None:
+        out = np.empty(weak.shape, np.uint8)
+
+    if not hasattr(cv2, "connectedComponents"):
+        # OpenCV 2.4
+        return _flood_from_strong(weak, strong, out)
+
+    count, labels = cv2.connectedComponents(weak, connectivity=8)
+    keep = np.zeros(count, np.uint8)
+    keep[labels[strong > 0]] = MAX_PIXEL_VALUE
+    # Label 0 is the pixels below low
+    keep[0] = 0
+    return keep.take(labels, out=out)
+
+
+def _flood_from_strong(weak, strong, out):
+    # Flood fills the weak component around each strong blob, which
+    # touches each component at most once
+    contours, _ = cv2.findContours(strong, cv2.RETR_EXTERNAL,
+                                   cv2.CHAIN_APPROX_SIMPLE)
+    height, width = weak.shape
+    fill_mask = np.zeros((height + 2, width + 2), np.uint8)
+    filled = MAX_PIXEL_VALUE // 2
+    for contour in contours:
+        x, y = contour[0, 0]
+        if weak[y, x] != filled:
+            cv2.floodFill(weak, fill_mask, (int(x), int(y)), filled, 0, 0, 8)
+    return cv2.compare(weak, filled, cv2.CMP_EQ, out)
+
+
+def segment_regions(segmenter, frame, regions):
+    """
+    Segments only the given regions of a frame with a stateless segmenter.
+    Everything outside the regions is background.
+    """
+    segmented = np.zeros(frame.shape[:2], np.uint8)
+    for x, y, w, h in regions:
+        segmented[y:y + h, x:x + w] = segmenter.segment(
+            frame.region((x, y, w, h)))
+    return segmented
+
+
 class HSVColourSegmenter(object):
-    def __init__(self):
+    # Mostly the cost of the morphology used to clean up the mask
+    cost = 10
+    stateful = False
+
+    def __init__(self, scale=1.0, tiler=None):
         # IMPORTANT NOTE:
         #   Hue range:        [0, 180]
         #   Saturation range: [0, 255]
@@ -45,37 +177,188 @@ class HSVColourSegmenter(object):
 
         # For cleaning
         self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        self.close_iterations = scaled_iterations(17, scale)
+        self.open_iterations = scaled_iterations(3, scale)
+        self.cleaning = MorphologyChain(
+            self.kernel, [(cv2.MORPH_CLOSE, self.close_iterations),
+                          (cv2.MORPH_OPEN, self.open_iterations)])
+
+        # Optionally splits frames into tiles processed on threads
+        self.tiler = tiler
 
     def segment(self, current_image):
-        hsv_img = cv2.cvtColor(current_image, cv2.COLOR_BGR2HSV)
+        frame = as_frame(current_image)
+
+        # Other segmenters with the same settings (such as the one used by
+        # the CamShift tracker) share the result.
+        key = ("colour mask", self.hue_min, self.hue_max, self.sat_min,
+               self.sat_max, self.val_min, self.val_max,
+               self.close_iterations, self.open_iterations)
+        return frame.memoize(key, lambda: self._segment_tiled(frame))
+
+    def _segment_tiled(self, frame):
+        if self.tiler is None:
+            return self._segment_frame(frame)
 
+        # Classifying colours is per pixel, so only the cleaning reaches
+        # across tiles.
+        return self.tiler.map_frame(self._segment_frame, frame,
+                                    self.cleaning.reach)
+
+    def _segment_frame(self, frame):
+        return self._segment(frame.hsv)
+
+    def _segment(self, hsv_img):
         min_vals = np.array([self.hue_min, self.sat_min, self.val_min])
-        max_vals = np.array([self.sat_max, self.sat_max, self.val_max])
+        max_vals = np.array([self.hue_max, self.sat_max, self.val_max])
         bin_img = cv2.inRange(hsv_img, min_vals, max_vals)
 
         return self._clean(bin_img)
 
     def _clean(self, bin_img):
-        bin_img = cv2.morphologyEx(bin_img, cv2.MORPH_CLOSE, self.kernel,
-                                   iterations=17)
-        bin_img = cv2.morphologyEx(bin_img, cv2.MORPH_OPEN, self.kernel,
-                                   iterations=3)
-        return bin_img
+        return self.cleaning.apply(bin_img)
+
+
+class LookupTableColourSegmenter(HSVColourSegmenter):
+    """
+    Produces exactly the same mask as HSVColourSegmenter, but classifies
+    each BGR pixel with a lookup in a table of every possible colour
+    instead of converting the frame to HSV.
+
+    The table is a bitset over the 256^3 colours (2 MB), built by running
+    the HSV threshold over all of them.  It is rebuilt whenever the
+    thresholds change.  With a cache_dir, tables are saved there per set
+    of thresholds (and OpenCV version, whose HSV conversion they capture)
+    and loaded instead of being rebuilt.
+    """
+
+    def __init__(self, scale=1.0, cache_dir=None, tiler=None):
+        super(LookupTableColourSegmenter, self).__init__(scale, tiler)
+        self.cache_dir = cache_dir
+        self._table = None
+        self._table_thresholds = None
+
+    @property
+    def thresholds(self):
+        return (self.hue_min, self.hue_max, self.sat_min, self.sat_max,
+                self.val_min, self.val_max)
+
+    def _segment_frame(self, frame):
+        return self._clean(self._classify(frame.image))
+
+    def _classify(self, image):
+        table = self._lookup_table()
+
+        # Each pixel as the little-endian integer b | g << 8 | r << 16
+        height, width = image.shape[:2]
+        bgra = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+        index = bgra.view(np.dtype("<u4")).reshape(height, width)
+        index &= 0xFFFFFF
+
+        # np.packbits stores the first colour of each byte in its high bit
+        bits = table.take(index >> 3)
+        np.left_shift(bits, (index & 7).astype(np.uint8), out=bits)
+        np.bitwise_and(bits, 0x80, out=bits)
+        return cv2.compare(bits, 0, cv2.CMP_NE)
+
+    def _lookup_table(self):
+        thresholds = self.thresholds
+        if self._table_thresholds != thresholds:
+            self._table = self._load_table(thresholds)
+            self._table_thresholds = thresholds
+        return self._table
+
+    def _load_table(self, thresholds):
+        if self.cache_dir is None:
+            return self._build_table(thresholds)
+
+        key = hashlib.sha1(repr((thresholds, cv2.__version__))).hexdigest()
+        path = os.path.join(self.cache_dir, "colour-%s.npy" % key)
+        if os.path.exists(path):
+            return np.load(path)
+
+        table = self._build_table(thresholds)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        partial_path = path + ".partial"
+        with open(partial_path, "wb") as table_file:
+            np.save(table_file, table)
+        os.rename(partial_path, path)
+        return table
+
+    def _build_table(self, thresholds):
+        hue_min, hue_max, sat_min, sat_max, val_min, val_max = thresholds
+
+        # Every colour once, laid out so that its position is its index
+        colours = np.arange(1 << 24, dtype=np.dtype("<u4"))
+        colours = colours.view(np.uint8).reshape(4096, 4096, 4)
+        colours = np.ascontiguousarray(colours[:, :, :3])
+
+        hsv = cv2.cvtColor(colours, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, np.array([hue_min, sat_min, val_min]),
+                           np.array([hue_max, sat_max, val_max]))
+        return np.packbits(mask.ravel() > 0)
 
 
 class MovingAverageBackgroundSubtractor(object):
+    """
+    The background can be updated just inside some regions with
+    segment_regions.  The updates skipped outside them are caught up on
+    the next full segment, as if those pixels had kept the value they have
+    then.
+    """
+
+    cost = 1
+    stateful = True
+
     def __init__(self, alpha):
         self.alpha = alpha
         self.background = None
+        self.threshold = None
+        self.pending_frames = 0
+
+        # Only needed once regions are updated on their own
+        self.frames_seen = 0
+        self.last_updated = None
+
+    def age(self, frames=1):
+        """
+        Ages the background as if it had seen frames more frames like the
+        next one it segments.
+        """
+        if self.last_updated is None:
+            self.pending_frames += frames
+        else:
+            self.frames_seen += frames
+
+    def checkpoint_state(self):
+        return {"background": _copy(self.background),
+                "threshold": self.threshold,
+                "pending_frames": self.pending_frames,
+                "frames_seen": self.frames_seen,
+                "last_updated": _copy(self.last_updated)}
+
+    def restore_state(self, state):
+        self.background = state["background"]
+        self.threshold = state["threshold"]
+        self.pending_frames = state["pending_frames"]
+        self.frames_seen = state["frames_seen"]
+        self.last_updated = state["last_updated"]
 
     def segment(self, current_image):
-        grayscale = cv2.cvtColor(current_image, cv2.COLOR_BGR2GRAY)
+        grayscale = as_frame(current_image).gray
+        self.frames_seen += 1
 
         if self.background is None:
             self.background = np.zeros(np.shape(grayscale))
 
-        self.background = ((1 - self.alpha) * self.background +
-                           self.alpha * grayscale)
+        if self.last_updated is None:
+            alpha = aged_weight(self.alpha, self.pending_frames)
+            self.pending_frames = 0
+            self.background = ((1 - alpha) * self.background +
+                               alpha * grayscale)
+        else:
+            self._catch_up(self.background, grayscale, self.last_updated)
 
         moving_pixels = np.abs(self.background - grayscale)
         moving_pixels = moving_pixels.astype(np.uint8)
@@ -83,15 +366,269 @@ class MovingAverageBackgroundSubtractor(object):
         # when otsu flag specified, the passed in threshold is not used
         threshold, _ = cv2.threshold(moving_pixels, -1, MAX_PIXEL_VALUE,
                                      cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        self.threshold = threshold
 
         _, segmented = cv2.threshold(moving_pixels, threshold, MAX_PIXEL_VALUE,
                                      cv2.THRESH_BINARY)
         return segmented
 
+    def segment_regions(self, current_image, regions):
+        """
+        Updates the background and segments only inside the given regions.
+        The threshold found by the last full segment is reused.
+        """
+        frame = as_frame(current_image)
+        if self.background is None or self.threshold is None:
+            return self.segment(frame)
+
+        self.frames_seen += 1
+        if self.last_updated is None:
+            self.last_updated = np.empty(self.background.shape, np.int32)
+            self.last_updated.fill(self.frames_seen - 1 - self.pending_frames)
+            self.pending_frames = 0
+
+        segmented = np.zeros(self.background.shape, np.uint8)
+        for x, y, w, h in regions:
+            roi = (slice(y, y + h), slice(x, x + w))
+            grayscale = frame.gray[roi]
+
+            self._catch_up(self.background[roi], grayscale,
+                           self.last_updated[roi])
+
+            moving_pixels = np.abs(self.background[roi] - grayscale)
+            moving_pixels = moving_pixels.astype(np.uint8)
+            _, segmented[roi] = cv2.threshold(moving_pixels, self.threshold,
+                                              MAX_PIXEL_VALUE,
+                                              cv2.THRESH_BINARY)
+        return segmented
+
+    def _catch_up(self, background, grayscale, last_updated):
+        # n skipped updates towards the same value have the same effect as
+        # one update with weight 1 - (1 - alpha)^n.  Pixels already updated
+        # this frame (in overlapping regions) have n = 0 and don't change.
+        skipped = self.frames_seen - last_updated
+        weight = 1 - np.power(1 - self.alpha, skipped)
+        background += weight * (grayscale - background)
+        last_updated[...] = self.frames_seen
+
+
+class InPlaceMovingAverageBackgroundSubtractor(object):
+    """
+    The same moving average background subtraction as
+    MovingAverageBackgroundSubtractor, but with a float32 background which
+    is updated in place and every intermediate image kept in a
+    preallocated buffer, so nothing frame-sized is allocated per frame.
+    Otsu's threshold is found and applied in a single pass.
+
+    With hysteresis_ratio, pixels which differ by more than that fraction
+    of Otsu's threshold are also foreground where they are connected to
+    pixels above it, so that fish close in colour to the background
+    aren't broken up.
+
+    The mask returned is reused, so it is only valid until the next call.
+    """
+
+    cost = 1
+    stateful = True
+
+    def __init__(self, alpha, hysteresis_ratio=None):
+        self.alpha = alpha
+        self.hysteresis_ratio = hysteresis_ratio
+        self.background = None
+        self.threshold = None
+        self.pending_frames = 0
+
+        self._grayscale = None
+        self._difference = None
+        self._moving_pixels = None
+        self._segmented = None
+
+    def segment(self, current_image):
+        grayscale = as_frame(current_image).gray
+
+        if self.background is None:
+            self.background = np.zeros(grayscale.shape, np.float32)
+        if self._segmented is None:
+            self._grayscale = np.empty(grayscale.shape, np.float32)
+            self._difference = np.empty(grayscale.shape, np.float32)
+            self._moving_pixels = np.empty(grayscale.shape, np.uint8)
+            self._segmented = np.empty(grayscale.shape, np.uint8)
+
+        # background = (1 - alpha) * background + alpha * grayscale
+        alpha = aged_weight(self.alpha, self.pending_frames)
+        self.pending_frames = 0
+        cv2.accumulateWeighted(grayscale, self.background, alpha)
+
+        np.copyto(self._grayscale, grayscale)
+        cv2.absdiff(self.background, self._grayscale, self._difference)
+        # Truncates, like astype
+        np.copyto(self._moving_pixels, self._difference, casting="unsafe")
+
+        # when otsu flag specified, the passed in threshold is not used
+        self.threshold, _ = cv2.threshold(self._moving_pixels, 0,
+                                          MAX_PIXEL_VALUE,
+                                          cv2.THRESH_BINARY | cv2.THRESH_OTSU,
+                                          self._segmented)
+        if self.hysteresis_ratio is not None:
+            hysteresis_threshold(self._moving_pixels,
+                                 self.hysteresis_ratio * self.threshold,
+                                 self.threshold, self._segmented)
+        return self._segmented
+
+    def age(self, frames=1):
+        """
+        Ages the background as if it had seen frames more frames like the
+        next one it segments.
+        """
+        self.pending_frames += frames
+
+    def checkpoint_state(self):
+        return {"background": _copy(self.background),
+                "threshold": self.threshold,
+                "pending_frames": self.pending_frames}
+
+    def restore_state(self, state):
+        self.background = state["background"]
+        self.threshold = state["threshold"]
+        self.pending_frames = state["pending_frames"]
+
+
+class BlockMovingAverageBackgroundSubtractor(object):
+    """
+    The same moving average background subtraction as
+    InPlaceMovingAverageBackgroundSubtractor, computed for a whole block of
+    frames at once, for offline runs where frames can be read ahead.
+
+    The block is processed a strip of strip_rows rows at a time: the strip
+    of the float32 background is updated through every frame of the block
+    while it is still in cache, rather than the whole background being
+    read and written once per frame.  Only Otsu's threshold, which needs
+    the whole difference image, is found frame by frame afterwards.
+
+    segment_block stores each frame's mask in the frame, and segment then
+    returns it; a frame which wasn't in a block is processed on its own.
+    The masks are the same as InPlaceMovingAverageBackgroundSubtractor's,
+    and are reused, so they are only valid until the next block.
+
+    Every frame of a block is in the background, so age does nothing.
+    """
+
+    cost = 1
+    stateful = True
+
+    def __init__(self, alpha, strip_rows=16):
+        self.alpha = alpha
+        self.strip_rows = strip_rows
+        self.background = None
+        self.threshold = None
+        self.frames_seen = 0
+
+        self._key = ("block moving average", id(self))
+        self._grayscale = None
+        self._difference = None
+        self._differences = None
+        self._segmented = None
+
+    def segment(self, current_image):
+        frame = as_frame(current_image)
+        return frame.memoize(self._key, lambda: self._update([frame])[0])
+
+    def segment_block(self, frames):
+        """
+        Updates the background over a block of frames, in order, and keeps
+        the mask of each in the frame for segment.
+        """
+        frames = [as_frame(frame) for frame in frames]
+        segmented = self._update(frames)
+
+        for frame, mask in zip(frames, segmented):
+            frame.memoize(self._key, lambda mask=mask: mask)
+
+    def age(self, frames=1):
+        pass
+
+    def checkpoint_state(self):
+        return {"background": _copy(self.background),
+                "threshold": self.threshold,
+                "frames_seen": self.frames_seen}
+
+    def restore_state(self, state):
+        self.background = state["background"]
+        self.threshold = state["threshold"]
+        self.frames_seen = state["frames_seen"]
+
+    def _update(self, frames):
+        num_frames = len(frames)
+        grayscales = [frame.gray for frame in frames]
+        height, width = grayscales[0].shape[:2]
+        self._allocate(num_frames, height, width)
+
+        if self.background is None:
+            self.background = np.zeros((height, width), np.float32)
+
+        differences = self._differences[:num_frames]
+        for start in xrange(0, height, self.strip_rows):
+            rows = slice(start, min(height, start + self.strip_rows))
+            background = self.background[rows]
+            grayscale = self._grayscale[:background.shape[0]]
+            difference = self._difference[:background.shape[0]]
+
+            for grayscale_image, moving_pixels in zip(grayscales,
+                                                      differences):
+                # background = (1 - alpha) * background + alpha * grayscale
+                cv2.accumulateWeighted(grayscale_image[rows], background,
+                                       self.alpha)
+                np.copyto(grayscale, grayscale_image[rows])
+                cv2.absdiff(background, grayscale, difference)
+                # Truncates, like astype
+                np.copyto(moving_pixels[rows], difference, casting="unsafe")
+
+        segmented = self._segmented[:num_frames]
+        for moving_pixels, mask in zip(differences, segmented):
+            # when otsu flag specified, the passed in threshold is not used
+            self.threshold, _ = cv2.threshold(
+                moving_pixels, 0, MAX_PIXEL_VALUE,
+                cv2.THRESH_BINARY | cv2.THRESH_OTSU, mask)
+
+        self.frames_seen += num_frames
+        return segmented
+
+    def _allocate(self, num_frames, height, width):
+        if (self._differences is not None and
+                len(self._differences) >= num_frames and
+                self._differences.shape[1:] == (height, width)):
+            return
+
+        self._grayscale = np.empty((self.strip_rows, width), np.float32)
+        self._difference = np.empty((self.strip_rows, width), np.float32)
+        self._differences = np.empty((num_frames, height, width), np.uint8)
+        self._segmented = np.empty((num_frames, height, width), np.uint8)
+
 
 class MixtureOfGaussiansBackgroundSubtractor(object):
+    """
+    Frames skipped with age are folded into the learning rate of the next
+    one, so the model adapts as much as it would have over all of them.
+    The mixture update is not linear, so this is only close to what
+    applying each frame would do.
+
+    OpenCV can't save the mixture itself, so a checkpoint keeps its
+    background image (or the last frame, where OpenCV can't produce one).
+    A restored model is primed with that image and then learns at the rate
+    it had reached, rather than starting over.
+    """
+
+    cost = 3
+    stateful = True
+
     def __init__(self):
+        self.frames_seen = 0
+        self.pending_frames = 0
+        self.last_grayscale = None
+        self._prime = None
+
         history = 1000 # any value > 0; default 200
+        self.history = history
         num_gaussians = 5 # can be from 1 - 8; default 5
         background_ratio = 0.8 # any value > 0 and < 1; default 0.7
         noise_sigma = 0.5 # any value > 0; default 15
@@ -100,30 +637,587 @@ class MixtureOfGaussiansBackgroundSubtractor(object):
                                                                  noise_sigma)
 
     def segment(self, current_image):
-        grayscale = cv2.cvtColor(current_image, cv2.COLOR_BGR2GRAY)
-        learning_rate = -1 # > 0 and < 1; -1 for automatically calculated value
+        grayscale = as_frame(current_image).gray
+        self.last_grayscale = grayscale
+
+        if self._prime is not None:
+            self.background_subtractor.apply(self._prime, None, 1)
+            self._prime = None
+
+        learning_rate = self._learning_rate()
         return self.background_subtractor.apply(grayscale, None, learning_rate)
 
+    def age(self, frames=1):
+        self.pending_frames += frames
+
+    def checkpoint_state(self):
+        if hasattr(self.background_subtractor, "getBackgroundImage"):
+            background = self.background_subtractor.getBackgroundImage()
+        else:
+            background = _copy(self.last_grayscale)
+
+        return {"background": background,
+                "frames_seen": self.frames_seen,
+                "pending_frames": self.pending_frames}
+
+    def restore_state(self, state):
+        self._prime = state["background"]
+        self.frames_seen = state["frames_seen"]
+        self.pending_frames = state["pending_frames"]
+
+    def _learning_rate(self):
+        previous_frames = self.frames_seen
+        self.frames_seen += 1 + self.pending_frames
+        self.pending_frames = 0
+
+        if previous_frames == 0:
+            return -1 # > 0 and < 1; -1 for automatically calculated value
+
+        # The automatic rate for the nth frame is 1 / min(n, history).  It
+        # is given explicitly, since the subtractor's own count of frames
+        # doesn't include the skipped ones.
+        if self.frames_seen == previous_frames + 1:
+            return 1. / min(self.frames_seen, self.history)
+
+        # The model keeps 1 - rate of itself each frame
+        kept = 1.
+        for n in xrange(previous_frames + 1, self.frames_seen + 1):
+            kept *= 1 - 1. / min(n, self.history)
+        return 1 - kept
+
+
+class EdgeBackgroundSubtractor(object):
+    """
+    Background subtraction on edges rather than intensities, so it can
+    reject the texture of the tank and the ripples on the water, which
+    keep producing edges in the same places.
+
+    The background is the probability of each pixel being on a Canny edge,
+    an exponentially decayed average of the edge images with weight alpha,
+    kept in a preallocated float32 buffer and updated in place.  Like the
+    edge images, it is scaled to MAX_PIXEL_VALUE rather than 1.  Edges
+    where (or within a pixel of where) that probability exceeds
+    background_threshold are background.  Cells of cell_size pixels
+    crossed by enough of the remaining edges (rather than a few noisy
+    pixels), and the cells around them, are foreground, so the mask
+    covers the whole outline of a fish and is cheap to narrow down in a
+    cascade.
+
+    With edge_scale, edges are found in the frame reduced by that factor.
+    The mask returned is reused, so it is only valid until the next call.
+    """
+
+    cost = 1
+    stateful = True
+
+    def __init__(self, scale=1.0, alpha=0.02, background_threshold=0.3,
+                 edge_scale=1.0, cell_size=16):
+        self.alpha = alpha
+        self.background_threshold = background_threshold
+        self.edge_scale = edge_scale
+        self.cell_size = max(1, int(round(cell_size * scale)))
+        self.canny_thresholds = (40, 100)
+
+        self.background = None
+        self.pending_frames = 0
+
+        self._grayscale = None
+        self._edges = None
+        self._background_edges = None
+        self._cells = None
+        self._segmented = None
+
+    def segment(self, current_image):
+        grayscale = as_frame(current_image).gray
+        height, width = grayscale.shape[:2]
+        if self._segmented is None:
+            self._allocate(width, height)
+
+        if self.edge_scale != 1.0:
+            cv2.resize(grayscale, self._grayscale.shape[::-1],
+                       self._grayscale, interpolation=cv2.INTER_AREA)
+            grayscale = self._grayscale
+        edges = cv2.Canny(grayscale, self.canny_thresholds[0],
+                          self.canny_thresholds[1], self._edges)
+
+        if self.background is None:
+            self.background = np.zeros(edges.shape, np.float32)
+            self.background[edges > 0] = MAX_PIXEL_VALUE
+
+        # background = (1 - alpha) * background + alpha * edges
+        alpha = aged_weight(self.alpha, self.pending_frames)
+        self.pending_frames = 0
+        cv2.accumulateWeighted(edges, self.background, alpha)
+
+        background_edges = cv2.compare(
+            self.background, self.background_threshold * MAX_PIXEL_VALUE,
+            cv2.CMP_GT, self._background_edges)
+        cv2.dilate(background_edges, None, background_edges)
+        cv2.subtract(edges, background_edges, edges)
+
+        # An edge crossing a cell covers about 1 / cell_size of it, so
+        # cells with half that are foreground, as are the cells next to them
+        cv2.resize(edges, self._cells.shape[::-1], self._cells,
+                   interpolation=cv2.INTER_AREA)
+        cv2.threshold(self._cells, MAX_PIXEL_VALUE / (2. * self.cell_size),
+                      MAX_PIXEL_VALUE, cv2.THRESH_BINARY, self._cells)
+        cv2.dilate(self._cells, None, self._cells)
+        return cv2.resize(self._cells, (width, height), self._segmented,
+                          interpolation=cv2.INTER_NEAREST)
+
+    def age(self, frames=1):
+        """
+        Ages the background as if it had seen frames more frames like the
+        next one it segments.
+        """
+        self.pending_frames += frames
+
+    def checkpoint_state(self):
+        return {"background": _copy(self.background),
+                "pending_frames": self.pending_frames}
+
+    def restore_state(self, state):
+        self.background = state["background"]
+        self.pending_frames = state["pending_frames"]
+
+    def _allocate(self, width, height):
+        edge_shape = (int(round(height * self.edge_scale)),
+                      int(round(width * self.edge_scale)))
+        self._grayscale = np.empty(edge_shape, np.uint8)
+        self._edges = np.empty(edge_shape, np.uint8)
+        self._background_edges = np.empty(edge_shape, np.uint8)
+        self._cells = np.empty(((height + self.cell_size - 1) //
+                                self.cell_size,
+                                (width + self.cell_size - 1) //
+                                self.cell_size), np.uint8)
+        self._segmented = np.empty((height, width), np.uint8)
+
+
+class OpticalFlowSegmenter(object):
+    """
+    Finds what is moving with sparse Lucas-Kanade optical flow, rather
+    than dense flow over the whole frame.
+
+    Flow is only computed at the points of a grid with grid_step spacing
+    where the frame differs from the previous one by more than
+    seed_threshold grey levels, or by half that next to such points (and,
+    with segment_regions, only inside the given regions).  The grid cell
+    around each point which moved further than speed_threshold pixels is
+    foreground, as are the cells of neighbouring points which moved half
+    as far.
+
+    The number of points tracked per frame is capped by max_points.  With
+    budget_seconds, the cap is also lowered whenever the flow takes longer
+    than that, and raised again while it keeps within it.  When there are
+    more seeds than the cap, the ones which changed the most are kept.
+    """
+
+    cost = 2
+    stateful = True
+
+    def __init__(self, scale=1.0, grid_step=8, seed_threshold=10,
+                 max_points=2000, budget_seconds=None):
+        self.grid_step = max(1, int(round(grid_step * scale)))
+        self.seed_threshold = seed_threshold
+        self.speed_threshold = 1.5 * scale
+        self.max_points = max_points
+        self.budget_seconds = budget_seconds
+
+        self.window_size = (15, 15)
+        self.pyramid_levels = 2
+
+        self.previous_grayscale = None
+        self.point_limit = max_points
+        self.points_tracked = 0
+
+    def segment(self, current_image):
+        return self._segment(as_frame(current_image), None)
+
+    def segment_regions(self, current_image, regions):
+        """
+        Only looks for motion inside the given regions.
+        """
+        return self._segment(as_frame(current_image), regions)
+
+    def age(self, frames=1):
+        # Nothing moved, so the previous frame is as good as any
+        pass
+
+    def checkpoint_state(self):
+        return {"previous_grayscale": _copy(self.previous_grayscale),
+                "point_limit": self.point_limit}
+
+    def restore_state(self, state):
+        self.previous_grayscale = state["previous_grayscale"]
+        self.point_limit = state["point_limit"]
+
+    def _segment(self, frame, regions):
+        grayscale = frame.gray
+        previous_grayscale = self.previous_grayscale
+        self.previous_grayscale = grayscale
+
+        height, width = grayscale.shape[:2]
+        step = self.grid_step
+        cells = np.zeros(((height + step - 1) // step,
+                          (width + step - 1) // step), np.uint8)
+
+        if previous_grayscale is not None:
+            points, cell_indices = self._seeds(previous_grayscale, grayscale,
+                                               regions)
+            if len(points) > 0:
+                speeds = np.zeros(cells.shape, np.float32)
+                speeds.flat[cell_indices] = self._speeds(previous_grayscale,
+                                                         grayscale, points)
+                hysteresis_threshold(speeds, self.speed_threshold / 2.,
+                                     self.speed_threshold, cells)
+
+        segmented = cv2.resize(cells, (cells.shape[1] * step,
+                                       cells.shape[0] * step),
+                               interpolation=cv2.INTER_NEAREST)
+        return segmented[:height, :width]
+
+    def _seeds(self, previous_grayscale, grayscale, regions):
+        step = self.grid_step
+        offset = step // 2
+        sampled = (slice(offset, None, step), slice(offset, None, step))
+        difference = cv2.absdiff(previous_grayscale[sampled],
+                                 grayscale[sampled])
+
+        if regions is not None:
+            in_regions = np.zeros(difference.shape, bool)
+            for x, y, w, h in regions:
+                in_regions[(y + step - 1 - offset) // step:
+                           (y + h + step - 1 - offset) // step,
+                           (x + step - 1 - offset) // step:
+                           (x + w + step - 1 - offset) // step] = True
+            difference[~in_regions] = 0
+
+        # Each sample lies in the cell of the same index
+        cell_width = (grayscale.shape[1] + step - 1) // step
+        seeds = hysteresis_threshold(difference, self.seed_threshold / 2.,
+                                     self.seed_threshold)
+        rows, columns = np.nonzero(seeds)
+
+        limit = self.point_limit
+        if len(rows) > limit:
+            keep = np.argpartition(-difference[rows, columns],
+                                   limit - 1)[:limit]
+            rows = rows[keep]
+            columns = columns[keep]
+
+        points = np.empty((len(rows), 1, 2), np.float32)
+        points[:, 0, 0] = columns * step + offset
+        points[:, 0, 1] = rows * step + offset
+        return points, rows * cell_width + columns
+
+    def _speeds(self, previous_grayscale, grayscale, points):
+        start_time = time.time()
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(
+            previous_grayscale, grayscale, points, None,
+            winSize=self.window_size, maxLevel=self.pyramid_levels)
+        self._record_time(time.time() - start_time, len(points))
+
+        # Points which couldn't be followed count as still
+        displacement = np.sqrt(np.sum(np.square(new_points - points),
+                                      axis=2)).reshape(-1)
+        displacement[status.reshape(-1) != 1] = 0
+        return displacement
+
+    def _record_time(self, seconds, num_points):
+        self.points_tracked = num_points
+        if self.budget_seconds is None:
+            return
+
+        # Building the image pyramids costs the same however many points
+        # there are, so rather than predict the time per point, back off
+        # quickly when over budget and creep back up when under it
+        if seconds > self.budget_seconds:
+            self.point_limit = max(1, int(self.point_limit * 0.75))
+        elif num_points >= self.point_limit:
+            self.point_limit = min(self.max_points,
+                                   int(self.point_limit * 1.1) + 1)
+
+
+class SegmenterTiming(object):
+    """
+    How long one segmenter has taken.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total_seconds = 0.
+        self.last_seconds = 0.
+
+    @property
+    def mean_seconds(self):
+        if self.calls == 0:
+            return 0.
+        return self.total_seconds / self.calls
+
+    def record(self, seconds):
+        self.calls += 1
+        self.total_seconds += seconds
+        self.last_seconds = seconds
+
+    def __str__(self):
+        return "%s: %.2f ms/frame" % (self.name, 1000 * self.mean_seconds)
+
 
 class CompositeSegmentationAlgorithm(object):
     """
     Performs logical AND operation on the segmentation results of the 
     component segmentation algorithms.
+
+    The algorithms can run concurrently on a pool of threads, since the
+    OpenCV calls they spend their time in release the GIL.
+
+    As a cascade, the algorithms run cheapest first, and later stateless
+    algorithms only look inside the regions (grown by margin) that are
+    still foreground after the earlier ones.  Stateful algorithms which
+    support it update just those regions too, with their whole model
+    brought up to date every refresh_interval frames; the others always
+    see the whole frame so their models stay current.  The stages of a
+    cascade depend on each other, so they can't run on threads.
+
+    The time taken by each algorithm is recorded in timings.
     """
 
-    def __init__(self, algorithms):
+    def __init__(self, algorithms, cascade=False, margin=32,
+                 refresh_interval=10, threads=0):
+        if cascade and threads > 0:
+            raise ValueError("A cascade can't run its stages on threads.")
+
         self.algorithms = algorithms
+        self.cascade = cascade
+        self.margin = margin
+        self.refresh_interval = refresh_interval
+        self.frames_seen = 0
+
+        if cascade:
+            # sorted is stable, so equal costs keep their given order
+            self.algorithms = sorted(algorithms,
+                                     key=lambda algorithm: algorithm.cost)
+
+        self.timings = [SegmenterTiming(type(algorithm).__name__)
+                        for algorithm in self.algorithms]
+
+        self.pool = None
+        if threads > 0:
+            self.pool = ThreadPool(threads)
+
+    @property
+    def critical_path(self):
+        """
+        The timing of the slowest algorithm, which bounds how fast the
+        algorithms can run concurrently.
+        """
+        return max(self.timings, key=lambda timing: timing.mean_seconds)
+
+    def timing_report(self):
+        lines = [str(timing) for timing in self.timings]
+        lines.append("Critical path: %s" % self.critical_path.name)
+        return "\n".join(lines)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
 
     def segment(self, current_image):
-        overall_segmentation = None
+        frame = as_frame(current_image)
+
+        if self.cascade:
+            return self._segment_cascade(frame)
+
+        indices = range(len(self.algorithms))
+        segment = lambda index: self._timed(index, "segment", frame)
 
+        if self.pool is None:
+            segmentations = map(segment, indices)
+        else:
+            segmentations = self.pool.map(segment, indices)
+
+        overall_segmentation = segmentations[0]
+        is_shared = True
+        for segmentation in segmentations[1:]:
+            overall_segmentation = self._and(overall_segmentation,
+                                             segmentation, is_shared)
+            is_shared = False
+
+        return overall_segmentation
+
+    def age(self, frames=1):
+        """
+        Ages the stateful algorithms over frames which were skipped.
+        """
         for algorithm in self.algorithms:
-            segmentation = algorithm.segment(current_image)
+            if hasattr(algorithm, "age"):
+                algorithm.age(frames)
+
+    def segment_block(self, frames):
+        """
+        Lets the algorithms which can process a block of frames at once do
+        so, ahead of the frames being segmented in order.
+        """
+        for algorithm in self.algorithms:
+            if hasattr(algorithm, "segment_block"):
+                algorithm.segment_block(frames)
+
+    def checkpoint_state(self):
+        return {"frames_seen": self.frames_seen,
+                "algorithms": [algorithm.checkpoint_state()
+                               if hasattr(algorithm, "checkpoint_state")
+                               else None
+                               for algorithm in self.algorithms]}
+
+    def restore_state(self, state):
+        self.frames_seen = state["frames_seen"]
+        for algorithm, algorithm_state in zip(self.algorithms,
+                                              state["algorithms"]):
+            if algorithm_state is not None:
+                algorithm.restore_state(algorithm_state)
 
+    def segment_regions(self, current_image, regions):
+        """
+        Segments only inside the given regions, which are found by the
+        caller.  Algorithms are restricted to the regions as they would be
+        in a cascade; everything outside the regions is background as
+        long as there is at least one stateless algorithm.
+        """
+        frame = as_frame(current_image)
+        self.frames_seen += 1
+        is_refresh = self.frames_seen % self.refresh_interval == 0
+
+        overall_segmentation = None
+        is_shared = True
+        for index in xrange(len(self.algorithms)):
+            segmentation = self._segment_stage(index, frame, regions,
+                                               is_refresh)
             if overall_segmentation is None:
                 overall_segmentation = segmentation
             else:
-                overall_segmentation &= segmentation
+                overall_segmentation = self._and(overall_segmentation,
+                                                 segmentation, is_shared)
+                is_shared = False
+
+        return overall_segmentation
+
+    def _segment_cascade(self, frame):
+        self.frames_seen += 1
+        is_refresh = self.frames_seen % self.refresh_interval == 0
+
+        overall_segmentation = self._timed(0, "segment", frame)
+        is_shared = True
+
+        for index in xrange(1, len(self.algorithms)):
+            regions = candidate_regions(overall_segmentation, self.margin)
+            if not self.algorithms[index].stateful and len(regions) == 0:
+                continue
+
+            segmentation = self._segment_stage(index, frame, regions,
+                                               is_refresh)
+            overall_segmentation = self._and(overall_segmentation,
+                                             segmentation, is_shared)
+            is_shared = False
+
+        return overall_segmentation
+
+    def _segment_stage(self, index, frame, regions, is_refresh):
+        algorithm = self.algorithms[index]
+
+        if not algorithm.stateful:
+            return self._timed(index, "regions", frame, regions)
+        elif is_refresh or not hasattr(algorithm, "segment_regions"):
+            return self._timed(index, "segment", frame)
+        else:
+            return self._timed(index, "segment_regions", frame, regions)
+
+    def _timed(self, index, method, frame, regions=None):
+        algorithm = self.algorithms[index]
+
+        start_time = time.time()
+        if method == "segment":
+            segmentation = algorithm.segment(frame)
+        elif method == "regions":
+            segmentation = segment_regions(algorithm, frame, regions)
+        else:
+            segmentation = algorithm.segment_regions(frame, regions)
+        self.timings[index].record(time.time() - start_time)
+
+        return segmentation
+
+    def _and(self, overall_segmentation, segmentation, is_shared):
+        if is_shared:
+            # The first segmentation may be shared through the frame, so
+            # it can't be modified in place.
+            return cv2.bitwise_and(overall_segmentation, segmentation)
 
+        cv2.bitwise_and(overall_segmentation, segmentation,
+                        overall_segmentation)
         return overall_segmentation
 
+
+class PyramidSegmentationAlgorithm(object):
+    """
+    Segments coarse to fine.  The coarse segmenter looks at the whole frame
+    reduced levels times by an image pyramid, to find where the fish
+    might be.  The fine segmenter (a CompositeSegmentationAlgorithm) then
+    refines the mask at full resolution only inside those regions, grown
+    by margin full resolution pixels.
+
+    The coarse segmenter and its algorithms should be created for frames
+    at 1 / 2^levels of the scale the fine ones are.
+    """
+
+    def __init__(self, coarse, fine, levels=2, margin=32):
+        self.coarse = coarse
+        self.fine = fine
+        self.levels = levels
+        self.margin = margin
+
+    def segment(self, current_image):
+        frame = as_frame(current_image)
+        factor = 2 ** self.levels
+
+        coarse_segmentation = self.coarse.segment(frame.reduced(self.levels))
+
+        # Each coarse pixel covers factor x factor full resolution pixels
+        height, width = frame.shape[:2]
+        regions = []
+        for x, y, w, h in candidate_regions(
+                coarse_segmentation, (self.margin + factor - 1) // factor,
+                cell_size=max(1, 8 // factor)):
+            x0 = x * factor
+            y0 = y * factor
+            regions.append((x0, y0, min(width, (x + w) * factor) - x0,
+                            min(height, (y + h) * factor) - y0))
+
+        return self.fine.segment_regions(frame, regions)
+
+    def age(self, frames=1):
+        self.coarse.age(frames)
+        self.fine.age(frames)
+
+    def segment_block(self, frames):
+        frames = [as_frame(frame) for frame in frames]
+        self.coarse.segment_block([frame.reduced(self.levels)
+                                   for frame in frames])
+        self.fine.segment_block(frames)
+
+    def checkpoint_state(self):
+        return {"coarse": self.coarse.checkpoint_state(),
+                "fine": self.fine.checkpoint_state()}
+
+    def restore_state(self, state):
+        self.coarse.restore_state(state["coarse"])
+        self.fine.restore_state(state["fine"])
+
+    def timing_report(self):
+        return "Coarse:\n%s\nFine:\n%s" % (self.coarse.timing_report(),
+                                             self.fine.timing_report())
+
+    def close(self):
+        self.coarse.close()
+        self.fine.close()
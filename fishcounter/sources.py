@@ -0,0 +1,362 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Sources of frames to be analyzed.
+
+A frame source behaves like cv2.VideoCapture: read() returns a flag and an
+image, and the flag is False (with no image) only once the end of the
+stream has been reached.  read() may be given a preallocated image to
+decode into; sources which can't use it return an image of their own.
+"""
+
+import collections
+import io
+import os
+import stat
+import sys
+import threading
+
+import cv2
+import numpy as np
+
+
+def _capture_property(name):
+    """
+    Looks up a VideoCapture property id, which lives in cv2.cv in
+    OpenCV 2.4 and in cv2 itself from OpenCV 3 onwards.
+    """
+    if hasattr(cv2, "CAP_PROP_" + name):
+        return getattr(cv2, "CAP_PROP_" + name)
+    return getattr(cv2.cv, "CV_CAP_PROP_" + name)
+
+
+class FrameSource(object):
+    """
+    Base class for frame sources.
+    """
+
+    # Live sources produce frames in real time whether or not they are
+    # being read.
+    is_live = False
+
+    @property
+    def fps(self):
+        """
+        Frames per second, or 0 if unknown.
+        """
+        return 0.
+
+    @property
+    def frame_count(self):
+        """
+        Number of frames in the source, or 0 if unknown.
+        """
+        return 0
+
+    def is_opened(self):
+        return True
+
+    def read(self, image=None):
+        raise NotImplementedError()
+
+    def grab(self):
+        """
+        Advances past the next frame, without necessarily decoding it.
+        """
+        frame_was_read, _ = self.read()
+        return frame_was_read
+
+    def seek(self, frame_number):
+        """
+        Tries to position the source so that frame_number is read next.
+
+        Returns the number of the frame that will actually be read next,
+        which may be earlier than requested, or None if the source can't
+        seek.
+        """
+        return None
+
+    def release(self):
+        pass
+
+
+class CaptureSource(FrameSource):
+    """
+    Frames from cv2.VideoCapture: a video file, a stream URL or a camera
+    index.
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self.capture = cv2.VideoCapture(location)
+        self.is_live = (isinstance(location, int) or "://" in location)
+
+    def __str__(self):
+        return str(self.location)
+
+    @property
+    def fps(self):
+        return self.capture.get(_capture_property("FPS"))
+
+    @property
+    def frame_count(self):
+        return max(0, int(self.capture.get(_capture_property("FRAME_COUNT"))))
+
+    def is_opened(self):
+        return self.capture.isOpened()
+
+    def read(self, image=None):
+        return self.capture.read(image)
+
+    def grab(self):
+        return self.capture.grab()
+
+    def seek(self, frame_number):
+        position_property = _capture_property("POS_FRAMES")
+
+        if not self.capture.set(position_property, frame_number):
+            return None
+
+        # Some backends can only seek to keyframes, and report where they
+        # actually ended up.
+        position = int(self.capture.get(position_property))
+        if position > frame_number:
+            # Overshot: start again from the beginning.
+            self.capture.release()
+            self.capture = cv2.VideoCapture(self.location)
+            position = 0
+
+        return position
+
+    def release(self):
+        self.capture.release()
+
+
+class RawFrameSource(FrameSource):
+    """
+    Raw BGR frames of a known size from a file, pipe or FIFO, such as the
+    output of ``ffmpeg -f rawvideo -pix_fmt bgr24 -``.  A location of "-"
+    reads from standard input.
+    """
+
+    def __init__(self, location, width, height, fps=0.):
+        self.location = location
+        self.shape = (height, width, 3)
+        self.frame_size = width * height * 3
+        self._fps = fps
+
+        if location == "-":
+            self.stream = io.open(sys.stdin.fileno(), "rb", closefd=False)
+        else:
+            self.stream = io.open(location, "rb")
+
+        self.is_live = location == "-" or _is_fifo(location)
+
+    def __str__(self):
+        return str(self.location)
+
+    @property
+    def fps(self):
+        return self._fps
+
+    def read(self, image=None):
+        if image is None or image.shape != self.shape:
+            image = np.empty(self.shape, np.uint8)
+        data = image.reshape(-1)
+
+        bytes_read = 0
+        while bytes_read < self.frame_size:
+            # Pipes may return less than was asked for.
+            n = self.stream.readinto(data[bytes_read:])
+            if not n:
+                # A partial frame at the end of the stream is discarded.
+                return False, None
+            bytes_read += n
+
+        return True, image
+
+    def release(self):
+        self.stream.close()
+
+
+class StackSource(FrameSource):
+    """
+    Frames from an array holding a stack of images, indexed by frame along
+    the first axis.  Each frame read is a view into the array.
+    """
+
+    def __init__(self, frames, fps=0.):
+        self.frames = frames
+        self.position = 0
+        self._fps = fps
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @property
+    def frame_count(self):
+        return len(self.frames)
+
+    def read(self, image=None):
+        # Frames are returned as views, so there's nothing to decode into.
+        if self.position >= len(self.frames):
+            return False, None
+
+        frame = self.frames[self.position]
+        self.position += 1
+        return True, frame
+
+    def grab(self):
+        if self.position >= len(self.frames):
+            return False
+        self.position += 1
+        return True
+
+    def seek(self, frame_number):
+        self.position = min(frame_number, len(self.frames))
+        return self.position
+
+
+class NumpySource(StackSource):
+    """
+    Frames from a .npy file holding a stack of images.  The file is
+    memory-mapped, and frames are copy-on-write views of it.
+    """
+
+    def __init__(self, location, fps=0.):
+        super(NumpySource, self).__init__(np.load(location, mmap_mode="c"),
+                                          fps)
+        self.location = location
+
+    def __str__(self):
+        return str(self.location)
+
+
+class LiveSource(FrameSource):
+    """
+    Reads another source continuously on a background thread, keeping only
+    the newest buffer_size frames.  If analysis falls behind, the oldest
+    frames are dropped rather than building up latency.
+    """
+
+    is_live = True
+
+    def __init__(self, source, buffer_size=1):
+        self.source = source
+        self.frames_dropped = 0
+
+        self._frames = collections.deque(maxlen=buffer_size)
+        self._frame_available = threading.Condition()
+        self._ended = False
+        self._stopped = False
+
+        self._reader = threading.Thread(target=self._read_frames,
+                                        name="live-source")
+        self._reader.daemon = True
+        self._reader.start()
+
+    def __str__(self):
+        return str(self.source)
+
+    @property
+    def fps(self):
+        return self.source.fps
+
+    def is_opened(self):
+        return self.source.is_opened()
+
+    def _read_frames(self):
+        frame_was_read = True
+        while frame_was_read and not self._stopped:
+            frame_was_read, image = self.source.read()
+
+            with self._frame_available:
+                if not frame_was_read:
+                    self._ended = True
+                else:
+                    if len(self._frames) == self._frames.maxlen:
+                        self.frames_dropped += 1
+                    self._frames.append(image)
+
+                self._frame_available.notify()
+
+    def read(self, image=None):
+        # Frames are read on a background thread; image is not used.
+        with self._frame_available:
+            while len(self._frames) == 0 and not self._ended:
+                self._frame_available.wait()
+
+            if len(self._frames) == 0:
+                return False, None
+
+            return True, self._frames.popleft()
+
+    def release(self):
+        self._stopped = True
+        self.source.release()
+
+
+def _is_fifo(location):
+    return os.path.exists(location) and stat.S_ISFIFO(os.stat(location).st_mode)
+
+
+def parse_frame_size(frame_size):
+    """
+    Converts a frame size of the form WIDTHxHEIGHT to a (width, height)
+    tuple.
+    """
+    try:
+        width, height = [int(n) for n in frame_size.lower().split("x")]
+    except ValueError:
+        raise ValueError("Invalid frame size: %s" % frame_size)
+    return width, height
+
+
+def open_source(location, raw_size=None, live=None, buffer_size=1):
+    """
+    Opens a frame source for a location given on the command line.
+
+    location may be a video file, a .npy stack, a camera index, a stream
+    URL, or a file or FIFO of raw BGR frames (with raw_size giving their
+    (width, height)); "-" reads raw frames from standard input.
+
+    Live sources (cameras, streams, FIFOs and standard input) are read on a
+    background thread which drops the oldest frames if analysis falls
+    behind.  Pass live to override whether a source is treated as live.
+    """
+    if raw_size is not None:
+        source = RawFrameSource(location, *raw_size)
+    elif location == "-":
+        raise ValueError("Reading from standard input needs a raw frame size.")
+    elif location.isdigit():
+        source = CaptureSource(int(location))
+    elif location.lower().endswith(".npy"):
+        source = NumpySource(location)
+    else:
+        source = CaptureSource(location)
+
+    if live is None:
+        live = source.is_live
+
+    if live:
+        return LiveSource(source, buffer_size)
+    return source
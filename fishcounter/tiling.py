@@ -0,0 +1,116 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Splits large frames into overlapping tiles which are processed on worker
+threads.
+"""
+
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from fishcounter.frame import as_frame
+
+
+class Tiler(object):
+    """
+    Applies a local operation to a frame tile by tile, on a pool of
+    threads (OpenCV releases the GIL, so the tiles really run in
+    parallel).
+
+    Each tile is processed with a halo of neighbouring pixels around it,
+    and only its interior is kept.  As long as the halo is at least the
+    operation's reach (how far away a pixel can affect the output), there
+    are no seams: the assembled result is identical to processing the
+    whole frame at once.  At the edges of the frame, tiles see the real
+    border just as the whole frame would.
+    """
+
+    def __init__(self, columns=2, rows=2, threads=None):
+        self.columns = columns
+        self.rows = rows
+
+        if threads is None:
+            threads = columns * rows
+        self.pool = ThreadPool(threads)
+
+    def tiles(self, shape, halo):
+        """
+        Returns (interior, outer) pairs of (x, y, width, height) rectangles
+        covering an image of the given shape, where outer is the interior
+        grown by halo and clipped to the image.
+        """
+        height, width = shape[:2]
+
+        tiles = []
+        for row in xrange(self.rows):
+            y0 = row * height // self.rows
+            y1 = (row + 1) * height // self.rows
+            for column in xrange(self.columns):
+                x0 = column * width // self.columns
+                x1 = (column + 1) * width // self.columns
+
+                outer_x0 = max(0, x0 - halo)
+                outer_y0 = max(0, y0 - halo)
+                outer_x1 = min(width, x1 + halo)
+                outer_y1 = min(height, y1 + halo)
+
+                tiles.append(((x0, y0, x1 - x0, y1 - y0),
+                              (outer_x0, outer_y0, outer_x1 - outer_x0,
+                               outer_y1 - outer_y0)))
+        return tiles
+
+    def map_frame(self, function, current_image, halo):
+        """
+        Assembles a mask from function applied to Frames for each tile.
+        """
+        frame = as_frame(current_image)
+        return self._map(lambda outer: function(frame.region(outer)),
+                         frame.shape, halo)
+
+    def map_image(self, function, image, halo):
+        """
+        Assembles a mask from function applied to each tile of an image.
+        """
+        def process(outer):
+            x, y, width, height = outer
+            return function(image[y:y + height, x:x + width])
+
+        return self._map(process, image.shape, halo)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def _map(self, process, shape, halo):
+        assembled = np.empty(shape[:2], np.uint8)
+
+        def process_tile(tile):
+            (x, y, width, height), outer = tile
+            result = process(outer)
+
+            offset_x = x - outer[0]
+            offset_y = y - outer[1]
+            assembled[y:y + height, x:x + width] = result[
+                offset_y:offset_y + height, offset_x:offset_x + width]
+
+        self.pool.map(process_tile, self.tiles(shape, halo))
+        return assembled
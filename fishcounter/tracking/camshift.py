@@ -25,6 +25,7 @@ Tracking based on the Camshift algorithm.
 import cv2
 import numpy as np
 
+from fishcounter.frame import as_frame
 from fishcounter.segment import HSVColourSegmenter
 
 
@@ -34,12 +35,20 @@ class CamShiftTracker(object):
     moving or not.
     """
 
-    def __init__(self):
-        self.mask_detector = HSVColourSegmenter()
+    def __init__(self, scale=1.0):
+        self.mask_detector = HSVColourSegmenter(scale)
+        self.displacement_threshold = 6 * scale
 
     def track(self, current_image, frame_number, moving_objects, stationary_objects):
-        hsv = cv2.cvtColor(current_image, cv2.COLOR_BGR2HSV)
-        mask = self.mask_detector.segment(current_image)
+        if len(stationary_objects) == 0:
+            return moving_objects, stationary_objects
+
+        # The HSV image and colour mask are usually already computed by the
+        # segmentation of this frame.  A cascade only segments colours
+        # inside its regions, so then the mask is computed again here.
+        frame = as_frame(current_image)
+        hsv = frame.hsv
+        mask = self.mask_detector.segment(frame)
 
         for obj in stationary_objects:
             bbox = obj.bbox
@@ -85,7 +94,7 @@ class CamShiftTracker(object):
             displacement = np.sqrt(np.square(prev_center[0] - new_center[0]) +
                                    np.square(prev_center[1] - new_center[1]))
 
-            if displacement > 6:
+            if displacement > self.displacement_threshold:
                 stationary_objects.remove(obj)
                 moving_objects.append(obj)
 
@@ -35,9 +35,9 @@ class MultistageTracker(object):
     new objects) and CamshiftTracker to track stationary objects.
     """
 
-    def __init__(self):
-        self.shape_tracker = ShapeFeatureTracker()
-        self.camshift_tracker = CamShiftTracker()
+    def __init__(self, scale=1.0):
+        self.shape_tracker = ShapeFeatureTracker(scale)
+        self.camshift_tracker = CamShiftTracker(scale)
 
         self.potential_objects = []
         self.moving_objects = []
@@ -54,13 +54,13 @@ class MultistageTracker(object):
     def known_objects(self):
         return utils.join_lists(self.moving_objects, self.stationary_objects)
 
-    def track(self, current_image, contours):
+    def track(self, current_image, blobs):
         self.frame_number += 1
 
         # Handle moving objects
         potential, moving, stationary = self.shape_tracker.track(current_image,
                                                                  self.frame_number,
-                                                                 contours,
+                                                                 blobs,
                                                                  self.potential_objects,
                                                                  self.moving_objects,
                                                                  self.stationary_objects)
@@ -69,12 +69,7 @@ class MultistageTracker(object):
         self.stationary_objects = stationary
 
         # Handle stationary objects
-        moving, stationary = self.camshift_tracker.track(current_image,
-                                                         self.frame_number,
-                                                         self.moving_objects,
-                                                         self.stationary_objects)
-        self.moving_objects = moving
-        self.stationary_objects = stationary
+        self._track_stationary(current_image)
 
         # Sometimes moving_objects stop getting updated, usually because 
         # they were only a piece of a larger object that emerged.  Prune 
@@ -84,3 +79,38 @@ class MultistageTracker(object):
 #                                                         self.frame_number,
 #                                                         inactive_frames=10)
         
+
+    def track_stationary(self, current_image):
+        """
+        Tracks a frame in which nothing moved.  Only the stationary objects
+        are followed, since nothing new can have appeared.
+        """
+        self.frame_number += 1
+        self._track_stationary(current_image)
+
+    def checkpoint_state(self):
+        return {"potential_objects": self.potential_objects,
+                "moving_objects": self.moving_objects,
+                "stationary_objects": self.stationary_objects,
+                "frame_number": self.frame_number}
+
+    def restore_state(self, state):
+        self.potential_objects = state["potential_objects"]
+        self.moving_objects = state["moving_objects"]
+        self.stationary_objects = state["stationary_objects"]
+        self.frame_number = state["frame_number"]
+
+    def skip_frame(self):
+        """
+        Skips a frame which repeats the last one, keeping frame numbers in
+        step with the video.
+        """
+        self.frame_number += 1
+
+    def _track_stationary(self, current_image):
+        moving, stationary = self.camshift_tracker.track(current_image,
+                                                         self.frame_number,
+                                                         self.moving_objects,
+                                                         self.stationary_objects)
+        self.moving_objects = moving
+        self.stationary_objects = stationary
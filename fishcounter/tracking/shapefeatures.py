@@ -22,7 +22,6 @@
 Tracking based on shape features.
 """
 
-import cv2
 import numpy as np
 
 import utils
@@ -39,33 +38,20 @@ class ShapeFeatureTracker(object):
     orientation and area.
     """
 
-    def __init__(self):
-        self.matcher = ShapeMatcher()
+    def __init__(self, scale=1.0):
+        self.matcher = ShapeMatcher(scale)
         self.pruner = Pruner()
+        self.stationary_threshold = 2 * scale
 
-    def track(self, current_image, frame_number, contours, potential_objects, moving_objects, stationary_objects):
+    def track(self, current_image, frame_number, blobs, potential_objects, moving_objects, stationary_objects):
         all_moving_objects = utils.join_lists(potential_objects, moving_objects)
         known_objects = utils.join_lists(moving_objects, stationary_objects)
 
         frame_height, frame_width = current_image.shape[:2]
 
-        for contour in contours:
-            bounding_rect = cv2.boundingRect(contour)
-            bbox = BoundingBox(*bounding_rect)
-            new_obj = TrackedObject(bbox, contour, frame_number,
-                                    frame_width, frame_height)
-
-            if self.matcher.has_match(new_obj, stationary_objects):
-                continue
-
-            matches = self.matcher.find_matches(new_obj, all_moving_objects)
-            if len(matches) == 0:
-                if new_obj.is_near_edge():
-                    potential_objects.append(new_obj)
-            else:
-                # TODO: should we only update closest match?
-                for match in matches:
-                    match.update(bbox, contour, frame_number)
+        self._match_blobs(blobs, frame_number, frame_width, frame_height,
+                          potential_objects, all_moving_objects,
+                          stationary_objects)
 
         # Prune spurious potential objects
         potential_objects = self.pruner.prune_inactive(potential_objects,
@@ -84,18 +70,79 @@ class ShapeFeatureTracker(object):
             moving_objects.append(obj)
 
         # Find objects that were moving but have stopped
-        stopped_objs = [obj for obj in moving_objects if obj.is_not_moving()]
+        stopped_objs = [obj for obj in moving_objects
+                        if obj.is_not_moving(self.stationary_threshold)]
         for obj in stopped_objs:
             moving_objects.remove(obj)
             stationary_objects.append(obj)
 
         return potential_objects, moving_objects, stationary_objects
 
+    def _match_blobs(self, blobs, frame_number, frame_width, frame_height,
+                     potential_objects, all_moving_objects,
+                     stationary_objects):
+        # Every blob is compared against the objects as they were at the
+        # start of the frame at once.  Blobs are still handled in order,
+        # so objects which an earlier blob updated are compared again.
+        centres = blob_centres(blobs.bboxes)
+        is_stationary = self.matcher.match_matrix(
+            centres, blobs.areas, blobs.angles, stationary_objects).any(axis=1)
+        moving_matches = self.matcher.match_matrix(
+            centres, blobs.areas, blobs.angles, all_moving_objects)
+
+        updated = []
+        updated_ids = set()
+        for index in xrange(len(blobs)):
+            if is_stationary[index]:
+                continue
+
+            bbox = BoundingBox(*blobs.bbox(index))
+            area = blobs.areas[index]
+            angle = blobs.angles[index]
+            new_obj = TrackedObject(bbox, area, angle, frame_number,
+                                    frame_width, frame_height)
+
+            matches = set(all_moving_objects[match]
+                          for match in np.flatnonzero(moving_matches[index])
+                          if id(all_moving_objects[match]) not in updated_ids)
+            matches.update(obj for obj in updated
+                           if self.matcher.is_match(new_obj, obj))
+
+            if len(matches) == 0:
+                if new_obj.is_near_edge():
+                    potential_objects.append(new_obj)
+            else:
+                # TODO: should we only update closest match?
+                for match in matches:
+                    match.update(bbox, area, angle, frame_number)
+                    if id(match) not in updated_ids:
+                        updated.append(match)
+                        updated_ids.add(id(match))
+
+
+def blob_centres(bboxes):
+    """
+    The centres of bounding boxes given as an array of rows of (x, y,
+    width, height), the same as BoundingBox.center.
+    """
+    return np.column_stack((bboxes[:, 0] + bboxes[:, 2] // 2,
+                            bboxes[:, 1] + bboxes[:, 3] // 2))
+
 
 class ShapeMatcher(object):
-    def __init__(self):
+    """
+    Decides whether shapes are similar enough to be the same object.
+
+    match_matrix makes the decisions for many shapes and objects at once,
+    as array operations, with the same results as is_match.  Only pairs
+    whose centroids fall in neighbouring cells of a grid with cells as big
+    as centroid_threshold are compared, since no others can be close
+    enough.
+    """
+
+    def __init__(self, scale=1.0):
         # Thresholds for object similarity
-        self.centroid_threshold = 50 # Euclidean distance
+        self.centroid_threshold = 50 * scale # Euclidean distance
         self.area_threshold = 0.40 # the percent difference
         self.angle_threshold = 45 # in degrees
 
@@ -119,6 +166,81 @@ class ShapeMatcher(object):
                 self._is_area_match(obj1, obj2) and
                 self._is_angle_match(obj1, obj2))
 
+    def match_matrix(self, centres, areas, angles, search_objects):
+        """
+        Which of the shapes, given as arrays of their centres, areas and
+        angles, match which of the search objects, as a boolean matrix with
+        a row for each shape.
+        """
+        matrix = np.zeros((len(centres), len(search_objects)), bool)
+        if len(centres) == 0 or len(search_objects) == 0:
+            return matrix
+
+        object_centres = np.array([obj.center for obj in search_objects],
+                                  np.float64)
+        object_areas = np.array([obj.area for obj in search_objects],
+                                np.float64)
+        object_angles = np.array([obj.angle for obj in search_objects],
+                                 np.float64)
+
+        shapes, objects = self._candidate_pairs(
+            np.asarray(centres, np.float64), object_centres)
+
+        centres = np.asarray(centres, np.float64)[shapes]
+        object_centres = object_centres[objects]
+        is_centroid_match = (
+            np.sqrt(np.square(centres[:, 0] - object_centres[:, 0]) +
+                    np.square(centres[:, 1] - object_centres[:, 1]))
+            < self.centroid_threshold)
+
+        areas = np.asarray(areas, np.float64)[shapes]
+        object_areas = object_areas[objects]
+        max_areas = np.maximum(areas, object_areas)
+        min_areas = np.minimum(areas, object_areas)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            is_area_match = ((np.abs(max_areas - min_areas) / max_areas)
+                             < self.area_threshold)
+
+        is_angle_match = (np.abs(np.asarray(angles, np.float64)[shapes] -
+                                 object_angles[objects])
+                          < self.angle_threshold)
+
+        is_match = is_centroid_match & is_area_match & is_angle_match
+        matrix[shapes[is_match], objects[is_match]] = True
+        return matrix
+
+    def _candidate_pairs(self, centres, object_centres):
+        # A little larger than the threshold, so that rounding can't put
+        # centroids which are close enough two cells apart
+        cell_size = self.centroid_threshold * (1 + 1e-6)
+
+        def cell_keys(cells, offset_x=0, offset_y=0):
+            return (cells[:, 0] + offset_x) * 2 ** 32 + (cells[:, 1] +
+                                                         offset_y)
+
+        object_keys = cell_keys(
+            np.floor(object_centres / cell_size).astype(np.int64))
+        order = np.argsort(object_keys, kind="mergesort")
+        object_keys = object_keys[order]
+        cells = np.floor(centres / cell_size).astype(np.int64)
+
+        shapes = []
+        objects = []
+        for offset_x in (-1, 0, 1):
+            for offset_y in (-1, 0, 1):
+                keys = cell_keys(cells, offset_x, offset_y)
+                first = np.searchsorted(object_keys, keys, "left")
+                counts = np.searchsorted(object_keys, keys, "right") - first
+
+                # The objects in each shape's neighbouring cell, in turn
+                starts = np.cumsum(counts) - counts
+                positions = (np.arange(counts.sum()) -
+                             np.repeat(starts - first, counts))
+                shapes.append(np.repeat(np.arange(len(centres)), counts))
+                objects.append(order[positions])
+
+        return np.concatenate(shapes), np.concatenate(objects)
+
     def find_matches(self, target_object, search_objects):
         matches = set()
         for search_object in search_objects:
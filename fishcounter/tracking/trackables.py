@@ -22,14 +22,13 @@
 Representations of things that can be tracked.
 """
 
-import cv2
-
 
 class TrackedObject(object):
-    def __init__(self, bbox, contour, frame_number, frame_width, frame_height):
+    def __init__(self, bbox, area, angle, frame_number, frame_width,
+                 frame_height):
         self.bbox = bbox
-        self.area = cv2.contourArea(contour)
-        self.rotated_bbox = cv2.minAreaRect(contour)
+        self.area = area
+        self.angle = angle
 
         # Keep track of "velocity"
         self.dx = 0
@@ -38,6 +37,7 @@ class TrackedObject(object):
         self.prev_area = 0
 
         self.frames_tracked = 1
+        self.first_frame_tracked = frame_number
         self.last_frame_tracked = frame_number
         self.frame_width = frame_width
         self.frame_height = frame_height
@@ -48,24 +48,14 @@ class TrackedObject(object):
     def center(self):
         return self.bbox.center
 
-    @property
-    def angle(self):
-        # raw angle seems inconsistent, can be 0 or -90 on same box
-        raw_angle = self.rotated_bbox[2]
-        if raw_angle < -45:
-            return raw_angle + 90
-        else:
-            return raw_angle
-
-    def update(self, new_bbox, contour, frame_number):
+    def update(self, new_bbox, area, angle, frame_number):
         self.dx = self.bbox.center[0] - new_bbox.center[0]
         self.dy = self.bbox.center[1] - new_bbox.center[1]
 
-        new_area = cv2.contourArea(contour)
         self.bbox.update(new_bbox)
         self.prev_area = self.area
-        self.area = new_area
-        self.rotated_bbox = cv2.minAreaRect(contour)
+        self.area = area
+        self.angle = angle
 
         self.frames_tracked += 1
         self.last_frame_tracked = frame_number
@@ -82,8 +72,9 @@ class TrackedObject(object):
     def is_new(self):
         return self.frames_tracked < 15
 
-    def is_not_moving(self):
-        return abs(self.dx) < 2 and abs(self.dy) < 2 and self.delta_area() < 0
+    def is_not_moving(self, threshold=2):
+        return (abs(self.dx) < threshold and abs(self.dy) < threshold and
+                self.delta_area() < 0)
 
     def is_near_edge(self):
         padding = 0.2
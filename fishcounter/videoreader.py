@@ -22,36 +22,361 @@
 Read and process video files.
 """
 
+import Queue
+import itertools
+import threading
+
 import cv2
+import numpy as np
+
+from fishcounter.sources import FrameSource, CaptureSource
+
+
+def parse_timestamp(timestamp):
+    """
+    Converts a timestamp of the form [[HH:]MM:]SS[.sss] to seconds.
+    """
+    fields = timestamp.split(":")
+    if len(fields) > 3:
+        raise ValueError("Invalid timestamp: %s" % timestamp)
+
+    seconds = 0.
+    for field in fields:
+        seconds = seconds * 60 + float(field)
+    return seconds
+
+
+class FrameRing(object):
+    """
+    A fixed number of preallocated frame buffers.  Frames are decoded into
+    a borrowed buffer, which is released for reuse once no longer needed,
+    so reading a video doesn't allocate a new image for every frame.
+
+    The buffers are allocated once the frame shape is known.  Until then,
+    borrow returns None.  borrow blocks while every buffer is out.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._buffers = []
+        self._free = Queue.Queue()
+
+    def allocate(self, shape, dtype):
+        if len(self._buffers) > 0:
+            return
+
+        for _ in xrange(self.size):
+            buf = np.empty(shape, dtype)
+            self._buffers.append(buf)
+            self._free.put(buf)
+
+    def borrow(self):
+        if len(self._buffers) == 0:
+            return None
+        return self._free.get()
+
+    def release(self, image):
+        """
+        Returns a buffer to the ring.  Images which aren't one of the
+        ring's buffers are ignored.
+        """
+        if any(image is buf for buf in self._buffers):
+            self._free.put(image)
 
 
 class VideoReader(object):
     """
     Reads a video file and analyzes each frame with a specified video 
     analyzer.
+
+    The video may be given as a path, or as any FrameSource.
+
+    In headless mode HighGUI is never polled, so frames are processed as
+    fast as they can be decoded and analyzed.
+
+    With a ring_size, frames are decoded into a FrameRing of that many
+    preallocated buffers.  A frame passed to the analyzer is then only
+    valid until the analyzer is next called with it as the previous frame;
+    analyzers which keep frames for longer must copy them.
     """
 
-    def __init__(self, video_path, video_analyzer):
-        self.capture = cv2.VideoCapture(video_path)
+    def __init__(self, video, video_analyzer, headless=False, ring_size=0):
+        if isinstance(video, FrameSource):
+            self.source = video
+        else:
+            self.source = CaptureSource(video)
+
         self.video_analyzer = video_analyzer
+        self.headless = headless
+
+        self.ring = None
+        if ring_size > 0:
+            if ring_size < 2:
+                raise ValueError("The frame ring needs at least 2 buffers.")
+            self.ring = FrameRing(ring_size)
 
-    def start(self, skip=0):
-        frame_was_read, current_image = self.capture.read()
+        # Index of the last frame read from the source.
+        self.frame_number = -1
+
+    @property
+    def fps(self):
+        return self.source.fps
+
+    @property
+    def frame_count(self):
+        return self.source.frame_count
+
+    def frame_at(self, seconds):
+        """
+        Returns the number of the frame shown at the given time.
+        """
+        fps = self.fps
+        if fps <= 0:
+            raise ValueError("Unable to determine the frame rate of %s" %
+                             self.source)
+        return int(round(seconds * fps))
+
+    def seek(self, frame_number):
+        """
+        Positions the reader so that the next frame read is frame_number.
+
+        The source is asked to seek directly.  Sources which can only seek
+        to a keyframe (or not at all) are moved forward the rest of the way
+        by grabbing frames without retrieving them, which is much cheaper
+        than a full read.
+        """
+        position = self.source.seek(frame_number)
+
+        if position is None:
+            position = self.frame_number + 1
+            if position > frame_number:
+                raise ValueError("Unable to seek backwards in %s" %
+                                 self.source)
+
+        while position < frame_number and self.source.grab():
+            position += 1
+
+        self.frame_number = position - 1
+
+    def start(self, skip=0, stop=None):
+        """
+        Analyzes frames from frame number skip until frame number stop
+        (exclusive), or until the end of the video if stop is None.
+        """
+        if skip > 0:
+            self.seek(skip)
+
+        self._analyze_frames(stop)
+
+    def _analyze_frames(self, stop):
+        previous_image = None
+        frame_was_read, current_image = self._read_frame()
 
         while frame_was_read:
+            self._release_frame(previous_image)
             previous_image = current_image
-            frame_was_read, current_image = self.capture.read()
+            frame_was_read, current_image = self._read_frame()
 
-            if skip > 0:
-                skip -= 1
-                continue
+            if not frame_was_read:
+                break
+
+            if stop is not None and self.frame_number >= stop:
+                break
 
             self.video_analyzer.analyze(previous_image, current_image)
 
             # Exit if user presses the Escape key
-            if cv2.waitKey(10) == 27:
+            if not self.headless and cv2.waitKey(10) == 27:
                 break
 
+    def _read_frame(self):
+        frame = self._decode_frame()
+        if frame[0]:
+            self.frame_number += 1
+        return frame
+
+    def _decode_frame(self):
+        if self.ring is None:
+            return self.source.read()
+
+        buf = self.ring.borrow()
+        frame_was_read, image = self.source.read(buf)
+
+        if image is not buf:
+            # Decoded somewhere else, such as a view of a memory-mapped
+            # source, or the ring isn't allocated yet.
+            self.ring.release(buf)
+            if frame_was_read:
+                self.ring.allocate(image.shape, image.dtype)
+
+        return frame_was_read, image
+
+    def _release_frame(self, image):
+        if self.ring is not None:
+            self.ring.release(image)
+
+
+class BlockVideoReader(VideoReader):
+    """
+    Reads frames in blocks of block_size, and has the analyzer prepare
+    each block (see Analyzer.prepare_block) before analyzing its frames in
+    order.  Nothing is analyzed until a block has been read, so this is
+    meant for offline files rather than live sources.
+
+    Frames are decoded into two alternating block buffers, so the last
+    frame of one block is still intact as the previous image of the next.
+    """
+
+    def __init__(self, video, video_analyzer, headless=False, block_size=16):
+        super(BlockVideoReader, self).__init__(video, video_analyzer,
+                                               headless=headless)
+        if block_size < 1:
+            raise ValueError("Blocks need at least 1 frame.")
+        self.block_size = block_size
+
+    def _analyze_frames(self, stop):
+        frame_was_read, previous_image = self._read_frame()
+        if not frame_was_read:
+            return
+
+        buffers = [np.empty((self.block_size,) + previous_image.shape,
+                            previous_image.dtype) for _ in xrange(2)]
+
+        for block_number in itertools.count():
+            images = self._read_block(buffers[block_number % 2], stop)
+            if len(images) == 0:
+                break
+
+            self.video_analyzer.prepare_block(images)
+            for current_image in images:
+                self.video_analyzer.analyze(previous_image, current_image)
+                previous_image = current_image
+
+                # Exit if user presses the Escape key
+                if not self.headless and cv2.waitKey(10) == 27:
+                    return
+
+            if len(images) < self.block_size:
+                break
+
+    def _read_block(self, block, stop):
+        images = []
+        for buf in block:
+            if stop is not None and self.frame_number + 1 >= stop:
+                break
+
+            # Sources which can't decode into the buffer return their own
+            # image, which is used as it is.
+            frame_was_read, image = self.source.read(buf)
+            if not frame_was_read:
+                break
+
+            self.frame_number += 1
+            images.append(image)
+        return images
+
+
+class PrefetchStatistics(object):
+    """
+    Backpressure statistics for a PrefetchingVideoReader.
+
+    Analyzer stalls count the frames the analyzer had to wait for because
+    the queue was empty (decoding is the bottleneck).  Decoder stalls count
+    the frames the decoder had to hold because the queue was full (analysis
+    is the bottleneck).
+    """
+
+    def __init__(self):
+        self.frames_read = 0
+        self.analyzer_stalls = 0
+        self.decoder_stalls = 0
+        self.total_queue_depth = 0
+
+    @property
+    def mean_queue_depth(self):
+        if self.frames_read == 0:
+            return 0.
+        return float(self.total_queue_depth) / self.frames_read
+
+    def __str__(self):
+        return ("Frames read: %d, analyzer stalls: %d, decoder stalls: %d, "
+                "mean queue depth: %.2f" % (self.frames_read,
+                                            self.analyzer_stalls,
+                                            self.decoder_stalls,
+                                            self.mean_queue_depth))
+
+
+class PrefetchingVideoReader(VideoReader):
+    """
+    A VideoReader which decodes frames on a background thread into a
+    bounded queue.  OpenCV releases the GIL while decoding, so the next
+    frame is decoded while the current one is being analyzed.
+    """
+
+    def __init__(self, video, video_analyzer, headless=False, depth=4,
+                 ring_size=0):
+        if depth < 1:
+            raise ValueError("Prefetch depth must be at least 1.")
+
+        if ring_size > 0:
+            # The analyzer holds two frames, the queue holds depth frames
+            # and the decoder holds the one it is decoding.
+            ring_size = max(ring_size, depth + 3)
+
+        super(PrefetchingVideoReader, self).__init__(video, video_analyzer,
+                                                     headless=headless,
+                                                     ring_size=ring_size)
+
+        self.depth = depth
+        self.stats = PrefetchStatistics()
+        self._frames = None
+        self._stopped = threading.Event()
+
+    def _analyze_frames(self, stop):
+        self._frames = Queue.Queue(maxsize=self.depth)
+        self._stopped.clear()
+
+        decoder = threading.Thread(target=self._decode_frames,
+                                   name="frame-decoder")
+        decoder.daemon = True
+        decoder.start()
+
+        try:
+            super(PrefetchingVideoReader, self)._analyze_frames(stop)
+        finally:
+            self._stopped.set()
+            decoder.join()
+
+    def _decode_frames(self):
+        frame_was_read = True
+        while frame_was_read and not self._stopped.is_set():
+            frame = self._decode_frame()
+            frame_was_read = frame[0]
+
+            if self._frames.full():
+                self.stats.decoder_stalls += 1
+
+            while not self._stopped.is_set():
+                try:
+                    # Time out periodically to notice if we were stopped.
+                    self._frames.put(frame, timeout=0.1)
+                    break
+                except Queue.Full:
+                    pass
+
+    def _read_frame(self):
+        if self._frames.empty():
+            self.stats.analyzer_stalls += 1
+
+        frame = self._frames.get()
+
+        self.stats.frames_read += 1
+        self.stats.total_queue_depth += self._frames.qsize()
+
+        if frame[0]:
+            self.frame_number += 1
+        return frame
+
 
 class FrameDisplayAnalyzer(object):
     """
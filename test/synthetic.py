@@ -0,0 +1,87 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Synthetic frames shared by the tests.
+"""
+
+import cv2
+import numpy as np
+
+
+def moving_blob_frames(num_frames, shape=(120, 160)):
+    rng = np.random.RandomState(0)
+    background = rng.randint(0, 256, shape + (3,)).astype(np.uint8)
+    background = cv2.GaussianBlur(background, (0, 0), 3)
+
+    frames = []
+    for i in xrange(num_frames):
+        frame = background.copy()
+        cv2.circle(frame, (10 + 5 * i, shape[0] / 2), 12, (200, 180, 40), -1)
+        noise = rng.randint(-3, 4, frame.shape)
+        frames.append(np.clip(frame + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+def textured_blob_frames(num_frames, shape=(240, 320)):
+    # Optical flow needs texture to follow, unlike a flat coloured blob
+    rng = np.random.RandomState(0)
+    background = rng.randint(0, 256, shape + (3,)).astype(np.uint8)
+    background = cv2.GaussianBlur(background, (0, 0), 3)
+    texture = rng.randint(0, 256, (41, 41, 3)).astype(np.uint8)
+    texture = cv2.GaussianBlur(texture, (0, 0), 1.5)
+    y, x = np.mgrid[-20:21, -20:21]
+    disk = x ** 2 + y ** 2 <= 400
+
+    frames = []
+    for i in xrange(num_frames):
+        frame = background.copy()
+        x, y = 40 + 5 * i, shape[0] / 2
+        frame[y - 20:y + 21, x - 20:x + 21][disk] = texture[disk]
+        frames.append(frame)
+    return frames
+
+
+def crossing_fish_frames(num_frames, starts, shape=(240, 480), speed=6):
+    # Each fish swims left to right in its own lane, starting to enter the
+    # frame at its start frame.  The colour passes HSVColourSegmenter.
+    rng = np.random.RandomState(0)
+    background = rng.randint(0, 256, shape + (3,)).astype(np.uint8)
+    background = cv2.GaussianBlur(background, (0, 0), 3)
+
+    frames = []
+    for i in xrange(num_frames):
+        frame = background.copy()
+        for lane, start in enumerate(starts):
+            x = -60 + speed * (i - start)
+            if i >= start and x < shape[1] + 60:
+                cv2.ellipse(frame, (x, 40 + 80 * lane), (60, 20), 0, 0, 360,
+                            (230, 220, 160), -1)
+        frames.append(frame)
+    return frames
+
+
+def write_clip(path, frames, fps=25):
+    height, width = frames[0].shape[:2]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps,
+                             (width, height))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
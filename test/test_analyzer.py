@@ -0,0 +1,125 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import unittest
+
+import cv2
+from hamcrest import assert_that
+from hamcrest import equal_to
+from hamcrest import has_length
+from hamcrest import less_than_or_equal_to
+
+from fishcounter.analyzer import Analyzer
+from fishcounter.segment import (CompositeSegmentationAlgorithm,
+                                 HSVColourSegmenter,
+                                 InPlaceMovingAverageBackgroundSubtractor)
+from fishcounter.tracking.multistage import MultistageTracker
+from synthetic import crossing_fish_frames
+
+MOVING = (255, 0, 0)
+
+
+class RecordingDisplay(object):
+    """
+    Records the bounding boxes of the moving objects drawn on each frame,
+    as (x0, y0, x1, y1) in the coordinates of the frame displayed.
+    """
+
+    def __init__(self):
+        self.boxes = []
+
+    def new_frame(self, image):
+        self.boxes.append([])
+
+    def draw_bounding_boxes(self, tracked_objects, colour, scale=1.0):
+        if colour != MOVING:
+            return
+        for obj in tracked_objects:
+            bbox = obj.bbox
+            self.boxes[-1].append(tuple(
+                int(round(scale * value))
+                for value in (bbox.x0, bbox.y0, bbox.x1, bbox.y1)))
+        self.boxes[-1].sort()
+
+    def draw_counter(self, count):
+        pass
+
+    def display_frame(self):
+        pass
+
+
+class ScaleTest(unittest.TestCase):
+    def setUp(self):
+        # Fish 120 by 40 pixels, which are still large enough to count at
+        # half resolution
+        self.frames = crossing_fish_frames(220, [20, 60, 100])
+
+    def analyze(self, frames, scale, input_scale=1.0):
+        segmenter = CompositeSegmentationAlgorithm([
+            InPlaceMovingAverageBackgroundSubtractor(0.05),
+            HSVColourSegmenter(scale)])
+        display = RecordingDisplay()
+        # Headless, since segmenting with a display shows the mask too
+        analyzer = Analyzer(segmenter, MultistageTracker(scale), display,
+                            headless=True, scale=scale,
+                            input_scale=input_scale)
+
+        for previous_image, current_image in zip(frames, frames[1:]):
+            analyzer.analyze(previous_image, current_image)
+            analyzer._display_findings(current_image)
+        return analyzer.count, display.boxes
+
+    def assert_boxes_close(self, boxes, expected_boxes, tolerance):
+        # While every fish is well inside the frame
+        for frame in xrange(60, 121, 20):
+            assert_that(boxes[frame], has_length(len(expected_boxes[frame])))
+            for box, expected in zip(boxes[frame], expected_boxes[frame]):
+                for value, expected_value in zip(box, expected):
+                    assert_that(abs(value - expected_value),
+                                less_than_or_equal_to(tolerance))
+
+    def test_half_scale_matches_full_resolution(self):
+        count, boxes = self.analyze(self.frames, 1.0)
+        half_count, half_boxes = self.analyze(self.frames, 0.5)
+
+        assert_that(count, equal_to(3))
+        assert_that(half_count, equal_to(count))
+        # A pixel at half resolution is two at full resolution, and the
+        # masks are cleaned up with proportionally fewer iterations
+        self.assert_boxes_close(half_boxes, boxes, tolerance=4)
+
+    def test_frames_resized_in_advance(self):
+        # As read from a frame cache at half resolution
+        small_frames = [cv2.resize(frame, None, fx=0.5, fy=0.5,
+                                   interpolation=cv2.INTER_AREA)
+                        for frame in self.frames]
+        count, boxes = self.analyze(self.frames, 0.5)
+        small_count, small_boxes = self.analyze(small_frames, 0.5,
+                                                input_scale=0.5)
+
+        assert_that(small_count, equal_to(count))
+        # Drawn on the small frames they were found in
+        doubled = [[tuple(2 * value for value in box) for box in frame]
+                   for frame in small_boxes]
+        self.assert_boxes_close(doubled, boxes, tolerance=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from hamcrest import assert_that
+from hamcrest import contains_inanyorder
+from hamcrest import equal_to
+
+from fishcounter import batch
+from fishcounter.batch import (STATUS_FAILED, STATUS_OK, find_videos,
+                               read_completed, run_batch)
+
+# Videos which the stubbed analyze_video fails on, by base name, and how
+# many more times it will fail on each
+failures = {}
+
+
+def stub_analyze_video(video_path, scale=1.0):
+    name = os.path.basename(video_path)
+    remaining = failures.get(name, 0)
+    if remaining > 0:
+        failures[name] = remaining - 1
+        raise IOError("Unable to open %s" % video_path)
+    return len(name), 100
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.summary_path = os.path.join(self.directory, "summary.csv")
+
+        self.analyze_video = batch.analyze_video
+        batch.analyze_video = stub_analyze_video
+        failures.clear()
+
+    def tearDown(self):
+        batch.analyze_video = self.analyze_video
+        shutil.rmtree(self.directory)
+
+    def make_file(self, filename, size=1):
+        path = os.path.join(self.directory, filename)
+        with open(path, "wb") as video_file:
+            video_file.write("x" * size)
+        return path
+
+    def write_summary(self, rows):
+        with open(self.summary_path, "wb") as summary_file:
+            writer = csv.DictWriter(summary_file, batch.SUMMARY_FIELDS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+
+    def read_summary(self):
+        with open(self.summary_path, "rb") as summary_file:
+            return list(csv.DictReader(summary_file))
+
+
+class FindVideosTest(BatchTestCase):
+    def test_largest_first(self):
+        small = self.make_file("small.avi", 10)
+        large = self.make_file("large.mp4", 1000)
+        medium = self.make_file("medium.MOV", 100)
+
+        assert_that(find_videos(self.directory),
+                    equal_to([large, medium, small]))
+
+    def test_skips_files_which_are_not_videos(self):
+        video = self.make_file("fish.avi")
+        self.make_file("notes.txt")
+        os.mkdir(os.path.join(self.directory, "more.avi"))
+
+        assert_that(find_videos(self.directory), equal_to([video]))
+
+    def test_glob_pattern(self):
+        first = self.make_file("day1.avi", 10)
+        second = self.make_file("day2.avi", 20)
+        self.make_file("night1.avi")
+
+        assert_that(find_videos(os.path.join(self.directory, "day*.avi")),
+                    equal_to([second, first]))
+
+
+class ReadCompletedTest(BatchTestCase):
+    def test_no_summary(self):
+        assert_that(read_completed(self.summary_path), equal_to(set()))
+
+    def test_only_successful_videos(self):
+        self.write_summary([{"video": "a.avi", "status": STATUS_OK},
+                            {"video": "b.avi", "status": STATUS_FAILED}])
+
+        assert_that(read_completed(self.summary_path), equal_to({"a.avi"}))
+
+
+class AnalyzeWithRetriesTest(BatchTestCase):
+    def test_success_after_retry(self):
+        failures["fish.avi"] = 1
+
+        row = batch._analyze_with_retries(("fish.avi", 1, 1.0))
+
+        assert_that(row["status"], equal_to(STATUS_OK))
+        assert_that(row["attempts"], equal_to(2))
+        assert_that(row["count"], equal_to(len("fish.avi")))
+        assert_that(row["frames"], equal_to(100))
+        assert_that(row["error"], equal_to(""))
+
+    def test_failure_row_after_retries_run_out(self):
+        failures["fish.avi"] = 3
+
+        row = batch._analyze_with_retries(("fish.avi", 1, 1.0))
+
+        assert_that(row["status"], equal_to(STATUS_FAILED))
+        assert_that(row["attempts"], equal_to(2))
+        assert_that(row["count"], equal_to(""))
+        assert_that(row["frames"], equal_to(""))
+        assert_that(row["error"],
+                    equal_to("IOError: Unable to open fish.avi"))
+
+
+class RunBatchTest(BatchTestCase):
+    def test_skips_videos_already_in_summary(self):
+        done = self.make_file("done.avi")
+        failed = self.make_file("failed.avi")
+        new = self.make_file("new.avi")
+        self.write_summary([{"video": done, "count": 4, "status": STATUS_OK},
+                            {"video": failed, "status": STATUS_FAILED}])
+
+        rows = run_batch(self.directory, self.summary_path, processes=1)
+
+        assert_that([row["video"] for row in rows],
+                    contains_inanyorder(failed, new))
+        # Appended to the summary without repeating the header
+        assert_that([row["video"] for row in self.read_summary()],
+                    equal_to([done, failed] + [row["video"] for row in rows]))
+
+    def test_nothing_left_to_do(self):
+        done = self.make_file("done.avi")
+        self.write_summary([{"video": done, "count": 4, "status": STATUS_OK}])
+
+        assert_that(run_batch(self.directory, self.summary_path,
+                              processes=1), equal_to([]))
+
+    def test_writes_failure_row(self):
+        ok = self.make_file("ok.avi")
+        broken = self.make_file("broken.avi")
+        failures["broken.avi"] = 2
+
+        run_batch(self.directory, self.summary_path, processes=1, retries=1)
+
+        rows = dict((row["video"], row) for row in self.read_summary())
+        assert_that(rows[ok]["status"], equal_to(STATUS_OK))
+        assert_that(rows[ok]["count"], equal_to(str(len("ok.avi"))))
+        assert_that(rows[broken]["status"], equal_to(STATUS_FAILED))
+        assert_that(rows[broken]["attempts"], equal_to("2"))
+        assert_that(rows[broken]["error"],
+                    equal_to("IOError: Unable to open %s" % broken))
+
+
+if __name__ == "__main__":
+    unittest.main()
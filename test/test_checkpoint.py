@@ -0,0 +1,173 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+from hamcrest import assert_that
+from hamcrest import equal_to
+from hamcrest import has_length
+
+from fishcounter.analyzer import Analyzer
+from fishcounter.checkpoint import (Checkpointer, CheckpointingAnalyzer,
+                                    restore_checkpoint)
+from fishcounter.motion import MotionGate, STATIC
+from fishcounter.segment import (CompositeSegmentationAlgorithm,
+                                 MovingAverageBackgroundSubtractor,
+                                 InPlaceMovingAverageBackgroundSubtractor,
+                                 BlockMovingAverageBackgroundSubtractor,
+                                 HSVColourSegmenter)
+from fishcounter.sources import StackSource
+from fishcounter.tracking.multistage import MultistageTracker
+from fishcounter.tracking.trackables import BoundingBox, TrackedObject
+from fishcounter.videoreader import BlockVideoReader
+
+from synthetic import moving_blob_frames
+
+
+def create_analyzer():
+    segmenter = CompositeSegmentationAlgorithm([
+        InPlaceMovingAverageBackgroundSubtractor(0.05),
+        MovingAverageBackgroundSubtractor(0.05),
+        HSVColourSegmenter()])
+    return Analyzer(segmenter, MultistageTracker(), None, headless=True)
+
+
+def create_block_analyzer():
+    segmenter = CompositeSegmentationAlgorithm([
+        BlockMovingAverageBackgroundSubtractor(0.05),
+        HSVColourSegmenter()])
+    return Analyzer(segmenter, MultistageTracker(), None, headless=True)
+
+
+def slow_fish_frames(num_frames):
+    # Too slow to change the gate's thumbnail much from frame to frame
+    frames = []
+    for i in xrange(num_frames):
+        frame = np.empty((360, 640, 3), np.uint8)
+        frame.fill(100)
+        cv2.rectangle(frame, (300 + i, 200), (339 + i, 211),
+                      (200, 200, 200), -1)
+        frames.append(frame)
+    return frames
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "analysis.checkpoint")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume_restores_state(self):
+        frames = moving_blob_frames(6)
+        analyzer = create_analyzer()
+        checkpointer = Checkpointer(self.path)
+        checkpointing = CheckpointingAnalyzer(analyzer, checkpointer,
+                                              interval=5)
+        for previous_image, current_image in zip(frames, frames[1:]):
+            checkpointing.analyze(previous_image, current_image)
+        checkpointer.wait()
+
+        # Something to count
+        fish = TrackedObject(BoundingBox(10, 20, 30, 15), 225., 0., 3,
+                             160, 120)
+        analyzer.tracker.moving_objects.append(fish)
+        checkpointer.save(analyzer, 5)
+        checkpointer.wait()
+
+        resumed = create_analyzer()
+        frame = restore_checkpoint(self.path, resumed)
+
+        assert_that(frame, equal_to(5))
+        assert_that(resumed.count, equal_to(analyzer.count))
+        assert_that(resumed.tracker.moving_objects, has_length(1))
+        assert_that(resumed.tracker.frame_number,
+                    equal_to(analyzer.tracker.frame_number))
+
+        for algorithm, original in zip(resumed.segmenter.algorithms[:2],
+                                       analyzer.segmenter.algorithms[:2]):
+            assert_that(np.array_equal(algorithm.background,
+                                       original.background),
+                        equal_to(True))
+
+    def test_checkpoint_every_interval(self):
+        frames = moving_blob_frames(5)
+        checkpointing = CheckpointingAnalyzer(create_analyzer(),
+                                              Checkpointer(self.path),
+                                              interval=3, frame=10)
+        for previous_image, current_image in zip(frames, frames[1:]):
+            checkpointing.analyze(previous_image, current_image)
+        checkpointing.checkpointer.wait()
+
+        assert_that(restore_checkpoint(self.path, create_analyzer()),
+                    equal_to(12))
+
+    def test_checkpoint_put_off_to_end_of_block(self):
+        frames = np.array(moving_blob_frames(30))
+        uninterrupted = create_block_analyzer()
+        checkpointing = CheckpointingAnalyzer(uninterrupted,
+                                              Checkpointer(self.path),
+                                              interval=10)
+        # Blocks of frames 1-4, 5-8, 9-12, ...
+        BlockVideoReader(StackSource(frames), checkpointing, headless=True,
+                         block_size=4).start(stop=14)
+        checkpointing.checkpointer.wait()
+        BlockVideoReader(StackSource(frames), uninterrupted, headless=True,
+                         block_size=4).start(skip=13)
+
+        resumed = create_block_analyzer()
+        frame = restore_checkpoint(self.path, resumed)
+        assert_that(frame, equal_to(12))
+        BlockVideoReader(StackSource(frames), resumed, headless=True,
+                         block_size=4).start(skip=frame)
+
+        background = resumed.segmenter.algorithms[0].background
+        expected = uninterrupted.segmenter.algorithms[0].background
+        assert_that(np.array_equal(background, expected), equal_to(True))
+
+    def test_resume_restores_motion_gate(self):
+        frames = slow_fish_frames(20)
+        analyzer = create_analyzer()
+        analyzer.motion_gate = MotionGate(tile_threshold=10)
+        for previous_image, current_image in zip(frames[:11], frames[1:11]):
+            analyzer.analyze(previous_image, current_image)
+        checkpointer = Checkpointer(self.path)
+        checkpointer.save(analyzer, 10)
+        checkpointer.wait()
+
+        resumed = create_analyzer()
+        resumed.motion_gate = MotionGate(tile_threshold=10)
+        restore_checkpoint(self.path, resumed)
+
+        pairs = zip(frames[10:], frames[11:])
+        expected = [analyzer.motion_gate.classify(*pair) for pair in pairs]
+        changes = [resumed.motion_gate.classify(*pair) for pair in pairs]
+        assert_that(changes, equal_to(expected))
+        assert_that(STATIC in changes, equal_to(True))
+
+
+if __name__ == "__main__":
+    unittest.main()
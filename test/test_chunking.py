@@ -0,0 +1,147 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from hamcrest import assert_that
+from hamcrest import equal_to
+
+from fishcounter.analyzer import Analyzer
+from fishcounter.chunking import (Chunk, TrackRecord, count_in_chunks,
+                                  split_into_chunks, stitch_chunks)
+from fishcounter.segment import (CompositeSegmentationAlgorithm,
+                                 HSVColourSegmenter,
+                                 InPlaceMovingAverageBackgroundSubtractor)
+from fishcounter.tracking.multistage import MultistageTracker
+from fishcounter.videoreader import VideoReader
+from synthetic import crossing_fish_frames, write_clip
+
+
+def make_record(first_frame, centers):
+    record = TrackRecord(first_frame)
+    record.centers.update(centers)
+    return record
+
+
+def create_analyzer(headless=True, scale=1.0):
+    # The default pipeline needs BackgroundSubtractorMOG, which newer
+    # OpenCV builds lack.  Module level so the chunk processes can use it.
+    segmenter = CompositeSegmentationAlgorithm([
+        InPlaceMovingAverageBackgroundSubtractor(0.05),
+        HSVColourSegmenter(scale)])
+    return Analyzer(segmenter, MultistageTracker(scale), None,
+                    headless=headless, scale=scale)
+
+
+class SplitIntoChunksTest(unittest.TestCase):
+    def test_chunks_cover_video_with_margins(self):
+        chunks = split_into_chunks(1000, 3, warmup=100, tail=20)
+
+        assert_that(chunks, equal_to([Chunk(0, 334, 0, 354),
+                                      Chunk(334, 668, 234, 688),
+                                      Chunk(668, 1000, 568, 1000)]))
+
+    def test_chunks_start_at_first_frame(self):
+        chunks = split_into_chunks(1000, 2, warmup=100, tail=20,
+                                   first_frame=400)
+
+        assert_that(chunks, equal_to([Chunk(400, 700, 400, 720),
+                                      Chunk(700, 1000, 600, 1000)]))
+
+    def test_nothing_to_split(self):
+        assert_that(split_into_chunks(100, 2, warmup=10, tail=10,
+                                      first_frame=100), equal_to([]))
+
+
+class StitchChunksTest(unittest.TestCase):
+    def setUp(self):
+        self.chunks = [Chunk(0, 100, 0, 120), Chunk(100, 200, 50, 200)]
+
+    def test_objects_seen_during_warmup_belong_to_previous_chunk(self):
+        first = [make_record(90, {})]
+        second = [make_record(60, {}), make_record(150, {})]
+
+        assert_that(stitch_chunks([first, second], self.chunks, 50),
+                    equal_to(2))
+
+    def test_object_crossing_boundary_counted_once(self):
+        first = [make_record(95, {100: (10, 10), 101: (12, 10)})]
+        second = [make_record(101, {101: (14, 11), 102: (16, 11)})]
+
+        assert_that(stitch_chunks([first, second], self.chunks, 50),
+                    equal_to(1))
+
+    def test_distinct_objects_near_boundary_counted_separately(self):
+        first = [make_record(95, {100: (10, 10), 101: (12, 10)})]
+        second = [make_record(101, {101: (300, 200), 102: (302, 200)})]
+
+        assert_that(stitch_chunks([first, second], self.chunks, 50),
+                    equal_to(2))
+
+
+class CountInChunksTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "fish.avi")
+        # The second fish is in the frame at the boundaries of both 2 and
+        # 3 chunks, and the third enters right on the last one.
+        write_clip(self.path, crossing_fish_frames(360, [20, 130, 240]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def sequential_count(self, skip=0, stop=None):
+        analyzer = create_analyzer()
+        VideoReader(self.path, analyzer, headless=True).start(skip, stop)
+        return analyzer.count
+
+    def chunked_count(self, num_chunks, **kwargs):
+        return count_in_chunks(self.path, processes=2, num_chunks=num_chunks,
+                               warmup=30, tail=30,
+                               analyzer_factory=create_analyzer, **kwargs)
+
+    def test_sequential_run_counts_every_fish(self):
+        assert_that(self.sequential_count(), equal_to(3))
+
+    def test_two_chunks_match_sequential_run(self):
+        assert_that(self.chunked_count(2), equal_to(self.sequential_count()))
+
+    def test_three_chunks_match_sequential_run(self):
+        assert_that(self.chunked_count(3), equal_to(self.sequential_count()))
+
+    def test_skip_matches_sequential_run(self):
+        # Starts as the first fish is leaving
+        assert_that(self.chunked_count(2, skip=100),
+                    equal_to(self.sequential_count(skip=100)))
+
+    def test_time_range_matches_sequential_run(self):
+        # Frames 150 to 250 at 25 frames per second, which ends before the
+        # third fish can be confirmed
+        count = self.chunked_count(2, start_time=6, end_time=10)
+
+        assert_that(count, equal_to(self.sequential_count(150, 250)))
+        assert_that(count, equal_to(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import unittest
+
+import cv2
+import numpy as np
+from hamcrest import assert_that
+from hamcrest import close_to
+from hamcrest import equal_to
+from hamcrest import greater_than
+
+from fishcounter.components import extract_blobs
+
+
+def random_mask(shape=(200, 250)):
+    rng = np.random.RandomState(0)
+    noise = cv2.GaussianBlur(rng.rand(*shape).astype(np.float32), (0, 0), 4)
+    return (noise > 0.52).astype(np.uint8) * 255
+
+
+def folded_angle(moments):
+    angle = 0.5 * np.degrees(np.arctan2(2 * moments["mu11"],
+                                        moments["mu20"] - moments["mu02"]))
+    return (angle + 45) % 90 - 45
+
+
+class ExtractBlobsTest(unittest.TestCase):
+    def setUp(self):
+        self.mask = random_mask()
+        self.contours, _ = cv2.findContours(self.mask.copy(),
+                                            cv2.RETR_EXTERNAL,
+                                            cv2.CHAIN_APPROX_SIMPLE)
+
+    def test_matches_per_contour_statistics(self):
+        blobs = extract_blobs(self.mask.copy())
+
+        assert_that(len(blobs), equal_to(len(self.contours)))
+        for index, contour in enumerate(self.contours):
+            assert_that(np.array_equal(blobs.contour(index), contour),
+                        equal_to(True))
+            assert_that(blobs.bbox(index),
+                        equal_to(cv2.boundingRect(contour)))
+            assert_that(blobs.areas[index],
+                        close_to(cv2.contourArea(contour), 1e-6))
+            assert_that(blobs.perimeters[index],
+                        close_to(cv2.arcLength(contour, True), 1e-3))
+
+            moments = cv2.moments(contour)
+            if moments["m00"] > 0:
+                assert_that(blobs.centroids[index, 0],
+                            close_to(moments["m10"] / moments["m00"], 1e-6))
+                assert_that(blobs.centroids[index, 1],
+                            close_to(moments["m01"] / moments["m00"], 1e-6))
+                # Folding can leave -45 and 45 apart
+                difference = abs(blobs.angles[index] - folded_angle(moments))
+                assert_that(min(difference, abs(difference - 90)),
+                            close_to(0, 1e-6))
+
+    def test_min_perimeter(self):
+        blobs = extract_blobs(self.mask.copy(), min_perimeter=50)
+        long_contours = [contour for contour in self.contours
+                         if cv2.arcLength(contour, True) > 50]
+
+        assert_that(len(long_contours), greater_than(0))
+        assert_that(len(blobs), equal_to(len(long_contours)))
+        for index, contour in enumerate(long_contours):
+            assert_that(np.array_equal(blobs.contour(index), contour),
+                        equal_to(True))
+            assert_that(blobs.areas[index],
+                        close_to(cv2.contourArea(contour), 1e-6))
+
+    def test_empty_mask(self):
+        blobs = extract_blobs(np.zeros((40, 50), np.uint8))
+        assert_that(len(blobs), equal_to(0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import collections
+import unittest
+
+import cv2
+import numpy as np
+from hamcrest import assert_that
+from hamcrest import equal_to
+
+from fishcounter.analyzer import Analyzer
+from fishcounter.frame import Frame
+from fishcounter.segment import (CompositeSegmentationAlgorithm,
+                                 HSVColourSegmenter,
+                                 InPlaceMovingAverageBackgroundSubtractor,
+                                 MovingAverageBackgroundSubtractor)
+from fishcounter.tracking.multistage import MultistageTracker
+from synthetic import crossing_fish_frames
+
+
+class FrameTest(unittest.TestCase):
+    def setUp(self):
+        self.image = crossing_fish_frames(1, [-10])[0]
+
+    def test_computed_once(self):
+        frame = Frame(self.image)
+        calls = []
+        compute = lambda: calls.append(1) or len(calls)
+
+        assert_that(frame.memoize("key", compute), equal_to(1))
+        assert_that(frame.memoize("key", compute), equal_to(1))
+        assert_that(len(calls), equal_to(1))
+
+    def test_region_shares_conversions(self):
+        frame = Frame(self.image)
+        hsv = frame.hsv
+        region = frame.region((10, 20, 30, 40))
+
+        assert_that(np.may_share_memory(region.hsv, hsv), equal_to(True))
+        assert_that(np.array_equal(region.hsv,
+                                   cv2.cvtColor(self.image[20:60, 10:40],
+                                                cv2.COLOR_BGR2HSV)),
+                    equal_to(True))
+
+
+class AnalyzerConversionsTest(unittest.TestCase):
+    """
+    Counts the work done for each frame by a whole Analyzer: the
+    background subtractors, the colour segmenter and the CamShift tracker
+    all use the grayscale or HSV conversion, or the colour mask.
+    """
+
+    def setUp(self):
+        self.computed = collections.Counter()
+        self.conversions = collections.Counter()
+        self.memoize = Frame.memoize
+        self.cvtColor = cv2.cvtColor
+
+        memoize = self.memoize
+        def counting_memoize(frame, key, compute):
+            def counted():
+                self.computed[key if isinstance(key, str) else key[0]] += 1
+                return compute()
+            return memoize(frame, key, counted)
+
+        cvtColor = self.cvtColor
+        def counting_cvtColor(image, code, *args):
+            self.conversions[code] += 1
+            return cvtColor(image, code, *args)
+
+        Frame.memoize = counting_memoize
+        cv2.cvtColor = counting_cvtColor
+
+    def tearDown(self):
+        Frame.memoize = self.memoize
+        cv2.cvtColor = self.cvtColor
+
+    def assert_converted_once_per_frame(self, threads):
+        segmenter = CompositeSegmentationAlgorithm([
+            InPlaceMovingAverageBackgroundSubtractor(0.05),
+            MovingAverageBackgroundSubtractor(0.05),
+            HSVColourSegmenter()], threads=threads)
+        analyzer = Analyzer(segmenter, MultistageTracker(), None,
+                            headless=True)
+
+        # A fish swims in and stops, so the CamShift tracker takes over
+        frames = crossing_fish_frames(40, [0])
+        frames += [frames[-1].copy() for _ in xrange(20)]
+
+        for previous_image, current_image in zip(frames, frames[1:]):
+            self.computed.clear()
+            self.conversions.clear()
+            analyzer.analyze(previous_image, current_image)
+
+            assert_that(self.computed,
+                        equal_to({"gray": 1, "hsv": 1, "colour mask": 1}))
+            assert_that(self.conversions,
+                        equal_to({cv2.COLOR_BGR2GRAY: 1,
+                                  cv2.COLOR_BGR2HSV: 1}))
+        analyzer.close()
+
+        assert_that(len(analyzer.tracker.stationary_objects), equal_to(1))
+
+    def test_sequential_segmenters(self):
+        self.assert_converted_once_per_frame(threads=0)
+
+    def test_threaded_segmenters(self):
+        self.assert_converted_once_per_frame(threads=3)
+
+
+if __name__ == "__main__":
+    unittest.main()
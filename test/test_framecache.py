@@ -0,0 +1,72 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from hamcrest import assert_that
+from hamcrest import equal_to
+
+from fishcounter.framecache import CachedFrameSource, FrameCache, write_frames
+from fishcounter.sources import StackSource
+
+
+class FrameCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.frames = np.random.randint(0, 256, (5, 8, 10, 3)).astype(np.uint8)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_cache_file(self, filename):
+        path = os.path.join(self.directory, filename)
+        write_frames(StackSource(self.frames, fps=25.), path)
+        return path
+
+    def test_frames_round_trip(self):
+        source = CachedFrameSource(self.write_cache_file("a.frames"))
+
+        assert_that(source.frame_count, equal_to(5))
+        assert_that(source.fps, equal_to(25.))
+
+        for expected in self.frames:
+            frame_was_read, frame = source.read()
+            assert_that(frame_was_read, equal_to(True))
+            assert_that(np.array_equal(frame, expected), equal_to(True))
+
+        assert_that(source.read(), equal_to((False, None)))
+
+    def test_evicts_least_recently_used(self):
+        old = self.write_cache_file("old.frames")
+        new = self.write_cache_file("new.frames")
+        os.utime(old, (0, 0))
+
+        FrameCache(self.directory, os.path.getsize(new)).evict()
+
+        assert_that(os.path.exists(old), equal_to(False))
+        assert_that(os.path.exists(new), equal_to(True))
+
+
+if __name__ == "__main__":
+    unittest.main()
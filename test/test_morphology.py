@@ -0,0 +1,98 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import os
+import unittest
+
+import cv2
+import numpy as np
+from hamcrest import assert_that
+from hamcrest import equal_to
+
+from fishcounter.morphology import (MorphologyChain, compile_steps, ERODE,
+                                    DILATE)
+from fishcounter.segment import HSVColourSegmenter
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+SAMPLE_IMAGES = ["fish_and_shadow.jpg", "fish_well_lit.jpg", "fish_ss.png"]
+
+
+def morphology_ex(bin_img, kernel, operations):
+    for operation, iterations in operations:
+        bin_img = cv2.morphologyEx(bin_img, operation, kernel,
+                                   iterations=iterations)
+    return bin_img
+
+
+def sample_masks():
+    masks = []
+
+    # Raw colour masks of the sample frames, before any cleaning
+    segmenter = HSVColourSegmenter()
+    for filename in SAMPLE_IMAGES:
+        image = cv2.imread(os.path.join(DATA_DIR, filename))
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        masks.append(cv2.inRange(hsv,
+                                 np.array([segmenter.hue_min, segmenter.sat_min,
+                                           segmenter.val_min]),
+                                 np.array([segmenter.hue_max, segmenter.sat_max,
+                                           segmenter.val_max])))
+
+    # Speckle noise touching the borders
+    rng = np.random.RandomState(0)
+    masks.append((rng.rand(97, 131) > 0.8).astype(np.uint8) * 255)
+
+    return masks
+
+
+class CompileStepsTest(unittest.TestCase):
+    def test_adjacent_runs_merged(self):
+        steps = compile_steps([(cv2.MORPH_OPEN, 1), (cv2.MORPH_CLOSE, 15)])
+
+        assert_that(steps, equal_to([(ERODE, 1), (DILATE, 16), (ERODE, 15)]))
+
+
+class MorphologyChainTest(unittest.TestCase):
+    def assert_identical(self, kernel, operations):
+        chain = MorphologyChain(kernel, operations)
+
+        for mask in sample_masks():
+            expected = morphology_ex(mask, kernel, operations)
+            assert_that(np.array_equal(chain.apply(mask), expected),
+                        equal_to(True))
+
+    def test_hsv_cleaning_identical(self):
+        self.assert_identical(
+            cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)),
+            [(cv2.MORPH_CLOSE, 17), (cv2.MORPH_OPEN, 3)])
+
+    def test_component_cleaning_identical(self):
+        self.assert_identical(
+            cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)),
+            [(cv2.MORPH_OPEN, 1), (cv2.MORPH_CLOSE, 15)])
+
+    def test_square_kernel_identical(self):
+        self.assert_identical(
+            cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)),
+            [(cv2.MORPH_CLOSE, 5), (cv2.MORPH_OPEN, 4)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import unittest
+
+import cv2
+import numpy as np
+from hamcrest import assert_that
+from hamcrest import equal_to
+from hamcrest import less_than
+
+from fishcounter.analyzer import Analyzer
+from fishcounter.motion import MotionGate, DUPLICATE, STATIC, CHANGED
+from fishcounter.segment import (CompositeSegmentationAlgorithm,
+                                 HSVColourSegmenter,
+                                 InPlaceMovingAverageBackgroundSubtractor)
+from fishcounter.tracking.multistage import MultistageTracker
+from synthetic import crossing_fish_frames
+
+
+def water(shape=(360, 640), seed=0):
+    rng = np.random.RandomState(seed)
+    background = rng.randint(0, 256, shape + (3,)).astype(np.uint8)
+    return cv2.GaussianBlur(background, (0, 0), 5)
+
+
+def with_noise(image, seed):
+    noise = np.random.RandomState(seed).randint(-2, 3, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+class MotionGateTest(unittest.TestCase):
+    def setUp(self):
+        self.gate = MotionGate()
+        self.previous = with_noise(water(), 1)
+
+    def test_repeated_frame_is_duplicate(self):
+        assert_that(self.gate.classify(self.previous, self.previous.copy()),
+                    equal_to(DUPLICATE))
+
+    def test_sensor_noise_is_static(self):
+        current = with_noise(water(), 2)
+
+        assert_that(self.gate.classify(self.previous, current),
+                    equal_to(STATIC))
+
+    def test_small_fish_is_changed(self):
+        current = with_noise(water(), 2)
+        cv2.ellipse(current, (300, 200), (12, 5), 0, 0, 360, (40, 180, 200),
+                    -1)
+
+        assert_that(self.gate.classify(self.previous, current),
+                    equal_to(CHANGED))
+
+    def test_slow_fish_adds_up_to_changed(self):
+        # Too slow to pass the tile threshold between consecutive frames
+        background = np.empty((1080, 1920, 3), np.uint8)
+        background.fill(100)
+
+        frames = []
+        for i in xrange(100):
+            frame = background.copy()
+            cv2.rectangle(frame, (600 + 2 * i, 500), (639 + 2 * i, 511),
+                          (200, 200, 200), -1)
+            frames.append(frame)
+
+        changes = [self.gate.classify(previous, current)
+                   for previous, current in zip(frames, frames[1:])]
+        changed = [i for i, change in enumerate(changes) if change == CHANGED]
+
+        # The tiles are 60 pixels wide, so the fish crosses one in 30 frames
+        assert_that(changed[0], less_than(30))
+        assert_that(max(np.diff(changed)), less_than(30))
+
+
+class GatedAnalyzerTest(unittest.TestCase):
+    def create_analyzer(self, motion_gate):
+        self.background_subtractor = InPlaceMovingAverageBackgroundSubtractor(
+            0.05)
+        segmenter = CompositeSegmentationAlgorithm([self.background_subtractor,
+                                                    HSVColourSegmenter()])
+        return Analyzer(segmenter, MultistageTracker(), None, headless=True,
+                        motion_gate=motion_gate)
+
+    def analyze(self, analyzer, frames):
+        for previous_image, current_image in zip(frames, frames[1:]):
+            analyzer.analyze(previous_image, current_image)
+
+    def test_same_count_as_ungated_run(self):
+        frames = crossing_fish_frames(220, [40, 70, 100])
+        # A static intro with sensor noise, and a stalled camera repeating
+        # every fifth frame
+        clip = []
+        for i, frame in enumerate(frames):
+            if i < 40:
+                frame = with_noise(frame, i)
+            clip.append(frame)
+            if i % 5 == 0:
+                clip.append(frame.copy())
+
+        ungated = self.create_analyzer(None)
+        self.analyze(ungated, clip)
+        gated = self.create_analyzer(MotionGate())
+        self.analyze(gated, clip)
+
+        assert_that(ungated.count, equal_to(3))
+        assert_that(gated.count, equal_to(ungated.count))
+
+    def test_duplicates_age_background(self):
+        # Repeated background until a fish swims into the left edge
+        frames = crossing_fish_frames(31, [21])
+        ungated = self.create_analyzer(None)
+        self.analyze(ungated, frames)
+        ungated_background = self.background_subtractor.background.copy()
+        gated = self.create_analyzer(MotionGate())
+        self.analyze(gated, frames)
+        gated_background = self.background_subtractor.background
+
+        # Away from the fish, which the gated model ages towards
+        difference = cv2.absdiff(ungated_background, gated_background)
+        assert_that(float(difference[:, 60:].max()), less_than(0.01))
+
+
+if __name__ == "__main__":
+    unittest.main()
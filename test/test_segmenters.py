@@ -0,0 +1,391 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import cv2
+import numpy as np
+from hamcrest import assert_that
+from hamcrest import equal_to
+from hamcrest import greater_than
+from hamcrest import has_length
+from hamcrest import less_than
+
+from fishcounter.frame import Frame
+from fishcounter.segment import (MovingAverageBackgroundSubtractor,
+                                 BlockMovingAverageBackgroundSubtractor,
+                                 InPlaceMovingAverageBackgroundSubtractor,
+                                 HSVColourSegmenter,
+                                 LookupTableColourSegmenter,
+                                 CompositeSegmentationAlgorithm,
+                                 EdgeBackgroundSubtractor,
+                                 OpticalFlowSegmenter,
+                                 PyramidSegmentationAlgorithm,
+                                 candidate_regions, hysteresis_threshold,
+                                 _flood_from_strong)
+
+from synthetic import (crossing_fish_frames, moving_blob_frames,
+                       textured_blob_frames)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+
+
+def grow_regions(image, low, high):
+    # Grows the pixels above high one ring at a time
+    weak = image > low
+    grown = image > high
+    while True:
+        dilated = cv2.dilate(grown.astype(np.uint8), np.ones((3, 3), np.uint8))
+        next_grown = dilated.astype(bool) & weak
+        if np.array_equal(next_grown, grown):
+            return grown.astype(np.uint8) * 255
+        grown = next_grown
+
+
+class HysteresisThresholdTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.images = [cv2.GaussianBlur(rng.rand(60, 80).astype(np.float32),
+                                        (0, 0), 2)
+                       for _ in xrange(10)]
+
+    def test_matches_growing_regions(self):
+        for image in self.images:
+            low, high = np.percentile(image, 50), np.percentile(image, 90)
+            assert_that(np.array_equal(hysteresis_threshold(image, low, high),
+                                       grow_regions(image, low, high)),
+                        equal_to(True))
+
+    def test_flood_fill_fallback(self):
+        for image in self.images:
+            low, high = np.percentile(image, 50), np.percentile(image, 90)
+            weak = cv2.compare(image, low, cv2.CMP_GT)
+            strong = cv2.compare(image, high, cv2.CMP_GT)
+            flooded = _flood_from_strong(weak, strong,
+                                         np.empty(weak.shape, np.uint8))
+            assert_that(np.array_equal(flooded,
+                                       grow_regions(image, low, high)),
+                        equal_to(True))
+
+
+class InPlaceMovingAverageTest(unittest.TestCase):
+    def test_matches_moving_average(self):
+        original = MovingAverageBackgroundSubtractor(0.05)
+        in_place = InPlaceMovingAverageBackgroundSubtractor(0.05)
+
+        for frame in moving_blob_frames(25):
+            expected = original.segment(frame)
+            actual = in_place.segment(frame)
+
+            # float32 rounding can move a few pixels across the threshold
+            mismatched = np.count_nonzero(expected != actual)
+            assert_that(mismatched, less_than(0.001 * expected.size))
+
+    def test_hysteresis_extends_mask(self):
+        plain = InPlaceMovingAverageBackgroundSubtractor(0.05)
+        hysteresis = InPlaceMovingAverageBackgroundSubtractor(
+            0.05, hysteresis_ratio=0.5)
+
+        for frame in moving_blob_frames(25):
+            expected = plain.segment(frame)
+            actual = hysteresis.segment(frame)
+            assert_that(np.count_nonzero(expected & ~actual), equal_to(0))
+
+
+class BlockMovingAverageTest(unittest.TestCase):
+    def test_matches_in_place_moving_average(self):
+        original = InPlaceMovingAverageBackgroundSubtractor(0.05)
+        # Strips which don't divide the frame evenly
+        block = BlockMovingAverageBackgroundSubtractor(0.05, strip_rows=7)
+
+        images = moving_blob_frames(25)
+        for start in xrange(0, len(images), 10):
+            frames = [Frame(image) for image in images[start:start + 10]]
+            block.segment_block(frames)
+
+            for frame in frames:
+                expected = original.segment(frame.image)
+                assert_that(np.array_equal(block.segment(frame), expected),
+                            equal_to(True))
+
+
+class AgingTest(unittest.TestCase):
+    def assert_aged_like_repeated(self, create):
+        first, second = moving_blob_frames(2)
+        aged = create()
+        repeated = create()
+
+        aged.segment(first)
+        aged.age(3)
+        aged.segment(second)
+
+        repeated.segment(first)
+        for _ in xrange(4):
+            repeated.segment(second)
+
+        assert_that(np.abs(aged.background - repeated.background).max(),
+                    less_than(1e-3))
+
+    def test_moving_average(self):
+        self.assert_aged_like_repeated(
+            lambda: MovingAverageBackgroundSubtractor(0.05))
+
+    def test_in_place_moving_average(self):
+        self.assert_aged_like_repeated(
+            lambda: InPlaceMovingAverageBackgroundSubtractor(0.05))
+
+    def test_edges(self):
+        self.assert_aged_like_repeated(
+            lambda: EdgeBackgroundSubtractor(alpha=0.05))
+
+
+class RegionCatchUpTest(unittest.TestCase):
+    def test_matches_updating_every_pixel(self):
+        frames = crossing_fish_frames(60, [0, 15])
+        # Both lanes with fish; the rest of the frame never changes
+        regions = [(0, 0, 480, 80), (0, 80, 480, 80)]
+        full = MovingAverageBackgroundSubtractor(0.05)
+        by_region = MovingAverageBackgroundSubtractor(0.05)
+
+        full.segment(frames[0])
+        by_region.segment(frames[0])
+        for frame in frames[1:-1]:
+            full.segment(frame)
+            by_region.segment_regions(frame, regions)
+        full.segment(frames[-1])
+        by_region.segment(frames[-1])
+
+        assert_that(np.abs(full.background - by_region.background).max(),
+                    less_than(1e-6))
+
+
+class CascadeTest(unittest.TestCase):
+    def test_matches_full_composite(self):
+        full = CompositeSegmentationAlgorithm([
+            InPlaceMovingAverageBackgroundSubtractor(0.05),
+            HSVColourSegmenter()])
+        cascade = CompositeSegmentationAlgorithm([
+            HSVColourSegmenter(),
+            InPlaceMovingAverageBackgroundSubtractor(0.05)], cascade=True)
+        first_stage = InPlaceMovingAverageBackgroundSubtractor(0.05)
+
+        for frame in crossing_fish_frames(60, [0, 15]):
+            expected = full.segment(frame)
+            actual = cascade.segment(frame)
+
+            regions = candidate_regions(first_stage.segment(frame),
+                                        cascade.margin)
+            inside = np.zeros(expected.shape, bool)
+            for x, y, w, h in regions:
+                inside[y:y + h, x:x + w] = True
+            assert_that(np.array_equal(actual[inside], expected[inside]),
+                        equal_to(True))
+            assert_that(np.count_nonzero(actual[~inside]), equal_to(0))
+
+    def test_stateful_stage_caught_up_on_refresh(self):
+        alone = MovingAverageBackgroundSubtractor(0.05)
+        cascade = CompositeSegmentationAlgorithm([
+            InPlaceMovingAverageBackgroundSubtractor(0.05),
+            MovingAverageBackgroundSubtractor(0.05),
+            HSVColourSegmenter()], cascade=True, refresh_interval=10)
+        in_regions = cascade.algorithms[1]
+
+        for frame in crossing_fish_frames(50, [0, 15]):
+            alone.segment(frame)
+            cascade.segment(frame)
+
+        # Updated region by region between refreshes
+        assert_that(in_regions.last_updated is not None, equal_to(True))
+        # A fish's first few pixels at the edge of the frame can be missed
+        # by the first stage, and are caught up as if they had been
+        # background all along
+        difference = np.abs(in_regions.background - alone.background)
+        assert_that(np.count_nonzero(difference > 0.5),
+                    less_than(0.001 * difference.size))
+
+
+class SlowSegmenter(object):
+    cost = 1
+    stateful = False
+
+    def segment(self, current_image):
+        time.sleep(0.005)
+        return np.full(current_image.shape[:2], 255, np.uint8)
+
+
+class ThreadedCompositeTest(unittest.TestCase):
+    def create(self, threads):
+        # The colour mask comes first, and is shared through the frame
+        return CompositeSegmentationAlgorithm([
+            HSVColourSegmenter(),
+            InPlaceMovingAverageBackgroundSubtractor(0.05),
+            MovingAverageBackgroundSubtractor(0.05)], threads=threads)
+
+    def test_matches_sequential(self):
+        sequential = self.create(0)
+        threaded = self.create(3)
+
+        for image in crossing_fish_frames(60, [0, 15]):
+            expected = sequential.segment(Frame(image))
+            frame = Frame(image)
+            actual = threaded.segment(frame)
+
+            assert_that(np.array_equal(actual, expected), equal_to(True))
+            # The shared colour mask wasn't changed by combining the masks
+            assert_that(np.array_equal(HSVColourSegmenter().segment(frame),
+                                       HSVColourSegmenter().segment(image)),
+                        equal_to(True))
+        threaded.close()
+
+    def test_timing_report(self):
+        composite = CompositeSegmentationAlgorithm([
+            HSVColourSegmenter(), SlowSegmenter()], threads=2)
+        for image in moving_blob_frames(5):
+            composite.segment(image)
+        composite.close()
+
+        assert_that([timing.calls for timing in composite.timings],
+                    equal_to([5, 5]))
+        lines = composite.timing_report().split("\n")
+        assert_that(lines, has_length(3))
+        assert_that(lines[0].startswith("HSVColourSegmenter: "),
+                    equal_to(True))
+        assert_that(lines[1].startswith("SlowSegmenter: "), equal_to(True))
+        assert_that(lines[1].endswith(" ms/frame"), equal_to(True))
+        assert_that(lines[2], equal_to("Critical path: SlowSegmenter"))
+
+
+class EdgeBackgroundSubtractorTest(unittest.TestCase):
+    def assert_finds_only_moving_blob(self, subtractor):
+        rng = np.random.RandomState(1)
+        for frame in textured_blob_frames(30):
+            noise = rng.randint(-3, 4, frame.shape)
+            segmented = subtractor.segment(
+                np.clip(frame + noise, 0, 255).astype(np.uint8))
+
+        # The blob in the last frame is centred at (185, 120)
+        assert_that(segmented[120, 185], equal_to(255))
+
+        segmented[64:177, 128:243] = 0
+        assert_that(np.count_nonzero(segmented), equal_to(0))
+
+    def test_rejects_background_texture(self):
+        self.assert_finds_only_moving_blob(EdgeBackgroundSubtractor())
+
+    def test_reduced_edge_resolution(self):
+        self.assert_finds_only_moving_blob(
+            EdgeBackgroundSubtractor(edge_scale=0.5))
+
+
+class OpticalFlowSegmenterTest(unittest.TestCase):
+    def test_finds_moving_blob(self):
+        segmenter = OpticalFlowSegmenter()
+        for frame in textured_blob_frames(10):
+            segmented = segmenter.segment(frame)
+
+        # The blob in the last frame is centred at (85, 120)
+        assert_that(np.count_nonzero(segmented), greater_than(0))
+        segmented[96:145, 56:115] = 0
+        assert_that(np.count_nonzero(segmented), equal_to(0))
+
+    def test_only_looks_in_regions(self):
+        segmenter = OpticalFlowSegmenter()
+        for frame in textured_blob_frames(10):
+            segmented = segmenter.segment_regions(frame, [(200, 0, 120, 240)])
+
+        assert_that(np.count_nonzero(segmented), equal_to(0))
+
+    def test_caps_points_tracked(self):
+        segmenter = OpticalFlowSegmenter(max_points=5)
+        for frame in textured_blob_frames(3):
+            segmenter.segment(frame)
+
+        assert_that(segmenter.points_tracked, equal_to(5))
+
+    def test_budget_lowers_point_limit(self):
+        segmenter = OpticalFlowSegmenter(budget_seconds=0)
+        for frame in textured_blob_frames(3):
+            segmenter.segment(frame)
+
+        assert_that(segmenter.point_limit, less_than(2000))
+
+
+class PyramidSegmentationTest(unittest.TestCase):
+    def test_refines_around_moving_blob(self):
+        pyramid = PyramidSegmentationAlgorithm(
+            CompositeSegmentationAlgorithm([
+                InPlaceMovingAverageBackgroundSubtractor(0.2)]),
+            CompositeSegmentationAlgorithm([
+                MovingAverageBackgroundSubtractor(0.2)]),
+            levels=2, margin=16)
+
+        frames = moving_blob_frames(45, (240, 320))
+        for frame in frames:
+            segmented = pyramid.segment(frame)
+
+        # The blob in the last frame is centred at (230, 120)
+        assert_that(segmented[120, 230], equal_to(255))
+
+        segmented[80:160, 170:270] = 0
+        assert_that(np.count_nonzero(segmented), equal_to(0))
+
+
+class LookupTableColourSegmenterTest(unittest.TestCase):
+    def setUp(self):
+        self.image = cv2.imread(os.path.join(DATA_DIR, "fish_well_lit.jpg"))
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def assert_same_mask(self, hsv_segmenter, lut_segmenter):
+        expected = hsv_segmenter.segment(self.image)
+        actual = lut_segmenter.segment(self.image)
+        assert_that(np.array_equal(expected, actual), equal_to(True))
+
+    def test_matches_hsv_segmenter(self):
+        self.assert_same_mask(HSVColourSegmenter(),
+                              LookupTableColourSegmenter())
+
+    def test_rebuilt_when_thresholds_change(self):
+        hsv_segmenter = HSVColourSegmenter()
+        lut_segmenter = LookupTableColourSegmenter()
+        self.assert_same_mask(hsv_segmenter, lut_segmenter)
+
+        hsv_segmenter.val_min = lut_segmenter.val_min = 150
+        self.assert_same_mask(hsv_segmenter, lut_segmenter)
+
+    def test_table_cached_on_disk(self):
+        LookupTableColourSegmenter(cache_dir=self.cache_dir).segment(
+            self.image)
+        assert_that(os.listdir(self.cache_dir), has_length(1))
+
+        # A second segmenter loads the table rather than rebuilding it
+        cached = LookupTableColourSegmenter(cache_dir=self.cache_dir)
+        cached._build_table = None
+        self.assert_same_mask(HSVColourSegmenter(), cached)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import copy
+import unittest
+
+import numpy as np
+from hamcrest import assert_that
+from hamcrest import equal_to
+from hamcrest import greater_than
+
+from fishcounter.components import Blobs
+from fishcounter.tracking.shapefeatures import (ShapeFeatureTracker,
+                                                ShapeMatcher, blob_centres)
+from fishcounter.tracking.trackables import BoundingBox, TrackedObject
+
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+
+
+def random_blobs(rng, count):
+    bboxes = np.column_stack((rng.randint(-20, FRAME_WIDTH, count),
+                              rng.randint(-20, FRAME_HEIGHT, count),
+                              rng.randint(10, 80, count),
+                              rng.randint(10, 80, count))).astype(np.int32)
+    areas = rng.uniform(0, 1, count) * bboxes[:, 2] * bboxes[:, 3]
+    angles = rng.uniform(-45, 45, count)
+    empty = np.zeros(count, np.intp)
+    return Blobs(np.empty((0, 2), np.int32), empty, empty, bboxes, areas,
+                 np.zeros((count, 2)), np.zeros(count), angles)
+
+
+def random_objects(rng, count):
+    blobs = random_blobs(rng, count)
+    return [TrackedObject(BoundingBox(*blobs.bbox(index)),
+                          blobs.areas[index], blobs.angles[index], 1,
+                          FRAME_WIDTH, FRAME_HEIGHT)
+            for index in xrange(count)]
+
+
+def match_sequentially(matcher, blobs, frame_number, potential_objects,
+                       all_moving_objects, stationary_objects):
+    # One blob and one object at a time
+    for index in xrange(len(blobs)):
+        bbox = BoundingBox(*blobs.bbox(index))
+        area = blobs.areas[index]
+        angle = blobs.angles[index]
+        new_obj = TrackedObject(bbox, area, angle, frame_number,
+                                FRAME_WIDTH, FRAME_HEIGHT)
+
+        if matcher.has_match(new_obj, stationary_objects):
+            continue
+
+        matches = matcher.find_matches(new_obj, all_moving_objects)
+        if len(matches) == 0:
+            if new_obj.is_near_edge():
+                potential_objects.append(new_obj)
+        else:
+            for match in matches:
+                match.update(bbox, area, angle, frame_number)
+
+
+def state(obj):
+    return (obj.bbox.cv2rect, obj.area, obj.angle, obj.dx, obj.dy,
+            obj.frames_tracked, obj.last_frame_tracked)
+
+
+class ShapeMatcherTest(unittest.TestCase):
+    def test_match_matrix_matches_is_match(self):
+        rng = np.random.RandomState(0)
+        matcher = ShapeMatcher()
+        blobs = random_blobs(rng, 200)
+        objects = random_objects(rng, 150)
+
+        matrix = matcher.match_matrix(blob_centres(blobs.bboxes),
+                                      blobs.areas, blobs.angles, objects)
+
+        expected = np.zeros(matrix.shape, bool)
+        for index in xrange(len(blobs)):
+            new_obj = TrackedObject(BoundingBox(*blobs.bbox(index)),
+                                    blobs.areas[index], blobs.angles[index],
+                                    2, FRAME_WIDTH, FRAME_HEIGHT)
+            for object_index, obj in enumerate(objects):
+                expected[index, object_index] = matcher.is_match(new_obj, obj)
+
+        assert_that(np.count_nonzero(expected), greater_than(0))
+        assert_that(np.array_equal(matrix, expected), equal_to(True))
+
+    def test_no_objects(self):
+        matrix = ShapeMatcher().match_matrix(np.zeros((3, 2)), np.ones(3),
+                                             np.zeros(3), [])
+        assert_that(matrix.shape, equal_to((3, 0)))
+
+
+class ShapeFeatureTrackerTest(unittest.TestCase):
+    def test_matches_like_one_blob_at_a_time(self):
+        rng = np.random.RandomState(1)
+        tracker = ShapeFeatureTracker()
+
+        for _ in xrange(20):
+            blobs = random_blobs(rng, 60)
+            potential = random_objects(rng, 30)
+            moving = random_objects(rng, 30)
+            stationary = random_objects(rng, 10)
+
+            expected = copy.deepcopy((potential, moving, stationary))
+            match_sequentially(tracker.matcher, blobs, 2, expected[0],
+                               expected[0] + expected[1], expected[2])
+
+            tracker._match_blobs(blobs, 2, FRAME_WIDTH, FRAME_HEIGHT,
+                                 potential, potential + moving, stationary)
+
+            for objects, expected_objects in zip((potential, moving,
+                                                  stationary), expected):
+                assert_that(map(state, objects),
+                            equal_to(map(state, expected_objects)))
+
+
+if __name__ == "__main__":
+    unittest.main()
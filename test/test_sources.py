@@ -0,0 +1,239 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+from hamcrest import assert_that
+from hamcrest import equal_to
+from hamcrest import instance_of
+
+from fishcounter.sources import (LiveSource, NumpySource, RawFrameSource,
+                                 open_source, parse_frame_size)
+from fishcounter.videoreader import VideoReader
+
+WIDTH = 8
+HEIGHT = 6
+
+
+def numbered_frames(num_frames):
+    """
+    Frames filled with their own number.
+    """
+    frames = np.empty((num_frames, HEIGHT, WIDTH, 3), np.uint8)
+    for number, frame in enumerate(frames):
+        frame.fill(number)
+    return frames
+
+
+def read_all(source):
+    frames = []
+    frame_was_read, image = source.read()
+    while frame_was_read:
+        frames.append(image.copy())
+        frame_was_read, image = source.read()
+    return frames
+
+
+class RecordingAnalyzer(object):
+    def __init__(self):
+        self.numbers = []
+
+    def analyze(self, previous_image, current_image):
+        self.numbers.append(current_image[0, 0, 0])
+
+
+class ParseFrameSizeTest(unittest.TestCase):
+    def test_width_by_height(self):
+        assert_that(parse_frame_size("1920X1080"), equal_to((1920, 1080)))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_frame_size, "1920")
+        self.assertRaises(ValueError, parse_frame_size, "1920xabc")
+
+
+class SourceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.frames = numbered_frames(20)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+
+class RawFrameSourceTest(SourceTestCase):
+    def test_round_trip(self):
+        path = self.path("clip.raw")
+        self.frames.tofile(path)
+
+        source = RawFrameSource(path, WIDTH, HEIGHT)
+        frames = read_all(source)
+        source.release()
+
+        assert_that(np.array_equal(frames, self.frames), equal_to(True))
+        assert_that(source.is_live, equal_to(False))
+
+    def test_decodes_into_image_given(self):
+        path = self.path("clip.raw")
+        self.frames.tofile(path)
+        image = np.empty((HEIGHT, WIDTH, 3), np.uint8)
+
+        source = RawFrameSource(path, WIDTH, HEIGHT)
+        source.read(image)
+        frame_was_read, frame = source.read(image)
+        source.release()
+
+        assert_that(frame is image, equal_to(True))
+        assert_that(np.array_equal(frame, self.frames[1]), equal_to(True))
+
+    def test_partial_frame_at_end_discarded(self):
+        path = self.path("clip.raw")
+        with open(path, "wb") as raw_file:
+            raw_file.write(self.frames[:3].tostring())
+            raw_file.write(self.frames[3].tostring()[:10])
+
+        source = RawFrameSource(path, WIDTH, HEIGHT)
+        frames = read_all(source)
+        source.release()
+
+        assert_that(len(frames), equal_to(3))
+
+
+class NumpySourceTest(SourceTestCase):
+    def test_round_trip(self):
+        path = self.path("clip.npy")
+        np.save(path, self.frames)
+
+        source = NumpySource(path)
+
+        assert_that(source.frame_count, equal_to(20))
+        assert_that(np.array_equal(read_all(source), self.frames),
+                    equal_to(True))
+
+    def test_seek(self):
+        path = self.path("clip.npy")
+        np.save(path, self.frames)
+
+        source = NumpySource(path)
+        assert_that(source.seek(12), equal_to(12))
+        _, frame = source.read()
+
+        assert_that(np.array_equal(frame, self.frames[12]), equal_to(True))
+
+
+class OpenSourceTest(SourceTestCase):
+    def test_npy(self):
+        path = self.path("clip.npy")
+        np.save(path, self.frames)
+
+        assert_that(open_source(path), instance_of(NumpySource))
+
+    def test_raw(self):
+        path = self.path("clip.raw")
+        self.frames.tofile(path)
+
+        source = open_source(path, raw_size=(WIDTH, HEIGHT))
+
+        assert_that(source, instance_of(RawFrameSource))
+        source.release()
+
+    def test_raw_forced_live(self):
+        path = self.path("clip.raw")
+        self.frames.tofile(path)
+
+        source = open_source(path, raw_size=(WIDTH, HEIGHT), live=True)
+
+        assert_that(source, instance_of(LiveSource))
+        source.release()
+
+    def test_standard_input_needs_frame_size(self):
+        self.assertRaises(ValueError, open_source, "-")
+
+
+class LiveSourceTest(SourceTestCase):
+    """
+    Feeds a raw clip through a FIFO, as a camera piped through ffmpeg
+    would be.
+    """
+
+    def setUp(self):
+        super(LiveSourceTest, self).setUp()
+        self.fifo = self.path("camera.fifo")
+        os.mkfifo(self.fifo)
+
+        # Opening a FIFO blocks until the other end is opened too
+        self.writer = threading.Thread(target=self._write_clip)
+        self.writer.start()
+
+    def tearDown(self):
+        self.writer.join()
+        super(LiveSourceTest, self).tearDown()
+
+    def _write_clip(self):
+        with open(self.fifo, "wb") as fifo:
+            fifo.write(self.frames.tostring())
+
+    def open_live(self, buffer_size):
+        source = open_source(self.fifo, raw_size=(WIDTH, HEIGHT),
+                             buffer_size=buffer_size)
+        assert_that(source, instance_of(LiveSource))
+        return source
+
+    def test_frames_arrive_in_order(self):
+        source = self.open_live(buffer_size=20)
+
+        frames = read_all(source)
+        source.release()
+
+        assert_that(np.array_equal(frames, self.frames), equal_to(True))
+        assert_that(source.frames_dropped, equal_to(0))
+
+    def test_slow_consumer_drops_oldest_frames(self):
+        source = self.open_live(buffer_size=3)
+        # Not reading anything until the whole clip has arrived
+        self.writer.join()
+        source._reader.join()
+
+        frames = read_all(source)
+        source.release()
+
+        assert_that(source.frames_dropped, equal_to(17))
+        assert_that(np.array_equal(frames, self.frames[-3:]),
+                    equal_to(True))
+
+    def test_end_of_stream_ends_run(self):
+        analyzer = RecordingAnalyzer()
+        reader = VideoReader(self.open_live(buffer_size=20), analyzer,
+                             headless=True)
+        reader.start()
+        reader.source.release()
+
+        assert_that(analyzer.numbers, equal_to(range(1, 20)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import os
+import unittest
+
+import cv2
+import numpy as np
+from hamcrest import assert_that
+from hamcrest import equal_to
+
+from fishcounter.components import find_blobs
+from fishcounter.segment import HSVColourSegmenter
+from fishcounter.tiling import Tiler
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+
+
+class TilerTest(unittest.TestCase):
+    def setUp(self):
+        image = cv2.imread(os.path.join(DATA_DIR, "fish_well_lit.jpg"))
+        # Odd sizes so the tiles are uneven
+        self.image = cv2.resize(image, (1283, 721))
+        self.tiler = Tiler(3, 2)
+
+    def tearDown(self):
+        self.tiler.close()
+
+    def test_tiles_cover_image(self):
+        covered = np.zeros((721, 1283), np.int32)
+        for (x, y, w, h), _ in self.tiler.tiles(covered.shape, 40):
+            covered[y:y + h, x:x + w] += 1
+
+        assert_that((covered == 1).all(), equal_to(True))
+
+    def test_colour_segmentation_matches_untiled(self):
+        expected = HSVColourSegmenter().segment(self.image)
+        actual = HSVColourSegmenter(tiler=self.tiler).segment(self.image)
+
+        assert_that(np.array_equal(actual, expected), equal_to(True))
+
+    def test_blobs_match_untiled(self):
+        mask = HSVColourSegmenter().segment(self.image)
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+        expected = find_blobs(mask.copy(), kernel, 100, headless=True)
+        actual = find_blobs(mask.copy(), kernel, 100, headless=True,
+                            tiler=self.tiler)
+
+        assert_that(len(actual), equal_to(len(expected)))
+        assert_that(np.array_equal(actual.points, expected.points),
+                    equal_to(True))
+        assert_that(np.array_equal(actual.bboxes, expected.bboxes),
+                    equal_to(True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,356 @@
+# Copyright (C) 2013 David Rusk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+from hamcrest import assert_that
+from hamcrest import equal_to
+from hamcrest import greater_than
+from hamcrest import less_than_or_equal_to
+
+from fishcounter.sources import CaptureSource, FrameSource, StackSource
+from fishcounter.videoreader import (BlockVideoReader, FrameRing,
+                                     PrefetchingVideoReader, VideoReader,
+                                     parse_timestamp)
+from synthetic import crossing_fish_frames, write_clip
+
+
+class CountingSource(FrameSource):
+    """
+    Frames filled with their own number, decoded into the buffer given.
+    """
+
+    def __init__(self, num_frames):
+        self.num_frames = num_frames
+        self.position = 0
+
+    def read(self, image=None):
+        if self.position >= self.num_frames:
+            return False, None
+        if image is None:
+            image = np.empty((4, 4, 3), np.uint8)
+        image.fill(self.position)
+        self.position += 1
+        return True, image
+
+
+class RecordingAnalyzer(object):
+    def __init__(self):
+        self.block_sizes = []
+        self.pairs = []
+
+    def prepare_block(self, images):
+        self.block_sizes.append(len(images))
+
+    def analyze(self, previous_image, current_image):
+        self.pairs.append((previous_image[0, 0, 0], current_image[0, 0, 0]))
+
+
+class HoldingAnalyzer(RecordingAnalyzer):
+    """
+    Checks that both frames it is given stay intact while it works on
+    them, giving a prefetching decoder time to run ahead.
+    """
+
+    def __init__(self):
+        super(HoldingAnalyzer, self).__init__()
+        self.buffer_ids = set()
+        self.intact = True
+
+    def analyze(self, previous_image, current_image):
+        expected = (previous_image.copy(), current_image.copy())
+        time.sleep(0.002)
+        self.intact &= (np.array_equal(previous_image, expected[0]) and
+                        np.array_equal(current_image, expected[1]))
+
+        self.buffer_ids.add(id(current_image))
+        super(HoldingAnalyzer, self).analyze(previous_image, current_image)
+
+
+class SlowSource(CountingSource):
+    def read(self, image=None):
+        time.sleep(0.002)
+        return super(SlowSource, self).read(image)
+
+
+class FailingAnalyzer(RecordingAnalyzer):
+    def analyze(self, previous_image, current_image):
+        super(FailingAnalyzer, self).analyze(previous_image, current_image)
+        if len(self.pairs) == 5:
+            raise RuntimeError("Analysis failed")
+
+
+def decoder_threads():
+    return [thread for thread in threading.enumerate()
+            if thread.name == "frame-decoder"]
+
+
+def run_in_thread(reader, timeout=10, **kwargs):
+    """
+    Runs a reader, failing rather than hanging if it deadlocks.
+    """
+    thread = threading.Thread(target=reader.start, kwargs=kwargs)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    assert_that(thread.is_alive(), equal_to(False))
+
+
+class ParseTimestampTest(unittest.TestCase):
+    def test_seconds_only(self):
+        assert_that(parse_timestamp("42"), equal_to(42))
+
+    def test_minutes_and_seconds(self):
+        assert_that(parse_timestamp("02:30.5"), equal_to(150.5))
+
+    def test_hours_minutes_seconds(self):
+        assert_that(parse_timestamp("01:20:00"), equal_to(4800))
+
+    def test_too_many_fields(self):
+        self.assertRaises(ValueError, parse_timestamp, "1:01:20:00")
+
+
+class OvershootingCapture(object):
+    """
+    Wraps a VideoCapture to report landing past the frame asked for, as
+    backends which can only seek to keyframes may.
+    """
+
+    def __init__(self, capture):
+        self.capture = capture
+        self.overshoot = 3
+
+    def set(self, property_id, value):
+        return self.capture.set(property_id, value + self.overshoot)
+
+    def __getattr__(self, name):
+        return getattr(self.capture, name)
+
+
+class SeekTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "fish.avi")
+        write_clip(self.path, crossing_fish_frames(40, [0]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def sequential_frame(self, frame_number):
+        reader = VideoReader(self.path, None, headless=True)
+        for _ in xrange(frame_number + 1):
+            _, image = reader.source.read()
+        return image
+
+    def seeked_frame(self, reader, frame_number):
+        reader.seek(frame_number)
+        _, image = reader._read_frame()
+        assert_that(reader.frame_number, equal_to(frame_number))
+        return image
+
+    def test_seek_video_file(self):
+        reader = VideoReader(self.path, None, headless=True)
+
+        for frame_number in [25, 10]:
+            assert_that(np.array_equal(self.seeked_frame(reader,
+                                                         frame_number),
+                                       self.sequential_frame(frame_number)),
+                        equal_to(True))
+
+    def test_seek_reopens_after_overshoot(self):
+        source = CaptureSource(self.path)
+        source.capture = OvershootingCapture(source.capture)
+        reader = VideoReader(source, None, headless=True)
+
+        assert_that(np.array_equal(self.seeked_frame(reader, 25),
+                                   self.sequential_frame(25)),
+                    equal_to(True))
+
+    def test_seek_by_grabbing(self):
+        # CountingSource can't seek, so the reader grabs its way forward
+        reader = VideoReader(CountingSource(40), None, headless=True)
+
+        assert_that(self.seeked_frame(reader, 25)[0, 0, 0], equal_to(25))
+        self.assertRaises(ValueError, reader.seek, 10)
+
+    def test_seek_stack(self):
+        frames = np.arange(40, dtype=np.uint8).reshape(40, 1, 1, 1)
+        reader = VideoReader(StackSource(frames), None, headless=True)
+
+        assert_that(self.seeked_frame(reader, 25)[0, 0, 0], equal_to(25))
+        assert_that(self.seeked_frame(reader, 10)[0, 0, 0], equal_to(10))
+
+
+class FrameRingTest(unittest.TestCase):
+    def test_borrow_before_allocation(self):
+        assert_that(FrameRing(2).borrow(), equal_to(None))
+
+    def test_buffers_reused(self):
+        ring = FrameRing(2)
+        ring.allocate((4, 4, 3), np.uint8)
+        first = ring.borrow()
+        second = ring.borrow()
+        ring.release(first)
+
+        assert_that(ring.borrow() is first, equal_to(True))
+        # Allocating again keeps the same buffers
+        ring.allocate((4, 4, 3), np.uint8)
+        ring.release(second)
+        assert_that(ring.borrow() is second, equal_to(True))
+
+    def test_foreign_images_ignored(self):
+        ring = FrameRing(2)
+        ring.allocate((4, 4, 3), np.uint8)
+        ring.borrow()
+        ring.release(np.empty((4, 4, 3), np.uint8))
+        ring.borrow()
+
+        assert_that(ring._free.empty(), equal_to(True))
+
+
+class RingVideoReaderTest(unittest.TestCase):
+    def test_frames_decoded_into_ring(self):
+        analyzer = HoldingAnalyzer()
+        reader = VideoReader(CountingSource(20), analyzer, headless=True,
+                             ring_size=2)
+        reader.start()
+
+        ring_ids = set(id(buf) for buf in reader.ring._buffers)
+        assert_that(len(ring_ids), equal_to(2))
+        # The first frame is read before the ring is allocated
+        assert_that(analyzer.buffer_ids, equal_to(ring_ids))
+
+    def test_previous_frame_intact(self):
+        analyzer = HoldingAnalyzer()
+        reader = VideoReader(CountingSource(20), analyzer, headless=True,
+                             ring_size=2)
+        reader.start()
+
+        assert_that(analyzer.intact, equal_to(True))
+        assert_that(analyzer.pairs,
+                    equal_to([(n, n + 1) for n in xrange(19)]))
+
+    def test_ring_needs_two_buffers(self):
+        self.assertRaises(ValueError, VideoReader, CountingSource(2), None,
+                          ring_size=1)
+
+    def test_prefetching_ring_holds_queue(self):
+        # The analyzer's two frames, the queue and the frame being decoded
+        reader = PrefetchingVideoReader(CountingSource(2), None, depth=4,
+                                        ring_size=2)
+        assert_that(reader.ring.size, equal_to(7))
+
+    def test_prefetching_frames_intact(self):
+        analyzer = HoldingAnalyzer()
+        reader = PrefetchingVideoReader(CountingSource(40), analyzer,
+                                        headless=True, depth=4, ring_size=2)
+        run_in_thread(reader)
+
+        assert_that(analyzer.intact, equal_to(True))
+        assert_that(analyzer.pairs,
+                    equal_to([(n, n + 1) for n in xrange(39)]))
+        assert_that(len(analyzer.buffer_ids),
+                    less_than_or_equal_to(reader.ring.size))
+        # There are enough buffers for the decoder to fill the queue while
+        # the analyzer holds its frames
+        assert_that(reader.stats.decoder_stalls, greater_than(0))
+
+
+class PrefetchingVideoReaderTest(unittest.TestCase):
+    def test_same_frames_as_plain_reader(self):
+        plain = RecordingAnalyzer()
+        VideoReader(CountingSource(50), plain, headless=True).start(skip=3)
+        prefetched = RecordingAnalyzer()
+        reader = PrefetchingVideoReader(CountingSource(50), prefetched,
+                                        headless=True, depth=3)
+        run_in_thread(reader, skip=3)
+
+        assert_that(prefetched.pairs, equal_to(plain.pairs))
+        assert_that(len(prefetched.pairs), equal_to(46))
+
+    def test_statistics_when_analysis_is_slow(self):
+        reader = PrefetchingVideoReader(CountingSource(40), HoldingAnalyzer(),
+                                        headless=True, depth=4)
+        run_in_thread(reader)
+
+        stats = reader.stats
+        # Every frame and the end of the video
+        assert_that(stats.frames_read, equal_to(41))
+        assert_that(stats.decoder_stalls, greater_than(0))
+        assert_that(stats.mean_queue_depth, greater_than(1))
+
+    def test_statistics_when_decoding_is_slow(self):
+        reader = PrefetchingVideoReader(SlowSource(20), RecordingAnalyzer(),
+                                        headless=True, depth=4)
+        run_in_thread(reader)
+
+        stats = reader.stats
+        assert_that(stats.frames_read, equal_to(21))
+        assert_that(stats.analyzer_stalls, greater_than(0))
+        assert_that(stats.decoder_stalls, equal_to(0))
+
+    def test_decoder_joined_when_analyzer_raises(self):
+        analyzer = FailingAnalyzer()
+        reader = PrefetchingVideoReader(CountingSource(1000), analyzer,
+                                        headless=True, depth=2, ring_size=2)
+
+        self.assertRaises(RuntimeError, reader.start)
+        assert_that(decoder_threads(), equal_to([]))
+
+    def test_decoder_joined_at_stop_frame(self):
+        analyzer = RecordingAnalyzer()
+        reader = PrefetchingVideoReader(CountingSource(1000), analyzer,
+                                        headless=True, depth=2)
+        run_in_thread(reader, stop=10)
+
+        assert_that(analyzer.pairs,
+                    equal_to([(n, n + 1) for n in xrange(9)]))
+        assert_that(decoder_threads(), equal_to([]))
+
+
+class BlockVideoReaderTest(unittest.TestCase):
+    def test_frames_analyzed_in_order(self):
+        analyzer = RecordingAnalyzer()
+        reader = BlockVideoReader(CountingSource(10), analyzer, headless=True,
+                                  block_size=3)
+        reader.start(skip=0, stop=8)
+
+        assert_that(analyzer.block_sizes, equal_to([3, 3, 1]))
+        assert_that(analyzer.pairs,
+                    equal_to([(n, n + 1) for n in xrange(7)]))
+
+    def test_ends_with_video(self):
+        analyzer = RecordingAnalyzer()
+        reader = BlockVideoReader(CountingSource(7), analyzer, headless=True,
+                                  block_size=3)
+        reader.start()
+
+        assert_that(analyzer.block_sizes, equal_to([3, 3]))
+        assert_that(len(analyzer.pairs), equal_to(6))
+
+
+if __name__ == "__main__":
+    unittest.main()